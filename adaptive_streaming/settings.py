@@ -45,6 +45,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'streaming.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -53,6 +54,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'streaming.profiling.ProfilingMiddleware',
 ]
 
 CSRF_TRUSTED_ORIGINS = [
@@ -100,6 +102,36 @@ CELERY_ACCEPT_CONTENT = ['application/json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
+# Results are only polled shortly after a task finishes; without a TTL they pile up in Redis.
+CELERY_RESULT_EXPIRES = int(os.getenv('CELERY_RESULT_EXPIRES', 3600))
+CELERY_BEAT_SCHEDULE = {
+    'flush-popularity-counters': {
+        'task': 'streaming.tasks.flush_popularity_counters',
+        'schedule': float(os.getenv('POPULARITY_FLUSH_INTERVAL', 60)),
+    },
+    'refresh-hot-set': {
+        'task': 'streaming.tasks.refresh_hot_set',
+        'schedule': float(os.getenv('POPULARITY_PREWARM_INTERVAL', 300)),
+    },
+    'ingest-experiment-results': {
+        'task': 'streaming.tasks.ingest_experiment_results',
+        'schedule': float(os.getenv('EXPERIMENTS_INGEST_INTERVAL', 30)),
+    },
+    'advance-reencode-batches': {
+        'task': 'streaming.tasks.advance_reencode_batches',
+        'schedule': float(os.getenv('REENCODE_ADVANCE_INTERVAL', 30)),
+    },
+    'collect-storage-garbage': {
+        'task': 'streaming.tasks.collect_storage_garbage',
+        'schedule': float(os.getenv('STORAGE_GC_INTERVAL', 3600)),
+    },
+    # Scratch directories live on the encoding host, so this one goes to the encoding queue.
+    'collect-scratch-garbage': {
+        'task': 'streaming.tasks.collect_scratch_garbage',
+        'schedule': float(os.getenv('STORAGE_GC_INTERVAL', 3600)),
+        'options': {'queue': 'video_encoding'},
+    },
+}
 
 # Optional: Redis Cache Configuration
 CACHES = {
@@ -111,6 +143,111 @@ CACHES = {
 
 REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
 
+# Resumable chunked uploads
+UPLOAD_MAX_SIZE = int(os.getenv('UPLOAD_MAX_SIZE', 20 * 1024 ** 3))
+UPLOAD_CHUNK_MAX_SIZE = int(os.getenv('UPLOAD_CHUNK_MAX_SIZE', 64 * 1024 ** 2))
+UPLOAD_PROBE_BYTES = int(os.getenv('UPLOAD_PROBE_BYTES', 4 * 1024 ** 2))
+UPLOAD_PROBE_TIMEOUT = int(os.getenv('UPLOAD_PROBE_TIMEOUT', 15))
+
+# Encode admission and scheduling. Costs are in rung-seconds (source seconds x ladder rungs).
+ENCODE_MAX_IN_FLIGHT = int(os.getenv('ENCODE_MAX_IN_FLIGHT', 1))
+ENCODE_BACKLOG_BUDGET = float(os.getenv('ENCODE_BACKLOG_BUDGET', 4 * 3600 * 4))
+ENCODE_FAIRNESS_WINDOW = int(os.getenv('ENCODE_FAIRNESS_WINDOW', 24 * 3600))
+ENCODE_DISPATCH_TIMEOUT = int(os.getenv('ENCODE_DISPATCH_TIMEOUT', 3600))
+ENCODE_JOB_TIMEOUT = int(os.getenv('ENCODE_JOB_TIMEOUT', 12 * 3600))
+ENCODE_BACKPRESSURE_RETRY_AFTER = int(os.getenv('ENCODE_BACKPRESSURE_RETRY_AFTER', 300))
+
+# Cores available to one encode; 0 detects them from the CPU affinity and cgroup quota. Rungs get
+# threads by resolution and are encoded side by side within this budget, so keep the encoding
+# worker at --concurrency=1 (or set this to the host's cores divided by the concurrency).
+ENCODE_CPUS = int(os.getenv('ENCODE_CPUS', 0))
+
+# Codec matrix: codecs are added in order while a video's estimated encode cost stays within budget.
+ENCODE_DEFAULT_CODECS = os.getenv('ENCODE_DEFAULT_CODECS', 'vp9,h264,av1').split(',')
+ENCODE_CODEC_BUDGET = float(os.getenv('ENCODE_CODEC_BUDGET', 3600 * 4 * 2))
+
+# Segment durations in seconds: the first ENCODE_STARTUP_SEGMENTS segments of every rendition are
+# short so playback starts after a small download, the rest are ENCODE_SEGMENT_DURATION long.
+ENCODE_SEGMENT_DURATION = float(os.getenv('ENCODE_SEGMENT_DURATION', 4))
+ENCODE_STARTUP_SEGMENT_DURATION = float(os.getenv('ENCODE_STARTUP_SEGMENT_DURATION', 1))
+ENCODE_STARTUP_SEGMENTS = int(os.getenv('ENCODE_STARTUP_SEGMENTS', 3))
+
+# DASH packaging: 'segments' writes a file per segment, 'on_demand' a single indexed file per rendition
+# that is served by byte range, with SegmentList manifests of any segment duration built per request.
+ENCODE_PACKAGING = os.getenv('ENCODE_PACKAGING', 'segments')
+DASH_SEGMENT_DURATIONS = [float(d) for d in os.getenv('DASH_SEGMENT_DURATIONS', '2,4,6,8,12').split(',')]
+DASH_MANIFEST_CACHE_TIMEOUT = int(os.getenv('DASH_MANIFEST_CACHE_TIMEOUT', 3600))
+
+# Search results: ranked ids are kept in the task result, rows are cached per video.
+SEARCH_MAX_RESULTS = int(os.getenv('SEARCH_MAX_RESULTS', 100))
+SEARCH_ROW_CACHE_TIMEOUT = int(os.getenv('SEARCH_ROW_CACHE_TIMEOUT', 300))
+SEARCH_STATUS_MAX_TASKS = int(os.getenv('SEARCH_STATUS_MAX_TASKS', 50))
+
+# Encoder scratch space. An encode only starts once its root has room for its estimated outputs
+# plus ENCODE_SCRATCH_HEADROOM; until then it is retried every ENCODE_SCRATCH_RETRY_DELAY seconds for up
+# to ENCODE_SCRATCH_WAIT seconds, without holding the worker. Encodes estimated at up to
+# ENCODE_SCRATCH_TMPFS_MAX_BYTES use the RAM-backed ENCODE_SCRATCH_TMPFS_DIR (e.g. /dev/shm) if set.
+ENCODE_SCRATCH_DIR = os.getenv('ENCODE_SCRATCH_DIR', '/tmp')
+ENCODE_SCRATCH_TMPFS_DIR = os.getenv('ENCODE_SCRATCH_TMPFS_DIR', '')
+ENCODE_SCRATCH_TMPFS_MAX_BYTES = int(os.getenv('ENCODE_SCRATCH_TMPFS_MAX_BYTES', 2 * 1024 ** 3))
+ENCODE_SCRATCH_HEADROOM = int(os.getenv('ENCODE_SCRATCH_HEADROOM', 1024 ** 3))
+ENCODE_SCRATCH_WAIT = int(os.getenv('ENCODE_SCRATCH_WAIT', 600))
+ENCODE_SCRATCH_RETRY_DELAY = int(os.getenv('ENCODE_SCRATCH_RETRY_DELAY', 60))
+
+# Storage garbage collector: reclaims what killed encodes, deleted videos and abandoned uploads leave
+# behind. Nothing younger than STORAGE_GC_GRACE seconds is touched.
+STORAGE_GC_GRACE = int(os.getenv('STORAGE_GC_GRACE', 3600))
+STORAGE_GC_UPLOAD_TTL = int(os.getenv('STORAGE_GC_UPLOAD_TTL', 7 * 24 * 3600))
+
+# View popularity: manifest fetches are counted in Redis; trending videos get their first segments
+# pre-warmed into the cache, videos that drop out of the hot set are evicted.
+POPULARITY_TRENDING_WINDOW = int(os.getenv('POPULARITY_TRENDING_WINDOW', 24))
+POPULARITY_HALF_LIFE = float(os.getenv('POPULARITY_HALF_LIFE', 6))
+POPULARITY_HOT_SET_SIZE = int(os.getenv('POPULARITY_HOT_SET_SIZE', 20))
+POPULARITY_HOT_MIN_SCORE = float(os.getenv('POPULARITY_HOT_MIN_SCORE', 3))
+POPULARITY_PREWARM_SEGMENTS = int(os.getenv('POPULARITY_PREWARM_SEGMENTS', 3))
+POPULARITY_PREWARM_MAX_BYTES = int(os.getenv('POPULARITY_PREWARM_MAX_BYTES', 8 * 1024 ** 2))
+POPULARITY_PREWARM_TIMEOUT = int(os.getenv('POPULARITY_PREWARM_TIMEOUT', 3 * 3600))
+
+# Network emulation results (written by experiments/runner.js, relative to this directory)
+EXPERIMENTS_DIR = os.getenv('EXPERIMENTS_DIR', str(BASE_DIR / 'experiments'))
+EXPERIMENT_MAX_DURATION = int(os.getenv('EXPERIMENT_MAX_DURATION', 600))
+EXPERIMENT_MAX_SWEEP_JOBS = int(os.getenv('EXPERIMENT_MAX_SWEEP_JOBS', 5000))
+# Runners heartbeat every 10s; a runner silent for longer than this loses its queued jobs to the others.
+EXPERIMENT_RUNNER_TTL = int(os.getenv('EXPERIMENT_RUNNER_TTL', 30))
+EXPERIMENT_JOB_TIMEOUT = int(os.getenv('EXPERIMENT_JOB_TIMEOUT', 24 * 3600))
+
+# Real-viewer QoE beacons: appended to a Redis stream and folded into per-minute buckets by
+# `python manage.py consume_beacons`.
+QOE_BEACON_MAX_BYTES = int(os.getenv('QOE_BEACON_MAX_BYTES', 64 * 1024))
+QOE_BEACON_INTERVAL = int(os.getenv('QOE_BEACON_INTERVAL', 10))
+QOE_STREAM_MAXLEN = int(os.getenv('QOE_STREAM_MAXLEN', 1000000))
+QOE_ROLLING_WINDOW = int(os.getenv('QOE_ROLLING_WINDOW', 60))
+# Players' throughput estimates are also kept per client and network for this long, and served as
+# the starting bandwidth estimate of their next sessions.
+QOE_BANDWIDTH_HINT_TTL = int(os.getenv('QOE_BANDWIDTH_HINT_TTL', 24 * 3600))
+
+# Live ingest (python manage.py live_ingest)
+LIVE_SEGMENT_DURATION = float(os.getenv('LIVE_SEGMENT_DURATION', 2))
+LIVE_FRAGMENT_DURATION = float(os.getenv('LIVE_FRAGMENT_DURATION', 0.5))
+LIVE_TARGET_LATENCY = float(os.getenv('LIVE_TARGET_LATENCY', 3))
+LIVE_MAX_HEIGHT = int(os.getenv('LIVE_MAX_HEIGHT', 720))
+LIVE_UTC_TIMING_URL = os.getenv('LIVE_UTC_TIMING_URL', 'http://localhost:8000/live/time/')
+
+# Port of the Prometheus exporter of a Celery worker container; 0 starts none. The web container
+# serves its metrics at /metrics.
+METRICS_EXPORTER_PORT = int(os.getenv('METRICS_EXPORTER_PORT', 0))
+
+# On-demand profiling of views and Celery tasks
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', '1') == '1'
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', 0.0))
+PROFILING_TASK_SAMPLE_RATE = float(os.getenv('PROFILING_TASK_SAMPLE_RATE', 0.0))
+PROFILING_HEADER = os.getenv('PROFILING_HEADER', 'X-Profile')
+PROFILING_TOKEN_MAX_AGE = int(os.getenv('PROFILING_TOKEN_MAX_AGE', 3600))
+PROFILING_DIR = os.getenv('PROFILING_DIR', str(BASE_DIR / 'profiles'))
+PROFILING_MAX_PROFILES = int(os.getenv('PROFILING_MAX_PROFILES', 500))
+PROFILING_MAX_BYTES = int(os.getenv('PROFILING_MAX_BYTES', 256 * 1024 ** 2))
+
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
 
@@ -0,0 +1,11 @@
+#!/bin/sh
+set -e
+
+# Metric files of a previous run belong to processes that no longer exist; left in place, their
+# counters would be added to the new ones.
+if [ -n "$PROMETHEUS_MULTIPROC_DIR" ]; then
+    rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+    mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+fi
+
+exec "$@"
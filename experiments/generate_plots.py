@@ -1,13 +1,11 @@
 import sys
 import json
-import math
 import glob
 from pathlib import Path
 import matplotlib.pyplot as plt
 
-def clamp(x, lo, hi):
-    return max(lo, min(hi, x))
-
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from streaming.qoe import run_metrics  # noqa: E402
 
 def step_series_from_switches(t_rel, y):
     if not t_rel:
@@ -15,70 +13,6 @@ def step_series_from_switches(t_rel, y):
     return t_rel, y
 
 
-def compute_time_weighted_avg_bitrate_kbps(switch_history, fallback_play_time_s):
-    if not switch_history:
-        return None
-
-    pts = []
-    for s in switch_history:
-        if "timestamp" in s and "bandwidth" in s:
-            pts.append((float(s["timestamp"]), float(s["bandwidth"])))
-    pts.sort(key=lambda x: x[0])
-
-    if len(pts) == 1:
-        return pts[0][1] / 1000.0  # kbps
-
-    total_dur = pts[-1][0] - pts[0][0]
-    if total_dur <= 0 and fallback_play_time_s:
-        total_dur = float(fallback_play_time_s)
-
-    if total_dur and total_dur > 0:
-        acc = 0.0
-        for i in range(len(pts)):
-            t_i, bw_i = pts[i]
-            t_next = pts[i + 1][0] if i + 1 < len(pts) else (pts[0][0] + total_dur)
-            dt = max(0.0, t_next - t_i)
-            acc += dt * bw_i
-        return (acc / total_dur) / 1000.0  # kbps
-
-    return (sum(bw for _, bw in pts) / len(pts)) / 1000.0
-
-
-def estimate_stalls_from_state_history(state_history):
-    if not state_history:
-        return None, 0, 0.0, 0.0
-
-    buffering = [x for x in state_history if x.get("state") == "buffering"]
-    total_buffering = sum(float(x.get("duration", 0.0)) for x in buffering)
-
-    startup = float(buffering[0].get("duration", 0.0)) if buffering else None
-    stall_chunks = buffering[1:] if len(buffering) > 1 else []
-    stall_time = sum(float(x.get("duration", 0.0)) for x in stall_chunks)
-    stall_count = len(stall_chunks)
-
-    return startup, stall_count, stall_time, total_buffering
-
-
-def qoe_mos_proxy(startup_s, stall_time_s, stall_count, switch_count, avg_bitrate_kbps, dropped_frames):
-    startup_s = float(startup_s) if startup_s is not None else 0.0
-    stall_time_s = float(stall_time_s or 0.0)
-    stall_count = int(stall_count or 0)
-    switch_count = int(switch_count or 0)
-    dropped_frames = int(dropped_frames or 0)
-
-    if avg_bitrate_kbps is None:
-        bitrate_term = 0.0
-    else:
-        bitrate_term = 0.6 * math.log10(1.0 + (avg_bitrate_kbps / 300.0))
-
-    startup_pen = 0.35 * startup_s
-    stall_pen = 2.2 * stall_time_s + 0.8 * stall_count
-    switch_pen = 0.06 * switch_count
-    drop_pen = 0.02 * dropped_frames
-
-    mos = 5.0 + bitrate_term - startup_pen - stall_pen - switch_pen - drop_pen
-    return clamp(mos, 0.0, 5.0)
-
 def generate_plots(path):
     json_path = Path(path)
     if not json_path.exists():
@@ -98,23 +32,17 @@ def generate_plots(path):
     stats = data.get("shakaStatsSnapshot", {}) or {}
     state_history = stats.get("stateHistory", []) or []
     switch_history = stats.get("switchHistory", []) or []
-    play_time_s = float(stats.get("playTime", 0.0) or 0.0)
-    dropped_frames = int(stats.get("droppedFrames", 0) or 0)
-
-    startup_s, stall_count, stall_time_s, total_buffering_s = estimate_stalls_from_state_history(state_history)
-
-    switch_count = max(0, len(switch_history) - 1) if switch_history else 0
-
-    avg_bitrate_kbps = compute_time_weighted_avg_bitrate_kbps(switch_history, fallback_play_time_s=play_time_s)
 
-    mos = qoe_mos_proxy(
-        startup_s=startup_s,
-        stall_time_s=stall_time_s,
-        stall_count=stall_count,
-        switch_count=switch_count,
-        avg_bitrate_kbps=avg_bitrate_kbps,
-        dropped_frames=dropped_frames,
-    )
+    metrics = run_metrics(data)
+    play_time_s = metrics["play_time_s"]
+    startup_s = metrics["startup_s"]
+    stall_count = metrics["stall_count"]
+    stall_time_s = metrics["stall_time_s"]
+    total_buffering_s = metrics["total_buffering_s"]
+    switch_count = metrics["switch_count"]
+    dropped_frames = metrics["dropped_frames"]
+    avg_bitrate_kbps = metrics["avg_bitrate_kbps"]
+    mos = metrics["qoe_mos"]
 
     # -------- Plot 1: Bandwidth trace --------
     plt.figure()
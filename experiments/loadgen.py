@@ -0,0 +1,424 @@
+"""
+Concurrent DASH player load generator.
+
+Simulates N players that fetch the manifest, pull init and media segments at
+playback pace with a throughput-based ABR rule, and optionally shape each
+player's download rate with one of the traces in experiments/traces/.
+
+Usage:
+    python experiments/loadgen.py --manifest http://localhost:8000/dash/1/manifest.mpd \
+        --concurrency 1,10,50 --duration 60 --traces experiments/traces --out loadgen.json
+"""
+import argparse
+import asyncio
+import csv
+import glob
+import json
+import math
+import random
+import re
+import sys
+import time
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from urllib.parse import urljoin
+
+import aiohttp
+
+NS = {"mpd": "urn:mpeg:dash:schema:mpd:2011"}
+READ_CHUNK = 16 * 1024
+
+ABR_SAFETY = 0.8
+ABR_EWMA_ALPHA = 0.3
+STARTUP_BUFFER_S = 2.0
+MAX_BUFFER_S = 30.0
+
+
+def percentile(values, p):
+    """Nearest-rank percentile"""
+    if not values:
+        return None
+    values = sorted(values)
+    k = max(0, min(len(values) - 1, math.ceil(p / 100.0 * len(values)) - 1))
+    return values[k]
+
+
+def parse_duration(value):
+    """ISO 8601 duration (PT1H2M3.5S) in seconds"""
+    if not value:
+        return None
+    m = re.match(r"P(?:(\d+)D)?T?(?:(\d+)H)?(?:(\d+)M)?(?:([\d.]+)S)?", value)
+    if not m:
+        return None
+    d, h, mi, s = m.groups()
+    return int(d or 0) * 86400 + int(h or 0) * 3600 + int(mi or 0) * 60 + float(s or 0)
+
+
+def load_trace(path):
+    with open(path, newline="") as f:
+        rows = [(float(r["timestamp_s"]), float(r["download_kbps"])) for r in csv.DictReader(f)]
+    rows.sort()
+    return rows
+
+
+def _child(el, name):
+    return el.find(f"mpd:{name}", NS) if el is not None else None
+
+
+def _first(*elements):
+    # Elements without children are falsy, so `a or b` cannot be used here.
+    return next((el for el in elements if el is not None), None)
+
+
+def _base_url(base, el):
+    node = _child(el, "BaseURL")
+    return urljoin(base, node.text.strip()) if node is not None and node.text else base
+
+
+def _expand(template, rep_id, bandwidth, number=None, t=None):
+    def sub(m):
+        name, fmt = m.group(1), m.group(2)
+        value = {"RepresentationID": rep_id, "Bandwidth": bandwidth, "Number": number, "Time": t}[name]
+        return (fmt % value) if fmt else str(value)
+
+    return re.sub(r"\$(RepresentationID|Bandwidth|Number|Time)(%0\d+d)?\$", sub, template).replace("$$", "$")
+
+
+def _template_segments(tmpl, base, rep_id, bandwidth, period_duration):
+    timescale = int(tmpl.get("timescale", 1))
+    start_number = int(tmpl.get("startNumber", 1))
+    init = tmpl.get("initialization")
+    init_url = urljoin(base, _expand(init, rep_id, bandwidth)) if init else None
+    media = tmpl.get("media")
+
+    segments = []
+    timeline = _child(tmpl, "SegmentTimeline")
+    if timeline is not None:
+        number, t = start_number, 0
+        for s in timeline.findall("mpd:S", NS):
+            t = int(s.get("t", t))
+            d = int(s.get("d"))
+            for _ in range(int(s.get("r", 0)) + 1):
+                segments.append((urljoin(base, _expand(media, rep_id, bandwidth, number, t)), d / timescale, None))
+                number += 1
+                t += d
+    elif tmpl.get("duration"):
+        seg_s = int(tmpl.get("duration")) / timescale
+        count = int(-(-(period_duration or seg_s) // seg_s))
+        for i in range(count):
+            segments.append((urljoin(base, _expand(media, rep_id, bandwidth, start_number + i)), seg_s, None))
+    return (init_url, None), segments
+
+
+def _list_segments(seg_list, base):
+    timescale = int(seg_list.get("timescale", 1))
+    seg_s = int(seg_list.get("duration", 0)) / timescale
+    init = _child(seg_list, "Initialization")
+    init_ref = (urljoin(base, init.get("sourceURL", "")), init.get("range")) if init is not None else (None, None)
+
+    durations = []
+    timeline = _child(seg_list, "SegmentTimeline")
+    if timeline is not None:
+        for s in timeline.findall("mpd:S", NS):
+            durations += [int(s.get("d")) / timescale] * (int(s.get("r", 0)) + 1)
+
+    segments = []
+    for i, seg in enumerate(seg_list.findall("mpd:SegmentURL", NS)):
+        url = urljoin(base, seg.get("media", ""))
+        segments.append((url, durations[i] if i < len(durations) else seg_s, seg.get("mediaRange")))
+    return init_ref, segments
+
+
+def parse_mpd(text, manifest_url):
+    """Flatten an MPD into {"video": [rep, ...], "audio": [rep, ...]} sorted by bandwidth"""
+    root = ET.fromstring(text)
+    base = _base_url(manifest_url, root)
+    period = _child(root, "Period")
+    period_duration = parse_duration(period.get("duration")) or parse_duration(root.get("mediaPresentationDuration"))
+    base = _base_url(base, period)
+
+    tracks = {"video": [], "audio": []}
+    for aset in period.findall("mpd:AdaptationSet", NS):
+        aset_base = _base_url(base, aset)
+        kind = aset.get("contentType") or (aset.get("mimeType") or "").split("/")[0]
+        for rep in aset.findall("mpd:Representation", NS):
+            kind = kind or (rep.get("mimeType") or "").split("/")[0]
+            if kind not in tracks:
+                continue
+            rep_base = _base_url(aset_base, rep)
+            rep_id = rep.get("id")
+            bandwidth = int(rep.get("bandwidth", 0))
+
+            tmpl = _first(_child(rep, "SegmentTemplate"), _child(aset, "SegmentTemplate"))
+            seg_list = _first(_child(rep, "SegmentList"), _child(aset, "SegmentList"))
+            if tmpl is not None:
+                init, segments = _template_segments(tmpl, rep_base, rep_id, bandwidth, period_duration)
+            elif seg_list is not None:
+                init, segments = _list_segments(seg_list, rep_base)
+            else:
+                continue
+
+            tracks[kind].append({
+                "id": rep_id,
+                "bandwidth": bandwidth,
+                "height": int(rep.get("height", 0) or 0),
+                "init": init,
+                "segments": segments,
+            })
+
+    for reps in tracks.values():
+        reps.sort(key=lambda r: r["bandwidth"])
+    return tracks
+
+
+class Shaper:
+    """Caps a player's download rate to a bandwidth trace, looping it if the run is longer"""
+
+    def __init__(self, trace):
+        self.trace = trace
+        self.span = trace[-1][0] if trace else 0.0
+        self.started = time.monotonic()
+        self.next_free = self.started
+
+    def rate_bps(self):
+        t = time.monotonic() - self.started
+        if self.span > 0:
+            t %= self.span
+        kbps = self.trace[0][1]
+        for ts, value in self.trace:
+            if ts > t:
+                break
+            kbps = value
+        return max(kbps, 1.0) * 1000.0
+
+    async def consume(self, nbytes):
+        now = time.monotonic()
+        self.next_free = max(self.next_free, now) + nbytes * 8.0 / self.rate_bps()
+        delay = self.next_free - now
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class Stats:
+    def __init__(self):
+        self.requests = []
+        self.sessions = []
+
+    def record_request(self, kind, ttfb, total, nbytes, error):
+        self.requests.append({"kind": kind, "ttfb": ttfb, "total": total, "bytes": nbytes, "error": error})
+
+
+async def fetch(session, url, stats, kind, byte_range=None, shaper=None):
+    headers = {"Range": f"bytes={byte_range}"} if byte_range else {}
+    start = time.monotonic()
+    ttfb = None
+    nbytes = 0
+    body = bytearray() if kind == "manifest" else None
+    try:
+        async with session.get(url, headers=headers) as resp:
+            ttfb = time.monotonic() - start
+            async for chunk in resp.content.iter_chunked(READ_CHUNK):
+                nbytes += len(chunk)
+                if body is not None:
+                    body += chunk
+                if shaper is not None:
+                    await shaper.consume(len(chunk))
+            error = resp.status >= 400
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        error = True
+    total = time.monotonic() - start
+    stats.record_request(kind, ttfb, total, nbytes, error)
+    return (not error), total, nbytes, (bytes(body) if body is not None else None)
+
+
+async def run_player(manifest_url, duration, stats, trace=None, timeout=30):
+    shaper = Shaper(trace) if trace else None
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+    session_stats = {"startup_s": None, "stalls": 0, "stall_s": 0.0, "switches": 0, "bitrates": [], "failed": False}
+
+    async with aiohttp.ClientSession(timeout=client_timeout) as session:
+        started = time.monotonic()
+        ok, _, _, body = await fetch(session, manifest_url, stats, "manifest", shaper=shaper)
+        if not ok:
+            session_stats["failed"] = True
+            stats.sessions.append(session_stats)
+            return
+
+        tracks = parse_mpd(body.decode("utf-8"), manifest_url)
+        videos, audios = tracks["video"], tracks["audio"]
+        if not videos:
+            session_stats["failed"] = True
+            stats.sessions.append(session_stats)
+            return
+
+        audio = audios[0] if audios else None
+        if audio and audio["init"][0]:
+            await fetch(session, audio["init"][0], stats, "init", audio["init"][1], shaper)
+
+        estimate_bps = None
+        current = None
+        buffer_s = 0.0
+        playing = False
+        video_time = audio_time = 0.0
+        audio_index = 0
+        last = time.monotonic()
+
+        for index in range(len(videos[0]["segments"])):
+            if time.monotonic() - started >= duration:
+                break
+
+            # Simple throughput rule: highest rung under a safety margin of the EWMA estimate.
+            rep = videos[0]
+            if estimate_bps is not None:
+                for candidate in videos:
+                    if candidate["bandwidth"] <= estimate_bps * ABR_SAFETY:
+                        rep = candidate
+            if rep is not current:
+                if current is not None:
+                    session_stats["switches"] += 1
+                current = rep
+                if rep["init"][0]:
+                    await fetch(session, rep["init"][0], stats, "init", rep["init"][1], shaper)
+
+            if index >= len(rep["segments"]):
+                break
+            url, seg_s, byte_range = rep["segments"][index]
+
+            ok, elapsed, nbytes, _ = await fetch(session, url, stats, "segment", byte_range, shaper)
+            while audio and audio_index < len(audio["segments"]) and audio_time < video_time + seg_s:
+                a_url, a_seg_s, a_range = audio["segments"][audio_index]
+                await fetch(session, a_url, stats, "segment", a_range, shaper)
+                audio_time += a_seg_s
+                audio_index += 1
+
+            now = time.monotonic()
+            wall = now - last
+            last = now
+            if playing:
+                if wall > buffer_s:
+                    session_stats["stalls"] += 1
+                    session_stats["stall_s"] += wall - buffer_s
+                    buffer_s = 0.0
+                else:
+                    buffer_s -= wall
+
+            if ok:
+                buffer_s += seg_s
+                video_time += seg_s
+                session_stats["bitrates"].append(rep["bandwidth"])
+                if elapsed > 0:
+                    sample = nbytes * 8.0 / elapsed
+                    estimate_bps = sample if estimate_bps is None else (
+                        ABR_EWMA_ALPHA * sample + (1 - ABR_EWMA_ALPHA) * estimate_bps
+                    )
+
+            if not playing and buffer_s >= min(STARTUP_BUFFER_S, seg_s):
+                playing = True
+                session_stats["startup_s"] = now - started
+
+            # Real playback pace: once the buffer is full, wait for it to drain.
+            if buffer_s > MAX_BUFFER_S:
+                wait = buffer_s - MAX_BUFFER_S
+                await asyncio.sleep(wait)
+                buffer_s -= wait
+                last = time.monotonic()
+
+    stats.sessions.append(session_stats)
+
+
+def summarize(level, stats, wall_s):
+    segments = [r for r in stats.requests if r["kind"] == "segment"]
+    ok_segments = [r for r in segments if not r["error"] and r["total"] > 0]
+    ttfb_ms = [r["ttfb"] * 1000 for r in stats.requests if r["ttfb"] is not None]
+    throughput_kbps = [r["bytes"] * 8 / r["total"] / 1000 for r in ok_segments]
+    sessions = [s for s in stats.sessions if not s["failed"]]
+    startup_ms = [s["startup_s"] * 1000 for s in sessions if s["startup_s"] is not None]
+    stall_ms = [s["stall_s"] * 1000 for s in sessions]
+    bitrates = [sum(s["bitrates"]) / len(s["bitrates"]) / 1000 for s in sessions if s["bitrates"]]
+
+    def pcts(values):
+        return {f"p{p}": percentile(values, p) for p in (50, 90, 99)}
+
+    return {
+        "concurrency": level,
+        "wall_s": wall_s,
+        "requests": len(stats.requests),
+        "error_rate": (sum(1 for r in stats.requests if r["error"]) / len(stats.requests)) if stats.requests else None,
+        "failed_sessions": len(stats.sessions) - len(sessions),
+        "egress_mbps": sum(r["bytes"] for r in stats.requests) * 8 / wall_s / 1e6 if wall_s > 0 else None,
+        "ttfb_ms": pcts(ttfb_ms),
+        "segment_throughput_kbps": pcts(throughput_kbps),
+        "startup_ms": pcts(startup_ms),
+        "stall_ms": pcts(stall_ms),
+        "sessions_with_stalls": sum(1 for s in sessions if s["stalls"]),
+        "avg_bitrate_kbps": pcts(bitrates),
+        "switches_mean": (sum(s["switches"] for s in sessions) / len(sessions)) if sessions else None,
+    }
+
+
+async def run_level(manifest_url, level, duration, traces, ramp_s, timeout):
+    stats = Stats()
+
+    async def delayed(i):
+        await asyncio.sleep(ramp_s * i / max(level, 1))
+        trace = random.choice(traces) if traces else None
+        await run_player(manifest_url, duration, stats, trace, timeout)
+
+    start = time.monotonic()
+    await asyncio.gather(*(delayed(i) for i in range(level)))
+    return summarize(level, stats, time.monotonic() - start)
+
+
+def _fmt(value, digits=0):
+    return "-" if value is None else f"{value:.{digits}f}"
+
+
+def print_report(results):
+    print(f"{'N':>6} {'err%':>6} {'ttfb p50/p90/p99 ms':>22} {'tput p50/p90 kbps':>20} "
+          f"{'startup p50/p90 ms':>20} {'stall p90 ms':>13} {'stalled':>8}")
+    for r in results:
+        print(
+            f"{r['concurrency']:>6} "
+            f"{_fmt(r['error_rate'] * 100 if r['error_rate'] is not None else None, 2):>6} "
+            f"{_fmt(r['ttfb_ms']['p50']) + '/' + _fmt(r['ttfb_ms']['p90']) + '/' + _fmt(r['ttfb_ms']['p99']):>22} "
+            f"{_fmt(r['segment_throughput_kbps']['p50']) + '/' + _fmt(r['segment_throughput_kbps']['p90']):>20} "
+            f"{_fmt(r['startup_ms']['p50']) + '/' + _fmt(r['startup_ms']['p90']):>20} "
+            f"{_fmt(r['stall_ms']['p90']):>13} "
+            f"{r['sessions_with_stalls']:>8}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent DASH player load generator")
+    parser.add_argument("--manifest", required=True, help="Absolute URL of manifest.mpd")
+    parser.add_argument("--concurrency", default="1,10,50", help="Comma separated player counts")
+    parser.add_argument("--duration", type=float, default=60.0, help="Seconds each player runs")
+    parser.add_argument("--ramp", type=float, default=5.0, help="Seconds over which players start")
+    parser.add_argument("--traces", help="Trace CSV file, directory or glob used to shape players")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Per-request timeout in seconds")
+    parser.add_argument("--out", help="Write the full report as JSON")
+    args = parser.parse_args()
+
+    traces = []
+    if args.traces:
+        pattern = str(Path(args.traces) / "*.csv") if Path(args.traces).is_dir() else args.traces
+        traces = [load_trace(p) for p in sorted(glob.glob(pattern))]
+        traces = [t for t in traces if t]
+        if not traces:
+            print(f"No traces found matching: {pattern}")
+            sys.exit(1)
+
+    levels = [int(x) for x in args.concurrency.split(",") if x.strip()]
+    results = []
+    for level in levels:
+        print(f"Running {level} concurrent players for {args.duration:.0f}s...")
+        results.append(asyncio.run(run_level(args.manifest, level, args.duration, traces, args.ramp, args.timeout)))
+
+    print_report(results)
+    if args.out:
+        Path(args.out).write_text(json.dumps({"manifest": args.manifest, "results": results}, indent=2), encoding="utf-8")
+        print(f"[OK] Report written to: {args.out}")
+
+
+if __name__ == "__main__":
+    main()
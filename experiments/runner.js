@@ -1,41 +1,72 @@
+const os = require("os");
 const redis = require("redis");
 const { spawn } = require("child_process");
 
 const REDIS_URL = process.env.REDIS_URL || "redis://redis:6379/0";
+const RUNNER_ID = process.env.RUNNER_ID || os.hostname();
+const HEARTBEAT_MS = 10000;
+
 const client = redis.createClient({ url: REDIS_URL });
+// BRPOP blocks its connection, so heartbeats go over a second one.
+const heartbeatClient = client.duplicate();
+
+async function heartbeat() {
+  await heartbeatClient.zAdd("emulation_runners", { score: Date.now() / 1000, value: RUNNER_ID });
+}
+
+function runJob(job, out) {
+  let url = `http://web:8000/detailed_view/${job.video_id}/?autoplay=1`;
+  if (job.config && Object.keys(job.config).length > 0) {
+    url += `&player_config=${encodeURIComponent(JSON.stringify(job.config))}`;
+  }
+
+  const proc = spawn(
+    "node",
+    [
+      "run_trace_experiment.js",
+      "--url", url,
+      "--trace", `traces/${job.trace}`,
+      "--out", out,
+      "--duration", String(job.duration),
+    ],
+    { stdio: "inherit" }
+  );
+
+  return new Promise((resolve, reject) => {
+    proc.on("exit", code => {
+      if (code === 0) resolve();
+      else reject(new Error(`Runner failed with code ${code}`));
+    });
+  });
+}
 
 async function main() {
   await client.connect();
-  console.log("Runner connected to Redis");
+  await heartbeatClient.connect();
+  await heartbeat();
+  setInterval(() => heartbeat().catch(err => console.error("Heartbeat failed:", err)), HEARTBEAT_MS);
+  console.log("Runner", RUNNER_ID, "connected to Redis");
 
   while (true) {
-    const res = await client.brPop("emulation_jobs", 0);
+    // Jobs sharded to this runner first, then the shared queue.
+    const res = await client.brPop([`emulation_jobs:${RUNNER_ID}`, "emulation_jobs"], 0);
     const job = JSON.parse(res.element);
 
     const traceName = job.trace.replace(".csv", "");
-    const url = `http://web:8000/detailed_view/${job.video_id}/?autoplay=1`;
-    const out = `results/video_${job.video_id}_${traceName}.json`;
+    const out = `results/video_${job.video_id}_${traceName}_${job.job_id}.json`;
 
     console.log("Running emulation job", job.job_id);
 
-    const proc = spawn(
-      "node",
-      [
-        "run_trace_experiment.js",
-        "--url", url,
-        "--trace", `traces/${job.trace}`,
-        "--out", out,
-        "--duration", String(job.duration),
-      ],
-      { stdio: "inherit" }
-    );
-
-    await new Promise((resolve, reject) => {
-      proc.on("exit", code => {
-        if (code === 0) resolve();
-        else reject(new Error(`Runner failed with code ${code}`));
-      });
-    });
+    let error = null;
+    try {
+      await runJob(job, out);
+    } catch (err) {
+      console.error("Job", job.job_id, "failed:", err);
+      error = String(err);
+    }
+
+    // Picked up by the ingest_experiment_results beat task.
+    await client.lPush("emulation_results", JSON.stringify({ ...job, out, error, runner: RUNNER_ID }));
 
     console.log("Finished job", job.job_id);
   }
@@ -44,4 +75,4 @@ async function main() {
 main().catch(err => {
   console.error(err);
   process.exit(1);
-});
\ No newline at end of file
+});
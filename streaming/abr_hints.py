@@ -0,0 +1,72 @@
+import logging
+import os
+import redis
+import xml.etree.ElementTree as ET
+from django.core.files.storage import default_storage
+from .beacons import bandwidth_hint, network_key
+from .models import Video
+from .packaging import ON_DEMAND, load_indices, manifest_renditions
+from .popularity import client_id
+
+logger = logging.getLogger(__name__)
+
+# Share of the remembered throughput the player starts from; the median of earlier sessions
+# overestimates a cold connection more often than it underestimates it.
+START_SAFETY = 0.75
+# Seconds the player buffers ahead at least, or this many of the longest segments.
+MIN_BUFFERING_GOAL = 10
+SEGMENTS_AHEAD = 3
+# Remembered estimates are limited to this multiple of the top rendition's bandwidth.
+BANDWIDTH_CAP_FACTOR = 2
+
+
+def _renditions(video):
+    """Renditions stored at encode time, parsed from the manifest for videos encoded before that"""
+    if video.renditions or not video.is_streamable:
+        return video.renditions
+    try:
+        with video.dash_manifest.open('r') as f:
+            mpd_text = f.read()
+        dash_dir = default_storage.path(video.dash_base_path)
+        indices = load_indices(dash_dir) if video.packaging == ON_DEMAND and os.path.isdir(dash_dir) else None
+        renditions = manifest_renditions(mpd_text, indices)
+    except (OSError, ValueError, ET.ParseError):
+        logger.warning("Could not read the renditions of video %s", video.pk, exc_info=True)
+        return {}
+    Video.objects.filter(pk=video.pk).update(renditions=renditions)
+    video.renditions = renditions
+    return renditions
+
+
+def abr_hints(video, request):
+    """Start-up settings for the player of one viewer: a bandwidth estimate from earlier sessions of
+    the same client or network, the rendition it selects, and buffer goals that fit the segments"""
+    if video.is_live:
+        return {}
+
+    renditions = _renditions(video)
+    hints = {}
+
+    top = max((r['bandwidth'] for r in renditions.get('renditions', [])), default=0)
+    try:
+        bandwidth, source = bandwidth_hint(
+            video.pk, client_id(request), network_key(request.META.get('REMOTE_ADDR', '')),
+            cap=top * BANDWIDTH_CAP_FACTOR or None,
+        )
+    except redis.RedisError as e:
+        logger.warning("Could not read bandwidth hints: %s", e)
+        bandwidth, source = None, None
+
+    if bandwidth:
+        estimate = int(bandwidth * START_SAFETY)
+        hints['bandwidth_estimate'] = estimate
+        hints['bandwidth_source'] = source
+        fitting = [r for r in renditions.get('renditions', []) if r['bandwidth'] <= estimate]
+        if fitting:
+            hints['start_rung'] = fitting[-1]
+
+    if renditions.get('first_segment'):
+        hints['rebuffering_goal'] = renditions['first_segment']
+    if renditions.get('longest_segment'):
+        hints['buffering_goal'] = max(MIN_BUFFERING_GOAL, SEGMENTS_AHEAD * renditions['longest_segment'])
+    return hints
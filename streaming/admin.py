@@ -1,4 +1,9 @@
 from django.contrib import admin
-from .models import Video
+from .models import EncodeJob, ExperimentJob, ExperimentRun, ExperimentSweep, ReencodeBatch, Video
 
-admin.site.register(Video)
\ No newline at end of file
+admin.site.register(Video)
+admin.site.register(EncodeJob)
+admin.site.register(ReencodeBatch)
+admin.site.register(ExperimentRun)
+admin.site.register(ExperimentSweep)
+admin.site.register(ExperimentJob)
@@ -6,6 +6,7 @@ class StreamingConfig(AppConfig):
     
     def ready(self):
         import streaming.signals
+        import streaming.metrics
 
         #requeue_interrupted_encodes()
 
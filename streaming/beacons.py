@@ -0,0 +1,348 @@
+import hashlib
+import ipaddress
+import json
+import logging
+import math
+import time
+import redis
+from django.conf import settings
+from .popularity import get_redis
+from .qoe import interval_metrics, percentile
+
+logger = logging.getLogger(__name__)
+
+STREAM_KEY = 'qoe_beacons'
+GROUP = 'qoe_aggregator'
+BUCKET_KEY = 'qoe:rt:{}:{}:{}'
+RENDITIONS_KEY = 'qoe:rt:renditions:{}'
+SESSIONS_KEY = 'qoe:rt:sessions:{}:{}'
+BANDWIDTH_KEY = 'qoe:bw:{}:{}'
+
+# Recent throughput estimates are kept per client; networks and videos keep their most recent
+# clients, so each client counts once there. A scope needs this many before its median is trusted
+# as a start-up hint.
+BANDWIDTH_SAMPLES = 20
+BANDWIDTH_MIN_SAMPLES = {'client': 1, 'network': 3, 'video': 3}
+# Estimates above 10 Gbit/s are not measurements.
+BANDWIDTH_MAX = 10 ** 10
+
+STARTUP_BUCKETS_MS = (250, 500, 1000, 2000, 4000, 8000, 16000)
+MOS_BUCKET = 0.25
+
+CODEC_FAMILIES = {'vp09': 'vp9', 'vp9': 'vp9', 'av01': 'av1', 'avc1': 'h264', 'avc3': 'h264', 'hvc1': 'hevc'}
+
+
+class BeaconError(ValueError):
+    pass
+
+
+def _minute(ts=None):
+    return int((ts or time.time()) // 60)
+
+
+def rendition_key(variant):
+    """'720p_vp9' style label for the variant a player reported"""
+    variant = variant or {}
+    height = variant.get('height')
+    codec = str(variant.get('codecs') or '').split(',')[0].split('.')[0].lower()
+    label = f'{int(height)}p' if height else 'unknown'
+    family = CODEC_FAMILIES.get(codec)
+    return f'{label}_{family}' if family else label
+
+
+SAMPLE_NUMBERS = ('ts', 'playTime', 'droppedFrames', 'bandwidth', 'estimatedBandwidth')
+HISTORY_NUMBERS = {'stateHistory': ('duration', 'timestamp'), 'switchHistory': ('bandwidth', 'timestamp')}
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def _valid_sample(sample):
+    """Field types the aggregation relies on; anything else in a sample is ignored"""
+    if not isinstance(sample, dict):
+        return False
+    if any(sample.get(name) is not None and not _is_number(sample[name]) for name in SAMPLE_NUMBERS):
+        return False
+    variant = sample.get('variant')
+    if variant is not None:
+        if not isinstance(variant, dict):
+            return False
+        if variant.get('height') is not None and not _is_number(variant['height']):
+            return False
+    for name, numbers in HISTORY_NUMBERS.items():
+        history = sample.get(name)
+        if history is None:
+            continue
+        if not isinstance(history, list):
+            return False
+        for entry in history:
+            if not isinstance(entry, dict):
+                return False
+            if any(entry.get(n) is not None and not _is_number(entry[n]) for n in numbers):
+                return False
+    return True
+
+
+def parse_beacon(body):
+    """Validate a beacon batch: {"video": id, "session": str, "samples": [{...}, ...]}"""
+    if len(body) > settings.QOE_BEACON_MAX_BYTES:
+        raise BeaconError("Beacon too large")
+    try:
+        beacon = json.loads(body)
+        video_id = int(beacon['video'])
+        session = str(beacon['session'])[:64]
+        samples = beacon['samples']
+    except (ValueError, KeyError, TypeError):
+        raise BeaconError("Malformed beacon")
+    if not isinstance(samples, list) or not samples or not all(isinstance(s, dict) for s in samples):
+        raise BeaconError("samples must be a non-empty list of objects")
+    if not all(_valid_sample(s) for s in samples):
+        raise BeaconError("Malformed sample")
+    return video_id, session, samples
+
+
+def network_key(ip):
+    """Anonymous id of the /24 (IPv4) or /48 (IPv6) network an address belongs to"""
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return None
+    network = ipaddress.ip_network(f'{address}/{24 if address.version == 4 else 48}', strict=False)
+    return hashlib.sha1(str(network).encode()).hexdigest()[:16]
+
+
+def append_beacon(video_id, session, samples, client=None, network=None):
+    """One XADD per batch; the stream is trimmed approximately so it cannot grow without bound"""
+    fields = {'v': video_id, 's': session, 'd': json.dumps(samples, separators=(',', ':'))}
+    if client:
+        fields['c'] = client
+    if network:
+        fields['n'] = network
+    get_redis().xadd(STREAM_KEY, fields, maxlen=settings.QOE_STREAM_MAXLEN, approximate=True)
+
+
+def _startup_bucket(startup_ms):
+    for bound in STARTUP_BUCKETS_MS:
+        if startup_ms <= bound:
+            return f'startup_le:{bound}'
+    return 'startup_le:inf'
+
+
+def _mos_bucket(mos):
+    return 'mos:{:.2f}'.format(math.floor(mos / MOS_BUCKET) * MOS_BUCKET)
+
+
+def entry_commands(fields, ttl):
+    """Redis commands folding one stream entry into the per-minute buckets of each sample's video and
+    rendition, as (method, *args) tuples; all of them are computed before any is queued"""
+    commands = []
+    video_id = int(fields[b'v'])
+    session = fields[b's'].decode()
+    samples = json.loads(fields[b'd'])
+
+    for sample in samples:
+        metrics = interval_metrics(sample, includes_startup=bool(sample.get('first')))
+        minute = _minute(float(sample.get('ts', 0) / 1000.0) or None)
+        rendition = rendition_key(sample.get('variant'))
+        key = BUCKET_KEY.format(video_id, rendition, minute)
+        play_ms = metrics['play_time_s'] * 1000.0
+
+        commands.append(('hincrby', key, 'samples', 1))
+        commands.append(('hincrbyfloat', key, 'play_ms', play_ms))
+        commands.append(('hincrbyfloat', key, 'stall_ms', metrics['stall_time_s'] * 1000.0))
+        commands.append(('hincrby', key, 'stall_count', metrics['stall_count']))
+        commands.append(('hincrby', key, 'switch_count', metrics['switch_count']))
+        commands.append(('hincrby', key, 'dropped_frames', metrics['dropped_frames']))
+        commands.append(('hincrbyfloat', key, 'mos_sum', metrics['qoe_mos']))
+        commands.append(('hincrby', key, _mos_bucket(metrics['qoe_mos']), 1))
+        if metrics['avg_bitrate_kbps'] is not None:
+            commands.append(('hincrbyfloat', key, 'bitrate_play_ms', metrics['avg_bitrate_kbps'] * play_ms))
+        if metrics['startup_s'] is not None:
+            startup_ms = metrics['startup_s'] * 1000.0
+            commands.append(('hincrby', key, 'startups', 1))
+            commands.append(('hincrbyfloat', key, 'startup_ms', startup_ms))
+            commands.append(('hincrby', key, _startup_bucket(startup_ms), 1))
+        commands.append(('expire', key, ttl))
+
+        commands.append(('sadd', RENDITIONS_KEY.format(video_id), rendition))
+        commands.append(('expire', RENDITIONS_KEY.format(video_id), ttl))
+        commands.append(('pfadd', SESSIONS_KEY.format(video_id, minute), session))
+        commands.append(('expire', SESSIONS_KEY.format(video_id, minute), ttl))
+
+    # The player's latest throughput estimate, for start-up hints of later sessions.
+    estimates = [
+        s['estimatedBandwidth'] for s in samples
+        if _is_number(s.get('estimatedBandwidth')) and 0 < s['estimatedBandwidth'] <= BANDWIDTH_MAX
+    ]
+    client = fields.get(b'c', b'').decode()
+    if estimates and client:
+        client_key = BANDWIDTH_KEY.format('client', client)
+        commands.append(('lpush', client_key, int(estimates[-1])))
+        commands.append(('ltrim', client_key, 0, BANDWIDTH_SAMPLES - 1))
+        commands.append(('expire', client_key, settings.QOE_BANDWIDTH_HINT_TTL))
+        for scope, key in (('network', fields.get(b'n', b'').decode()), ('video', str(video_id))):
+            if not key:
+                continue
+            recent_key = BANDWIDTH_KEY.format(scope, key)
+            commands.append(('zadd', recent_key, {client: time.time()}))
+            commands.append(('zremrangebyrank', recent_key, 0, -BANDWIDTH_SAMPLES - 1))
+            commands.append(('expire', recent_key, settings.QOE_BANDWIDTH_HINT_TTL))
+    return commands
+
+
+def bandwidth_hint(video_id, client=None, network=None, cap=None):
+    """(bits/s, scope) of the median recent throughput of this client, else of the latest estimates
+    of its network's recent clients, else of the video's; (None, None) without enough samples.
+    Estimates are limited to cap."""
+    r = get_redis()
+    pipe = r.pipeline(transaction=False)
+    pipe.lrange(BANDWIDTH_KEY.format('client', client), 0, -1)
+    pipe.zrevrange(BANDWIDTH_KEY.format('network', network), 0, BANDWIDTH_SAMPLES - 1)
+    pipe.zrevrange(BANDWIDTH_KEY.format('video', video_id), 0, BANDWIDTH_SAMPLES - 1)
+    own, network_clients, video_clients = pipe.execute()
+    if not client:
+        own = []
+    if not network:
+        network_clients = []
+
+    def median(values):
+        values = [int(v) for v in values if v is not None]
+        if cap:
+            values = [min(v, int(cap)) for v in values]
+        return int(percentile(values, 50)) if values else None
+
+    if len(own) >= BANDWIDTH_MIN_SAMPLES['client']:
+        return median(own), 'client'
+
+    clients = list(dict.fromkeys(network_clients + video_clients))
+    if not clients:
+        return None, None
+    pipe = r.pipeline(transaction=False)
+    for member in clients:
+        pipe.lindex(BANDWIDTH_KEY.format('client', member.decode()), 0)
+    latest = dict(zip(clients, pipe.execute()))
+
+    for scope, members in (('network', network_clients), ('video', video_clients)):
+        values = [latest[m] for m in members if latest[m] is not None]
+        if len(values) >= BANDWIDTH_MIN_SAMPLES[scope]:
+            return median(values), scope
+    return None, None
+
+
+def ensure_group(r):
+    try:
+        r.xgroup_create(STREAM_KEY, GROUP, id='0', mkstream=True)
+    except redis.ResponseError as e:
+        if 'BUSYGROUP' not in str(e):
+            raise
+
+
+def consume(r, consumer, count=500, block_ms=5000):
+    """Aggregate one batch of beacons and acknowledge it; returns the number of entries handled.
+
+    Pending entries of consumers that died are claimed first, so no batch is lost.
+    """
+    ttl = settings.QOE_ROLLING_WINDOW * 60 + 120
+    _, entries, _ = r.xautoclaim(STREAM_KEY, GROUP, consumer, min_idle_time=60000, count=count)
+    if not entries:
+        response = r.xreadgroup(GROUP, consumer, {STREAM_KEY: '>'}, count=count, block=block_ms)
+        entries = response[0][1] if response else []
+    if not entries:
+        return 0
+
+    pipe = r.pipeline(transaction=False)
+    for entry_id, fields in entries:
+        # A beacon that cannot be aggregated is dropped whole and still acknowledged; left pending,
+        # it would be claimed and fail again forever.
+        try:
+            commands = entry_commands(fields, ttl)
+        except Exception as e:
+            logger.warning("Dropping malformed beacon %s: %r", entry_id, e)
+            continue
+        for method, *args in commands:
+            getattr(pipe, method)(*args)
+    pipe.xack(STREAM_KEY, GROUP, *[entry_id for entry_id, _ in entries])
+    pipe.execute()
+    return len(entries)
+
+
+def _histogram_percentile(histogram, p):
+    """Upper bound of the bucket holding the p-th percentile"""
+    total = sum(histogram.values())
+    if not total:
+        return None
+    rank = math.ceil(p / 100.0 * total)
+    seen = 0
+    for bound, count in sorted(histogram.items()):
+        seen += count
+        if seen >= rank:
+            return bound
+    return None
+
+
+def _summarize(totals):
+    startups = totals.get('startups', 0)
+    play_ms = totals.get('play_ms', 0.0)
+    samples = totals.get('samples', 0)
+    startup_hist = {
+        float(k.split(':')[1]): v for k, v in totals.items() if k.startswith('startup_le:')
+    }
+    mos_hist = {
+        min(float(k.split(':')[1]) + MOS_BUCKET, 5.0): v for k, v in totals.items() if k.startswith('mos:')
+    }
+    return {
+        'samples': int(samples),
+        'play_ms': play_ms,
+        'stall_ms': totals.get('stall_ms', 0.0),
+        'stall_ratio': totals.get('stall_ms', 0.0) / (play_ms + totals.get('stall_ms', 0.0)) if play_ms else None,
+        'stall_count': int(totals.get('stall_count', 0)),
+        'switch_count': int(totals.get('switch_count', 0)),
+        'dropped_frames': int(totals.get('dropped_frames', 0)),
+        'avg_bitrate_kbps': totals.get('bitrate_play_ms', 0.0) / play_ms if play_ms else None,
+        'startup_ms': {
+            'mean': totals.get('startup_ms', 0.0) / startups if startups else None,
+            'p50': _histogram_percentile(startup_hist, 50),
+            'p90': _histogram_percentile(startup_hist, 90),
+        },
+        'qoe_mos': {
+            'mean': totals.get('mos_sum', 0.0) / samples if samples else None,
+            'p10': _histogram_percentile(mos_hist, 10),
+            'p50': _histogram_percentile(mos_hist, 50),
+        },
+    }
+
+
+def rolling_qoe(video_id, minutes):
+    """QoE of the last `minutes` minutes of real playback of a video, per rendition and overall"""
+    r = get_redis()
+    now = _minute()
+    window = range(now - minutes + 1, now + 1)
+    renditions = sorted(v.decode() for v in r.smembers(RENDITIONS_KEY.format(video_id)))
+
+    pipe = r.pipeline(transaction=False)
+    for rendition in renditions:
+        for minute in window:
+            pipe.hgetall(BUCKET_KEY.format(video_id, rendition, minute))
+    pipe.pfcount(*[SESSIONS_KEY.format(video_id, minute) for minute in window])
+    results = pipe.execute()
+
+    overall = {}
+    per_rendition = {}
+    for i, rendition in enumerate(renditions):
+        totals = {}
+        for bucket in results[i * len(window):(i + 1) * len(window)]:
+            for field, value in bucket.items():
+                field = field.decode()
+                totals[field] = totals.get(field, 0) + float(value)
+                overall[field] = overall.get(field, 0) + float(value)
+        if totals:
+            per_rendition[rendition] = _summarize(totals)
+
+    return {
+        'video': video_id,
+        'minutes': minutes,
+        'sessions': results[-1],
+        'overall': _summarize(overall),
+        'renditions': per_rendition,
+    }
@@ -0,0 +1,129 @@
+import logging
+import math
+import os
+import resource
+import subprocess
+import tempfile
+import time
+from django.conf import settings
+from .metrics import ENCODE_CPU_UTILISATION, observe_encode_stage
+
+logger = logging.getLogger(__name__)
+
+# Pixels one encoder thread is given; a 360p rung gets one thread, 1080p gets nine (capped).
+PIXELS_PER_THREAD = 640 * 360
+MAX_THREADS_PER_RUNG = 8
+# VP9 tiles are at least 256 pixels wide.
+MIN_TILE_WIDTH = 256
+# Threads added to the budget of the rung that also writes the poster and sprite sheets.
+PREVIEW_THREADS = 1
+
+
+def _cgroup_cpus():
+    """CPU limit of the container, or None without one"""
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()[:2]
+        if quota != 'max':
+            return int(quota) / int(period)
+        return None
+    except (OSError, ValueError):
+        pass
+    try:
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as f:
+            quota = int(f.read())
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as f:
+            period = int(f.read())
+        return quota / period if quota > 0 else None
+    except (OSError, ValueError):
+        return None
+
+
+def available_cpus():
+    """Cores this worker may use: ENCODE_CPUS, or the affinity mask capped by the cgroup quota"""
+    if settings.ENCODE_CPUS:
+        return settings.ENCODE_CPUS
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    quota = _cgroup_cpus()
+    if quota is not None:
+        cpus = min(cpus, math.floor(quota))
+    return max(1, cpus)
+
+
+def rung_threads(width, height, cpus):
+    return max(1, min(cpus, MAX_THREADS_PER_RUNG, round(width * height / PIXELS_PER_THREAD)))
+
+
+def input_thread_args(threads):
+    """ffmpeg options, placed before -i, that hold the decoder and the filter graphs to the budget
+    of the job; left alone, both start a thread per core next to the encoder's"""
+    return ['-threads', str(threads), '-filter_threads', str(threads)]
+
+
+def tile_columns(width, threads):
+    """log2 of the VP9 tile columns: as many as the width allows, but no more than there are threads"""
+    by_width = int(math.log2(max(width // MIN_TILE_WIDTH, 1)))
+    by_threads = math.ceil(math.log2(threads)) if threads > 1 else 0
+    return min(by_width, by_threads, 6)
+
+
+def _stderr_tail(log, limit=8192):
+    log.seek(0, os.SEEK_END)
+    log.seek(max(0, log.tell() - limit))
+    return log.read()
+
+
+def run_packed(jobs, cpus, poll_interval=0.2):
+    """Run (name, cmd, threads) jobs at the same time without their threads exceeding cpus.
+
+    Biggest jobs start first and smaller ones fill the remaining cores; a job larger than the
+    machine runs on its own. The first failure stops the others and raises CalledProcessError.
+    Returns the share of the cores the children kept busy.
+    """
+    pending = sorted(jobs, key=lambda job: job[2], reverse=True)
+    running = []
+    used = 0
+    started_at = time.monotonic()
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    try:
+        while pending or running:
+            for job in list(pending):
+                name, cmd, threads = job
+                if running and used + threads > cpus:
+                    continue
+                log = tempfile.TemporaryFile('w+')
+                proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=log, text=True)
+                running.append((proc, job, log, time.monotonic()))
+                pending.remove(job)
+                used += threads
+
+            time.sleep(poll_interval)
+            for entry in list(running):
+                proc, (name, cmd, threads), log, job_started = entry
+                if proc.poll() is None:
+                    continue
+                running.remove(entry)
+                used -= threads
+                observe_encode_stage(name, time.monotonic() - job_started)
+                if proc.returncode != 0:
+                    stderr = _stderr_tail(log)
+                    log.close()
+                    raise subprocess.CalledProcessError(proc.returncode, cmd, None, stderr)
+                log.close()
+    finally:
+        for proc, _, log, _ in running:
+            proc.kill()
+            proc.wait()
+            log.close()
+
+    wall = time.monotonic() - started_at
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu_time = (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+    utilisation = cpu_time / (wall * cpus) if wall > 0 else 0.0
+    ENCODE_CPU_UTILISATION.observe(utilisation)
+    logger.info("Ran %s encodes on %s cores in %.1fs, %.0f%% utilisation", len(jobs), cpus, wall, utilisation * 100)
+    return utilisation
@@ -0,0 +1,184 @@
+import json
+import logging
+import os
+import re
+import uuid
+from datetime import datetime, timezone as dt_timezone
+import redis
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import ExperimentJob, ExperimentRun, Video
+from .qoe import percentile, run_metrics
+from .sweeps import config_hash
+
+logger = logging.getLogger(__name__)
+
+RESULTS_KEY = 'emulation_results'
+FAILED_RESULTS_KEY = 'emulation_results:failed'
+PROCESSING_RESULTS_KEY = 'emulation_results:processing'
+RESULT_NAME_RE = re.compile(r'^video_(\d+)_(.+?)(?:_([0-9a-f]{8}-[0-9a-f-]{27}))?\.json$')
+
+QOE_FIELDS = (
+    'startup_ms',
+    'stall_time_ms',
+    'stall_count',
+    'total_buffering_ms',
+    'switch_count',
+    'dropped_frames',
+    'avg_bitrate_kbps',
+    'qoe_mos',
+)
+PERCENTILES = (50, 90, 95, 99)
+GROUPINGS = {
+    'video': ('video_id', 'encode_version'),
+    'trace': ('trace', 'encode_version'),
+    'video_trace': ('video_id', 'trace', 'encode_version'),
+}
+
+
+def _epoch_ms(value):
+    if value is None:
+        return None
+    return datetime.fromtimestamp(value / 1000.0, tz=dt_timezone.utc)
+
+
+def _ms(seconds):
+    return None if seconds is None else seconds * 1000.0
+
+
+def result_path(name):
+    return os.path.join(settings.EXPERIMENTS_DIR, name)
+
+
+def _finish_job(job_id, state, **fields):
+    """Mark the sweep job a result belongs to; results from plain emulation runs have none"""
+    try:
+        job_id = uuid.UUID(str(job_id))
+    except ValueError:
+        return
+    ExperimentJob.objects.filter(job_id=job_id).update(state=state, finished_at=timezone.now(), **fields)
+
+
+def ingest_result(path, video_id, trace, job_id, encode_version=None, player_config=None):
+    """Compute the QoE metrics of one result file and store them; re-ingesting a job updates it"""
+    current_version = Video.objects.filter(pk=video_id).values_list('encode_version', flat=True).first()
+    if current_version is None:
+        raise ValueError(f"Video {video_id} does not exist")
+    if encode_version is None:
+        encode_version = current_version
+
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    metrics = run_metrics(data)
+
+    duration = data.get('durationRequestedS')
+    run, _ = ExperimentRun.objects.update_or_create(
+        job_id=job_id,
+        defaults={
+            'video_id': video_id,
+            'trace': os.path.splitext(os.path.basename(trace))[0],
+            'encode_version': encode_version,
+            'result_path': os.path.relpath(path, settings.EXPERIMENTS_DIR),
+            'player_config': player_config or {},
+            'config_hash': config_hash(player_config),
+            'started_at': _epoch_ms(data.get('startedAt')),
+            'finished_at': _epoch_ms(data.get('finishedAt')),
+            'duration_requested_ms': int(float(duration) * 1000) if duration is not None else None,
+            'play_time_ms': _ms(metrics['play_time_s']),
+            'startup_ms': _ms(metrics['startup_s']),
+            'stall_count': metrics['stall_count'],
+            'stall_time_ms': _ms(metrics['stall_time_s']),
+            'total_buffering_ms': _ms(metrics['total_buffering_s']),
+            'switch_count': metrics['switch_count'],
+            'dropped_frames': metrics['dropped_frames'],
+            'avg_bitrate_kbps': metrics['avg_bitrate_kbps'],
+            'qoe_mos': metrics['qoe_mos'],
+        },
+    )
+    _finish_job(job_id, ExperimentJob.DONE, run=run)
+    return run
+
+
+def ingest_file(path):
+    """Ingest a result file named video_<id>_<trace>[_<job id>].json, e.g. when backfilling"""
+    match = RESULT_NAME_RE.match(os.path.basename(path))
+    if not match:
+        raise ValueError(f"Not an emulation result file name: {path}")
+    video_id, trace, job_id = match.groups()
+    job_id = job_id or 'file:' + os.path.relpath(path, settings.EXPERIMENTS_DIR)
+    return ingest_result(path, int(video_id), trace, job_id)
+
+
+def _ingest_item(raw):
+    item = json.loads(raw)
+    if item.get('error'):
+        _finish_job(item['job_id'], ExperimentJob.FAILED, error=str(item['error']))
+        return False
+    ingest_result(
+        result_path(item['out']),
+        int(item['video_id']),
+        item['trace'],
+        item['job_id'],
+        item.get('encode_version'),
+        item.get('config'),
+    )
+    return True
+
+
+def drain_results(limit=1000):
+    """Ingest the runs the emulation runner has reported as finished
+
+    Each result is moved to a processing list while it is written and only removed once the write
+    has committed; a drain that dies leaves it there, and the next drain queues it again.
+    Ingesting a result twice only updates its run.
+    """
+    r = redis.Redis.from_url(settings.REDIS_URL)
+    while r.rpoplpush(PROCESSING_RESULTS_KEY, RESULTS_KEY) is not None:
+        pass
+
+    ingested = 0
+    for _ in range(limit):
+        raw = r.rpoplpush(RESULTS_KEY, PROCESSING_RESULTS_KEY)
+        if raw is None:
+            break
+        try:
+            with transaction.atomic():
+                ingested += _ingest_item(raw)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Could not ingest emulation result %s: %s", raw, e)
+            r.pipeline().lpush(FAILED_RESULTS_KEY, raw).lrem(PROCESSING_RESULTS_KEY, 1, raw).execute()
+        except Exception:
+            # Most likely the database; the result goes back to be drained next time.
+            r.pipeline().rpush(RESULTS_KEY, raw).lrem(PROCESSING_RESULTS_KEY, 1, raw).execute()
+            raise
+        else:
+            r.lrem(PROCESSING_RESULTS_KEY, 1, raw)
+    return ingested
+
+
+def _summary(values):
+    values = [v for v in values if v is not None]
+    if not values:
+        return None
+    summary = {'mean': sum(values) / len(values)}
+    for p in PERCENTILES:
+        summary[f'p{p}'] = percentile(values, p)
+    return summary
+
+
+def aggregate_qoe(runs, group_by='video'):
+    """Mean and percentiles of each QoE metric, grouped by video and/or trace and encode version"""
+    keys = GROUPINGS[group_by]
+    groups = {}
+    for row in runs.values(*keys, *QOE_FIELDS):
+        groups.setdefault(tuple(row[k] for k in keys), []).append(row)
+
+    results = []
+    for key, rows in sorted(groups.items(), key=lambda item: tuple(str(k) for k in item[0])):
+        group = {k.removesuffix('_id'): v for k, v in zip(keys, key)}
+        group['runs'] = len(rows)
+        for field in QOE_FIELDS:
+            group[field] = _summary([row[field] for row in rows])
+        results.append(group)
+    return results
@@ -1,7 +1,24 @@
+from django import forms
+from django.conf import settings
 from django.forms import ModelForm
+from .media import CODECS, in_preference_order
 from .models import Video
 
 class VideoForm(ModelForm):
+    codecs = forms.MultipleChoiceField(
+        choices=[(key, codec['label']) for key, codec in CODECS.items()],
+        widget=forms.CheckboxSelectMultiple,
+        required=False,
+        initial=lambda: settings.ENCODE_DEFAULT_CODECS,
+        help_text="Codecs beyond the first are skipped if the encode would exceed the cost budget.",
+    )
+
     class Meta:
         model = Video
-        fields = ["title", "description", "video"]
\ No newline at end of file
+        fields = ["title", "description", "video", "codecs"]
+
+    def clean_codecs(self):
+        selected = self.cleaned_data["codecs"]
+        # Keep the configured preference order rather than the checkbox order: codecs late in the
+        # list are the first to be dropped by the cost budget.
+        return in_preference_order(selected, settings.ENCODE_DEFAULT_CODECS)
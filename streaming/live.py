@@ -0,0 +1,137 @@
+import os
+import time
+from django.conf import settings
+from .media import VIDEO_LADDER
+
+LIVE_MANIFEST_NAME = 'manifest.mpd'
+LIVE_FRAME_RATE = 30
+# ffmpeg's dash muxer writes each segment to <name>.tmp and renames it once the segment is complete.
+IN_PROGRESS_SUFFIX = '.tmp'
+SEGMENT_READ_SIZE = 64 * 1024
+SEGMENT_POLL_INTERVAL = 0.05
+
+
+def live_qualities(max_height):
+    return [q for q in VIDEO_LADDER if q['height'] <= max_height] or VIDEO_LADDER[:1]
+
+
+def _bufsize(maxrate):
+    # Half a second of VBV at maxrate keeps rate spikes inside a chunk.
+    return f"{int(maxrate.rstrip('k')) // 2}k"
+
+
+def build_input_args(input_url, listen=False, test_source=False):
+    if test_source:
+        return [
+            '-re',
+            '-f', 'lavfi', '-i', f'testsrc2=size=1920x1080:rate={LIVE_FRAME_RATE}',
+            '-f', 'lavfi', '-i', 'sine=frequency=1000:sample_rate=48000',
+        ], '1:a:0'
+
+    args = ['-fflags', 'nobuffer']
+    if listen and input_url.startswith('rtmp'):
+        args += ['-listen', '1']
+    if input_url == '-':
+        input_url = 'pipe:0'
+    return args + ['-i', input_url], '0:a:0'
+
+
+def build_live_command(input_args, audio_map, output_dir, qualities, segment_duration, fragment_duration):
+    """One ffmpeg process that transcodes the feed into the ladder and writes low-latency CMAF DASH"""
+    gop = int(segment_duration * LIVE_FRAME_RATE)
+
+    splits = ''.join(f'[v{i}]' for i in range(len(qualities)))
+    filters = [f'[0:v]fps={LIVE_FRAME_RATE},split={len(qualities)}{splits}']
+    for i, quality in enumerate(qualities):
+        filters.append(f"[v{i}]scale={quality['width']}:{quality['height']}[out{i}]")
+
+    cmd = ['ffmpeg', '-hide_banner', '-loglevel', 'warning', *input_args, '-filter_complex', ';'.join(filters)]
+
+    for i, quality in enumerate(qualities):
+        cmd += [
+            '-map', f'[out{i}]',
+            f'-b:v:{i}', quality['bitrate'],
+            f'-maxrate:v:{i}', quality['maxrate'],
+            f'-bufsize:v:{i}', _bufsize(quality['maxrate']),
+        ]
+
+    if audio_map:
+        cmd += [
+            '-map', audio_map,
+            '-c:a', 'aac',
+            '-b:a', '128k',
+            '-ar', '48000',
+            '-ac', '2',
+        ]
+
+    cmd += [
+        '-c:v', 'libx264',
+        '-preset', 'veryfast',
+        '-tune', 'zerolatency',
+        '-profile:v', 'main',
+        '-pix_fmt', 'yuv420p',
+        '-g', str(gop),
+        '-keyint_min', str(gop),
+        '-sc_threshold', '0',
+        '-f', 'dash',
+        '-ldash', '1',
+        '-streaming', '1',
+        '-use_template', '1',
+        '-use_timeline', '0',
+        '-seg_duration', str(segment_duration),
+        '-frag_type', 'duration',
+        '-frag_duration', str(fragment_duration),
+        '-target_latency', str(settings.LIVE_TARGET_LATENCY),
+        '-window_size', '0',
+        '-remove_at_exit', '0',
+        '-utc_timing_url', settings.LIVE_UTC_TIMING_URL,
+        '-format_options', 'movflags=cmaf',
+        '-adaptation_sets', 'id=0,streams=v id=1,streams=a' if audio_map else 'id=0,streams=v',
+        '-init_seg_name', 'init_$RepresentationID$.$ext$',
+        '-media_seg_name', 'chunk_$RepresentationID$_$Number%05d$.$ext$',
+        '-y',
+        os.path.join(output_dir, LIVE_MANIFEST_NAME),
+    ]
+    return cmd
+
+
+def wait_for_segment(path, timeout, poll_interval=SEGMENT_POLL_INTERVAL):
+    """The finished segment at path or the file ffmpeg is still writing it to, whichever exists
+    first; None if neither appears within timeout seconds"""
+    deadline = time.monotonic() + timeout
+    while True:
+        for candidate in (path, path + IN_PROGRESS_SUFFIX):
+            if os.path.isfile(candidate):
+                return candidate
+        if time.monotonic() >= deadline:
+            return None
+        time.sleep(poll_interval)
+
+
+def read_growing_segment(in_progress_path, stall_timeout, poll_interval=SEGMENT_POLL_INTERVAL):
+    """Yield the bytes of a segment as ffmpeg writes them, until it is renamed to its final name.
+
+    Stops early if nothing is written for stall_timeout seconds, e.g. because the ingest died.
+    """
+    final_path = in_progress_path[:-len(IN_PROGRESS_SUFFIX)]
+    try:
+        f = open(in_progress_path, 'rb')
+    except FileNotFoundError:
+        # Finished between the lookup and here.
+        f = open(final_path, 'rb')
+    with f:
+        last_write = time.monotonic()
+        while True:
+            data = f.read(SEGMENT_READ_SIZE)
+            if data:
+                last_write = time.monotonic()
+                yield data
+                continue
+            if os.path.exists(final_path):
+                # The open handle still reads the renamed, now complete, file.
+                while data := f.read(SEGMENT_READ_SIZE):
+                    yield data
+                return
+            if time.monotonic() - last_write > stall_timeout:
+                return
+            time.sleep(poll_interval)
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from streaming.storage_gc import collect_media, collect_scratch
+
+
+class Command(BaseCommand):
+    help = "Delete orphaned DASH trees, originals and encoder scratch directories, and report the bytes reclaimed"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only report what would be deleted")
+        parser.add_argument('--no-scratch', action='store_true', help="Skip scratch directories (not on the encoding host)")
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        report = collect_media(dry_run=dry_run)
+        if not options['no_scratch']:
+            report['scratch'] = collect_scratch(dry_run=dry_run)
+            report['reclaimed_bytes'] += report['scratch']['reclaimed_bytes']
+
+        for kind in ('dash', 'superseded', 'originals', 'scratch'):
+            if kind in report:
+                self.stdout.write(f"{kind}: {report[kind]['removed']} removed, {report[kind]['reclaimed_bytes']} bytes")
+        verb = "Would reclaim" if dry_run else "Reclaimed"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {report['reclaimed_bytes'] / 1024 ** 2:.1f} MiB"))
@@ -0,0 +1,34 @@
+import signal
+import socket
+import redis
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from streaming.beacons import consume, ensure_group
+
+
+def _interrupt(_signum, _frame):
+    raise KeyboardInterrupt
+
+
+class Command(BaseCommand):
+    help = "Aggregate player QoE beacons from the Redis stream into rolling per-rendition buckets"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--consumer', default=socket.gethostname(), help="Consumer name within the group")
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        signal.signal(signal.SIGTERM, _interrupt)
+
+        # Not the shared client: its short socket timeout would cut blocking reads short.
+        r = redis.Redis.from_url(settings.REDIS_URL)
+        ensure_group(r)
+        self.stdout.write(f"Consuming QoE beacons as {options['consumer']}")
+
+        handled = 0
+        try:
+            while True:
+                handled += consume(r, options['consumer'], count=options['batch_size'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(f"Stopped after {handled} beacons")
@@ -0,0 +1,31 @@
+import glob
+import os
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from streaming.experiment_results import drain_results, ingest_file
+
+
+class Command(BaseCommand):
+    help = "Ingest emulation results: the runner's pending queue, plus any result files given or found"
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', help="Result files to (re)ingest")
+        parser.add_argument('--all', action='store_true', help="Backfill every file in experiments/results/")
+
+    def handle(self, *args, **options):
+        paths = list(options['paths'])
+        if options['all']:
+            paths += sorted(glob.glob(os.path.join(settings.EXPERIMENTS_DIR, 'results', 'video_*.json')))
+
+        ingested = 0
+        for path in paths:
+            try:
+                ingest_file(path)
+                ingested += 1
+            except (OSError, ValueError) as e:
+                self.stderr.write(f"Skipping {path}: {e}")
+
+        if not options['paths']:
+            ingested += drain_results()
+
+        self.stdout.write(self.style.SUCCESS(f"Ingested {ingested} runs"))
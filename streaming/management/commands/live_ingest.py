@@ -0,0 +1,115 @@
+import os
+import signal
+import subprocess
+import time
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from streaming.live import (
+    LIVE_MANIFEST_NAME,
+    build_input_args,
+    build_live_command,
+    live_qualities,
+)
+from streaming.models import Video
+
+
+def _interrupt(_signum, _frame):
+    raise KeyboardInterrupt
+
+
+class Command(BaseCommand):
+    help = "Transcode a live feed (RTMP/SRT/pipe or a test source) into low-latency DASH for a Video"
+
+    def add_arguments(self, parser):
+        target = parser.add_mutually_exclusive_group(required=True)
+        target.add_argument('--video', type=int, help="Existing video id to (re)use for the stream")
+        target.add_argument('--title', help="Create a new live video with this title")
+        parser.add_argument('--description', default='')
+
+        source = parser.add_mutually_exclusive_group(required=True)
+        source.add_argument('--input', help="ffmpeg input URL, e.g. rtmp://0.0.0.0:1935/live/stream, srt://0.0.0.0:9000?mode=listener or - for stdin")
+        source.add_argument('--test-source', action='store_true', help="Use an ffmpeg testsrc2/sine feed")
+
+        parser.add_argument('--listen', action='store_true', help="Act as the RTMP server instead of pulling")
+        parser.add_argument('--no-audio', action='store_true', help="The feed has no audio track")
+        parser.add_argument('--segment-duration', type=float, default=settings.LIVE_SEGMENT_DURATION)
+        parser.add_argument('--fragment-duration', type=float, default=settings.LIVE_FRAGMENT_DURATION)
+        parser.add_argument('--max-height', type=int, default=settings.LIVE_MAX_HEIGHT)
+
+    def handle(self, *args, **options):
+        if options['video']:
+            try:
+                video = Video.objects.get(pk=options['video'])
+            except Video.DoesNotExist:
+                raise CommandError(f"Video {options['video']} does not exist")
+            if video.video:
+                raise CommandError("Live streams cannot reuse an uploaded (VOD) video")
+        else:
+            video = Video.objects.create(
+                title=options['title'],
+                description=options['description'],
+                video='',
+            )
+
+        dash_dir_name = f'dash/{video.pk}'
+        output_dir = default_storage.path(dash_dir_name)
+        os.makedirs(output_dir, exist_ok=True)
+        manifest_path = os.path.join(output_dir, LIVE_MANIFEST_NAME)
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+
+        input_args, audio_map = build_input_args(
+            options['input'],
+            listen=options['listen'],
+            test_source=options['test_source'],
+        )
+        cmd = build_live_command(
+            input_args,
+            None if options['no_audio'] else audio_map,
+            output_dir,
+            live_qualities(options['max_height']),
+            options['segment_duration'],
+            options['fragment_duration'],
+        )
+
+        Video.objects.filter(pk=video.pk).update(
+            is_live=True,
+            dash_ready=False,
+            dash_manifest=f'{dash_dir_name}/{LIVE_MANIFEST_NAME}',
+            dash_base_path=dash_dir_name,
+        )
+        self.stdout.write(f"Ingesting into video {video.pk}: {' '.join(cmd)}")
+
+        # docker compose stops services with SIGTERM; treat it like Ctrl+C so the stream is finalised.
+        signal.signal(signal.SIGTERM, _interrupt)
+
+        stdin = None if options['input'] == '-' else subprocess.DEVNULL
+        proc = subprocess.Popen(cmd, stdin=stdin)
+        published = False
+        started = time.monotonic()
+
+        try:
+            while proc.poll() is None:
+                if not published and os.path.exists(manifest_path):
+                    Video.objects.filter(pk=video.pk).update(dash_ready=True)
+                    published = True
+                    self.stdout.write(self.style.SUCCESS(f"Live manifest published for video {video.pk}"))
+                time.sleep(0.25)
+        except KeyboardInterrupt:
+            # SIGINT lets ffmpeg flush the last chunks and write a final (static) manifest.
+            proc.send_signal(signal.SIGINT)
+            proc.wait()
+        finally:
+            if proc.poll() is None:
+                proc.terminate()
+                proc.wait()
+            Video.objects.filter(pk=video.pk).update(
+                is_live=False,
+                dash_ready=os.path.exists(manifest_path),
+                duration=time.monotonic() - started,
+            )
+
+        if proc.returncode not in (0, 255, -signal.SIGINT):
+            raise CommandError(f"ffmpeg exited with code {proc.returncode}")
+        self.stdout.write(f"Live stream for video {video.pk} ended")
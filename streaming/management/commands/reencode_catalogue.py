@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand, CommandError
+from streaming.models import ReencodeBatch
+from streaming.reencode import batch_progress, create_batch, set_batch_state
+
+
+def _duration(seconds):
+    if seconds is None:
+        return '-'
+    hours, rem = divmod(int(seconds), 3600)
+    return f'{hours}h{rem // 60:02d}m'
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-encode videos with the current ladder, a few at a time. Each video keeps serving its old "
+        "encode until the new one is swapped in; batches continue in the background and survive restarts."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('video_ids', nargs='*', type=int, help="Videos to re-encode")
+        parser.add_argument('--all', action='store_true', help="Re-encode the whole catalogue")
+        parser.add_argument('--concurrency', type=int, default=1, help="Jobs of the batch queued or encoding at once")
+        parser.add_argument('--cost-budget', type=float, default=0.0,
+                            help="Summed estimated cost of those jobs in rung-seconds (0 for no limit)")
+        parser.add_argument('--priority', type=int, default=-1, help="Encode priority; uploads use 0")
+        parser.add_argument('--status', type=int, metavar='BATCH', help="Show the progress of a batch")
+        parser.add_argument('--pause', type=int, metavar='BATCH')
+        parser.add_argument('--resume', type=int, metavar='BATCH')
+        parser.add_argument('--cancel', type=int, metavar='BATCH')
+
+    def _batch(self, batch_id):
+        try:
+            return ReencodeBatch.objects.get(pk=batch_id)
+        except ReencodeBatch.DoesNotExist:
+            raise CommandError(f"No re-encode batch {batch_id}")
+
+    def _report(self, batch):
+        progress = batch_progress(batch)
+        rate = progress['videos_per_hour']
+        self.stdout.write(
+            f"Batch {progress['id']} [{progress['state']}]: {progress['done']} done, {progress['failed']} failed, "
+            f"{progress['in_flight']} in flight, {progress['remaining']} of {progress['videos']} remaining"
+        )
+        self.stdout.write(
+            f"  {rate:.1f} videos/h, {progress['cost_per_second'] or 0:.2f} rung-s/s, ETA {_duration(progress['eta_s'])}"
+            if rate else "  No finished encodes yet"
+        )
+
+    def handle(self, *args, **options):
+        for action, state in (('pause', ReencodeBatch.PAUSED), ('resume', ReencodeBatch.RUNNING), ('cancel', ReencodeBatch.CANCELLED)):
+            if options[action] is not None:
+                self._report(set_batch_state(self._batch(options[action]), state))
+                return
+        if options['status'] is not None:
+            self._report(self._batch(options['status']))
+            return
+
+        if not options['video_ids'] and not options['all']:
+            raise CommandError("Give video ids or --all")
+
+        batch = create_batch(
+            video_ids=options['video_ids'],
+            max_in_flight=options['concurrency'],
+            cost_budget=options['cost_budget'],
+            priority=options['priority'],
+        )
+        self.stdout.write(self.style.SUCCESS(f"Started re-encode batch {batch.pk} of {batch.total} videos"))
+        self._report(batch)
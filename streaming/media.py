@@ -0,0 +1,304 @@
+import json
+import math
+import os
+import subprocess
+
+
+VIDEO_LADDER = [
+    {'name': '360p', 'width': 640, 'height': 360, 'bitrate': '400k', 'maxrate': '500k'},
+    {'name': '480p', 'width': 854, 'height': 480, 'bitrate': '800k', 'maxrate': '1200k'},
+    {'name': '720p', 'width': 1280, 'height': 720, 'bitrate': '2000k', 'maxrate': '3000k'},
+    {'name': '1080p', 'width': 1920, 'height': 1080, 'bitrate': '4000k', 'maxrate': '6000k'},
+]
+
+
+# Codec matrix. bitrate_scale adjusts the ladder bitrates for equal quality,
+# cost is the encode time relative to VP9 at the settings below.
+CODECS = {
+    'vp9': {
+        'label': 'VP9',
+        'container': 'webm',
+        'audio': 'opus',
+        'bitrate_scale': 1.0,
+        'cost': 1.0,
+    },
+    'av1': {
+        'label': 'AV1 (SVT-AV1)',
+        'container': 'mp4',
+        'audio': 'opus',
+        'bitrate_scale': 0.7,
+        'cost': 1.3,
+    },
+    'h264': {
+        'label': 'H.264',
+        'container': 'mp4',
+        'audio': 'aac',
+        'bitrate_scale': 1.4,
+        'cost': 0.25,
+    },
+}
+
+AUDIO_CODECS = {
+    'opus': {'container': 'webm', 'args': ['-c:a', 'libopus', '-b:a', '128k']},
+    'aac': {'container': 'mp4', 'args': ['-c:a', 'aac', '-b:a', '128k']},
+}
+
+
+class ProbeError(Exception):
+    pass
+
+
+def probe_media(path, timeout=None):
+    """Run ffprobe on a file and return the parsed JSON output"""
+    probe_cmd = [
+        'ffprobe',
+        '-v', 'error',
+        '-show_entries', 'format=duration:stream=codec_type,width,height,codec_name,r_frame_rate',
+        '-of', 'json',
+        path
+    ]
+    try:
+        result = subprocess.run(probe_cmd, capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired as e:
+        raise ProbeError(f"ffprobe timed out after {timeout}s") from e
+
+    if result.returncode != 0:
+        raise ProbeError(result.stderr.strip() or f"ffprobe exited with code {result.returncode}")
+
+    return json.loads(result.stdout)
+
+
+def video_stream(probe_data):
+    return next((s for s in probe_data.get('streams', []) if s.get('codec_type') == 'video'), None)
+
+
+def audio_stream(probe_data):
+    return next((s for s in probe_data.get('streams', []) if s.get('codec_type') == 'audio'), None)
+
+
+def probed_duration(probe_data):
+    try:
+        return float(probe_data['format']['duration'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def select_qualities(source_width, source_height):
+    """Ladder rungs that do not upscale the source"""
+    qualities = [q for q in VIDEO_LADDER if q['height'] <= source_height]
+
+    if not qualities:
+        qualities = [{
+            'name': 'source',
+            'width': source_width,
+            'height': source_height,
+            'bitrate': '400k',
+            'maxrate': '500k'
+        }]
+
+    return qualities
+
+
+POSTER_NAME = 'poster.jpg'
+THUMBNAILS_VTT_NAME = 'thumbnails.vtt'
+THUMBNAIL_INTERVAL = 5
+THUMBNAIL_WIDTH = 160
+THUMBNAIL_COLUMNS = 10
+THUMBNAIL_ROWS = 10
+
+
+def thumbnail_size(source_width, source_height):
+    height = int(round(THUMBNAIL_WIDTH * source_height / max(source_width, 1) / 2.0)) * 2
+    return THUMBNAIL_WIDTH, max(height, 2)
+
+
+def preview_outputs(output_dir, duration, source_width, source_height):
+    """Extra ffmpeg outputs for the poster and sprite sheets, decoded alongside a rung encode"""
+    thumb_width, thumb_height = thumbnail_size(source_width, source_height)
+    poster_at = min((duration or 0) * 0.1, 10.0)
+
+    return [
+        '-map', '0:v:0',
+        '-vf', f"select='gte(t,{poster_at:.3f})',scale=-2:{min(source_height, 720)}",
+        '-frames:v', '1',
+        '-q:v', '3',
+        '-threads', '1',
+        '-an',
+        '-y',
+        os.path.join(output_dir, POSTER_NAME),
+        '-map', '0:v:0',
+        '-vf', (
+            f"fps=1/{THUMBNAIL_INTERVAL},scale={thumb_width}:{thumb_height},"
+            f"tile={THUMBNAIL_COLUMNS}x{THUMBNAIL_ROWS}"
+        ),
+        '-q:v', '5',
+        '-threads', '1',
+        '-an',
+        '-y',
+        os.path.join(output_dir, 'sprite_%03d.jpg'),
+    ]
+
+
+def _vtt_timestamp(seconds):
+    hours, rem = divmod(seconds, 3600)
+    minutes, secs = divmod(rem, 60)
+    return f'{int(hours):02d}:{int(minutes):02d}:{secs:06.3f}'
+
+
+def write_thumbnails_vtt(output_dir, duration, source_width, source_height):
+    """WebVTT index mapping each time range to its tile in the sprite sheets"""
+    thumb_width, thumb_height = thumbnail_size(source_width, source_height)
+    per_sheet = THUMBNAIL_COLUMNS * THUMBNAIL_ROWS
+    count = max(1, math.ceil((duration or THUMBNAIL_INTERVAL) / THUMBNAIL_INTERVAL))
+
+    lines = ['WEBVTT', '']
+    for i in range(count):
+        start = i * THUMBNAIL_INTERVAL
+        end = min((i + 1) * THUMBNAIL_INTERVAL, duration or (i + 1) * THUMBNAIL_INTERVAL)
+        sheet, pos = divmod(i, per_sheet)
+        x = (pos % THUMBNAIL_COLUMNS) * thumb_width
+        y = (pos // THUMBNAIL_COLUMNS) * thumb_height
+        lines.append(f'{_vtt_timestamp(start)} --> {_vtt_timestamp(end)}')
+        lines.append(f'sprite_{sheet + 1:03d}.jpg#xywh={x},{y},{thumb_width},{thumb_height}')
+        lines.append('')
+
+    path = os.path.join(output_dir, THUMBNAILS_VTT_NAME)
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines))
+    return path
+
+
+def _scale_rate(rate, factor):
+    return f"{int(round(int(rate.rstrip('k')) * factor))}k"
+
+
+def video_codec_args(codec, quality, threads=1, tile_columns=0):
+    """Codec specific ffmpeg arguments for one ladder rung, encoded with the given number of threads
+    (tile_columns is log2 of the VP9 tile columns)"""
+    scale = CODECS[codec]['bitrate_scale']
+    bitrate = _scale_rate(quality['bitrate'], scale)
+    maxrate = _scale_rate(quality['maxrate'], scale)
+
+    if codec == 'vp9':
+        return [
+            '-c:v', 'libvpx-vp9',
+            '-b:v', bitrate,
+            '-minrate', bitrate,
+            '-maxrate', maxrate,
+            '-crf', '31',
+            '-cpu-used', '2',
+            '-row-mt', '1',
+            '-tile-columns', str(tile_columns),
+            '-threads', str(threads),
+        ]
+    if codec == 'av1':
+        return [
+            '-c:v', 'libsvtav1',
+            '-preset', '8',
+            '-b:v', bitrate,
+            '-pix_fmt', 'yuv420p',
+            '-svtav1-params', f'lp={threads}',
+        ]
+    if codec == 'h264':
+        return [
+            '-c:v', 'libx264',
+            '-preset', 'medium',
+            '-profile:v', 'high',
+            '-pix_fmt', 'yuv420p',
+            '-b:v', bitrate,
+            '-maxrate', maxrate,
+            '-bufsize', _scale_rate(maxrate, 2),
+            '-threads', str(threads),
+        ]
+    raise ValueError(f"Unknown codec '{codec}'")
+
+
+def frame_rate(stream, default=30.0):
+    """Frames per second of a probed video stream, from its r_frame_rate fraction"""
+    try:
+        num, _, den = str(stream.get('r_frame_rate', '')).partition('/')
+        rate = float(num) / float(den or 1)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return default
+    return rate if rate > 0 else default
+
+
+def keyframe_args(fps, segment_duration, startup_duration=None, startup_segments=0):
+    """Keyframe placement for startup_segments segments of startup_duration seconds followed by
+    segment_duration seconds segments.
+
+    The packager cuts a segment at the first keyframe past its target duration, so with a target of
+    startup_duration the keyframes alone decide where every segment ends.
+    """
+    gop = max(1, int(round(fps * segment_duration)))
+    if startup_segments > 0:
+        startup_end = startup_duration * startup_segments
+        expr = (
+            f'if(lt(t,{startup_end}),gte(t,n_forced*{startup_duration}),'
+            f'gte(t,{startup_end}+(n_forced-{startup_segments})*{segment_duration}))'
+        )
+    else:
+        expr = f'gte(t,n_forced*{segment_duration})'
+    return [
+        '-force_key_frames', f'expr:{expr}',
+        '-g', str(gop),
+        '-keyint_min', str(gop),
+        '-sc_threshold', '0',
+    ]
+
+
+def packager_segment_duration(segment_duration, startup_duration=None, startup_segments=0):
+    return startup_duration if startup_segments > 0 else segment_duration
+
+
+# Encoder outputs stay in scratch next to their packaged copies; container overhead on top.
+SCRATCH_COPIES = 2
+SCRATCH_OVERHEAD = 1.2
+PREVIEW_BYTES = 64 * 1024 ** 2
+
+
+def _rate_bits(rate):
+    return int(rate.rstrip('k')) * 1000
+
+
+def estimate_scratch_bytes(duration, qualities, codecs, has_audio):
+    """Upper bound of the scratch space one encode needs: every rendition at its maxrate, both as
+    encoder output and packaged, plus the poster and seek-preview sprites"""
+    bits_per_second = sum(
+        _rate_bits(_scale_rate(quality['maxrate'], CODECS[codec]['bitrate_scale']))
+        for codec in codecs
+        for quality in qualities
+    )
+    if has_audio:
+        for audio_codec in dict.fromkeys(CODECS[codec]['audio'] for codec in codecs):
+            args = AUDIO_CODECS[audio_codec]['args']
+            bits_per_second += _rate_bits(args[args.index('-b:a') + 1])
+    return int(duration * bits_per_second / 8 * SCRATCH_COPIES * SCRATCH_OVERHEAD) + PREVIEW_BYTES
+
+
+def in_preference_order(codecs, preference):
+    """codecs sorted by their position in preference (e.g. ENCODE_DEFAULT_CODECS), unknown ones last"""
+    rank = {codec: i for i, codec in enumerate(preference)}
+    return sorted(codecs, key=lambda codec: rank.get(codec, len(rank)))
+
+
+def select_codecs(requested, duration, rungs, budget):
+    """Requested codecs in order, dropping those that would push the encode past the cost budget.
+
+    The first codec is always kept so every video gets at least one rendition set.
+    """
+    codecs = []
+    cost = 0.0
+    for codec in requested:
+        if codec not in CODECS or codec in codecs:
+            continue
+        codec_cost = max(float(duration or 0), 1.0) * max(rungs, 1) * CODECS[codec]['cost']
+        if codecs and cost + codec_cost > budget:
+            continue
+        codecs.append(codec)
+        cost += codec_cost
+    return codecs or ['vp9']
+
+
+def codec_cost_factor(codecs):
+    return sum(CODECS[codec]['cost'] for codec in codecs)
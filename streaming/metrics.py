@@ -0,0 +1,167 @@
+import os
+import time
+from contextlib import contextmanager
+import redis
+from celery.signals import task_failure, task_postrun, task_prerun, task_retry, worker_init, worker_process_shutdown
+from django.conf import settings
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+    start_http_server,
+)
+from prometheus_client.core import GaugeMetricFamily
+
+REQUEST_LATENCY = Histogram(
+    'streaming_http_request_duration_seconds',
+    'Time spent handling HTTP requests, per view',
+    ['view', 'method', 'status'],
+)
+
+TASK_DURATION = Histogram(
+    'streaming_celery_task_duration_seconds',
+    'Celery task run time',
+    ['task'],
+    buckets=(0.05, 0.1, 0.5, 1, 5, 15, 60, 300, 900, 1800, 3600, 7200, float('inf')),
+)
+
+TASK_OUTCOMES = Counter(
+    'streaming_celery_task_outcomes_total',
+    'Celery task outcomes',
+    ['task', 'outcome'],
+)
+
+ENCODE_STAGE_DURATION = Histogram(
+    'streaming_encode_stage_duration_seconds',
+    'Time spent in each stage of encode_video',
+    ['stage'],
+    buckets=(0.1, 0.5, 1, 5, 15, 60, 300, 900, 1800, 3600, 7200, float('inf')),
+)
+
+ENCODE_CPU_UTILISATION = Histogram(
+    'streaming_encode_cpu_utilisation_ratio',
+    'Share of the available cores kept busy by the packed rung encodes of one video',
+    buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0, float('inf')),
+)
+
+STORAGE_RECLAIMED_BYTES = Counter(
+    'streaming_storage_gc_reclaimed_bytes_total',
+    'Bytes freed by deleting orphaned or deleted media',
+    ['kind'],
+)
+
+# Celery's Redis transport keeps every queue as a plain list named after it.
+BROKER_QUEUES = ('celery', 'video_encoding')
+EMULATION_QUEUES = ('emulation_jobs',)
+
+
+@contextmanager
+def encode_stage(stage):
+    with ENCODE_STAGE_DURATION.labels(stage=stage).time():
+        yield
+
+
+def observe_encode_stage(stage, seconds):
+    """For stages that run concurrently and cannot be timed with encode_stage"""
+    ENCODE_STAGE_DURATION.labels(stage=stage).observe(seconds)
+
+
+class QueueDepthCollector:
+    """Reads queue lengths from Redis at scrape time, so every scraper sees the shared value"""
+
+    def collect(self):
+        gauge = GaugeMetricFamily(
+            'streaming_queue_depth',
+            'Messages waiting in each work queue',
+            labels=['queue'],
+        )
+        for url, queues in ((settings.CELERY_BROKER_URL, BROKER_QUEUES), (settings.REDIS_URL, EMULATION_QUEUES)):
+            try:
+                r = redis.Redis.from_url(url, socket_timeout=1, socket_connect_timeout=1)
+                pipe = r.pipeline()
+                for queue in queues:
+                    pipe.llen(queue)
+                for queue, depth in zip(queues, pipe.execute()):
+                    gauge.add_metric([queue], depth)
+            except (redis.RedisError, ValueError):
+                continue
+        yield gauge
+
+
+_queue_registry = CollectorRegistry()
+_queue_registry.register(QueueDepthCollector())
+
+
+def _process_registry():
+    """Metrics of this process, or of all processes of this container in multiprocess mode"""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def render_metrics():
+    """Exposition text for the web container, with the queue depths read from Redis"""
+    return generate_latest(_process_registry()) + generate_latest(_queue_registry), CONTENT_TYPE_LATEST
+
+
+@worker_init.connect
+def _start_worker_exporter(**kwargs):
+    # Workers serve no HTTP, so each worker container exposes its own metrics on a port of its
+    # own; the queue depths are left to the web container's /metrics.
+    if settings.METRICS_EXPORTER_PORT:
+        start_http_server(settings.METRICS_EXPORTER_PORT, registry=_process_registry())
+
+
+@worker_process_shutdown.connect
+def _on_worker_process_shutdown(pid=None, **kwargs):
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(pid or os.getpid())
+
+
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        response = self.get_response(request)
+        match = request.resolver_match
+        REQUEST_LATENCY.labels(
+            view=match.view_name if match else 'unresolved',
+            method=request.method,
+            status=response.status_code,
+        ).observe(time.perf_counter() - start)
+        return response
+
+
+_task_started = {}
+
+
+@task_prerun.connect
+def _on_task_prerun(task_id=None, **kwargs):
+    _task_started[task_id] = time.perf_counter()
+
+
+@task_postrun.connect
+def _on_task_postrun(task_id=None, task=None, state=None, **kwargs):
+    started = _task_started.pop(task_id, None)
+    if started is not None:
+        TASK_DURATION.labels(task=task.name).observe(time.perf_counter() - started)
+    if state == 'SUCCESS':
+        TASK_OUTCOMES.labels(task=task.name, outcome='success').inc()
+
+
+@task_failure.connect
+def _on_task_failure(sender=None, **kwargs):
+    TASK_OUTCOMES.labels(task=sender.name, outcome='failure').inc()
+
+
+@task_retry.connect
+def _on_task_retry(sender=None, **kwargs):
+    TASK_OUTCOMES.labels(task=sender.name, outcome='retry').inc()
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-19 17:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streaming', '0005_encode_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='poster',
+            field=models.FileField(blank=True, null=True, upload_to='videos/dash/'),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='thumbnails',
+            field=models.FileField(blank=True, null=True, upload_to='videos/dash/'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 17:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streaming', '0006_video_previews'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='is_live',
+            field=models.BooleanField(default=False),
+        ),
+    ]
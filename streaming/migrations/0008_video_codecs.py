@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-19 17:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streaming', '0007_video_is_live'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadsession',
+            name='codecs',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='codecs',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 17:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streaming', '0008_video_codecs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='packaging',
+            field=models.CharField(default='segments', max_length=16),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-19 17:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streaming', '0009_video_packaging'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='last_viewed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='unique_viewers',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='view_count',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.30 on 2026-10-19 17:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streaming', '0010_video_popularity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='encode_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='ExperimentRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('job_id', models.CharField(max_length=64, unique=True)),
+                ('trace', models.CharField(max_length=255)),
+                ('encode_version', models.PositiveIntegerField(default=0)),
+                ('result_path', models.CharField(max_length=255)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('duration_requested_ms', models.PositiveIntegerField(blank=True, null=True)),
+                ('play_time_ms', models.FloatField(default=0.0)),
+                ('startup_ms', models.FloatField(blank=True, null=True)),
+                ('stall_count', models.PositiveIntegerField(default=0)),
+                ('stall_time_ms', models.FloatField(default=0.0)),
+                ('total_buffering_ms', models.FloatField(default=0.0)),
+                ('switch_count', models.PositiveIntegerField(default=0)),
+                ('dropped_frames', models.PositiveIntegerField(default=0)),
+                ('avg_bitrate_kbps', models.FloatField(blank=True, null=True)),
+                ('qoe_mos', models.FloatField()),
+                ('ingested_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('video', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='experiment_runs', to='streaming.video')),
+            ],
+            options={
+                'ordering': ['-finished_at'],
+                'indexes': [models.Index(fields=['video', 'trace', 'encode_version'], name='streaming_e_video_i_3e61e9_idx'), models.Index(fields=['trace', 'encode_version'], name='streaming_e_trace_544680_idx')],
+            },
+        ),
+    ]
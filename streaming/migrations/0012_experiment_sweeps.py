@@ -0,0 +1,88 @@
+# Generated by Django 4.2.30 on 2026-10-19 17:28
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('streaming', '0011_experiment_runs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExperimentJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('job_id', models.UUIDField(default=uuid.uuid4, editable=False, unique=True)),
+                ('trace', models.CharField(max_length=255)),
+                ('encode_version', models.PositiveIntegerField(default=0)),
+                ('player_config', models.JSONField(blank=True, default=dict)),
+                ('config_hash', models.CharField(max_length=64)),
+                ('duration_ms', models.PositiveIntegerField()),
+                ('shard', models.CharField(blank=True, max_length=255)),
+                ('state', models.CharField(choices=[('queued', 'Queued'), ('done', 'Done'), ('failed', 'Failed')], db_index=True, default='queued', max_length=16)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ExperimentSweep',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('spec', models.JSONField()),
+                ('skipped', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='experimentrun',
+            name='config_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='experimentrun',
+            name='player_config',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddIndex(
+            model_name='experimentrun',
+            index=models.Index(fields=['video', 'trace', 'encode_version', 'config_hash', 'duration_requested_ms'], name='streaming_e_video_i_c34106_idx'),
+        ),
+        migrations.AddField(
+            model_name='experimentsweep',
+            name='created_by',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='experiment_sweeps', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='experimentjob',
+            name='run',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='job', to='streaming.experimentrun'),
+        ),
+        migrations.AddField(
+            model_name='experimentjob',
+            name='sweep',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='jobs', to='streaming.experimentsweep'),
+        ),
+        migrations.AddField(
+            model_name='experimentjob',
+            name='video',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='experiment_jobs', to='streaming.video'),
+        ),
+        migrations.AddIndex(
+            model_name='experimentjob',
+            index=models.Index(fields=['video', 'trace', 'encode_version', 'config_hash', 'duration_ms'], name='streaming_e_video_i_aa921e_idx'),
+        ),
+    ]
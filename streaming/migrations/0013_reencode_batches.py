@@ -0,0 +1,41 @@
+# Generated by Django 4.2.30 on 2026-10-19 17:36
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('streaming', '0012_experiment_sweeps'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReencodeBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('video_ids', models.JSONField(blank=True, default=list)),
+                ('max_in_flight', models.PositiveIntegerField(default=1)),
+                ('cost_budget', models.FloatField(default=0.0)),
+                ('priority', models.IntegerField(default=-1)),
+                ('state', models.CharField(choices=[('running', 'Running'), ('paused', 'Paused'), ('done', 'Done'), ('cancelled', 'Cancelled')], db_index=True, default='running', max_length=16)),
+                ('cursor', models.PositiveIntegerField(default=0)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reencode_batches', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='encodejob',
+            name='batch',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='jobs', to='streaming.reencodebatch'),
+        ),
+    ]
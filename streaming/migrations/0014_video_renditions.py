@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 17:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streaming', '0013_reencode_batches'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='renditions',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
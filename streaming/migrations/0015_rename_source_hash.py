@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 18:05
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streaming', '0014_video_renditions'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='video',
+            old_name='source_hash',
+            new_name='upload_digest',
+        ),
+    ]
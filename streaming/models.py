@@ -1,13 +1,17 @@
 from django.db import models
+from django.conf import settings
 from django.core.exceptions import ValidationError
+from django.urls import reverse
 from django.utils import timezone
 import os
+import uuid
+
+ALLOWED_VIDEO_EXTENSIONS = (".mp4", ".mov", ".avi", ".mkv", ".webm")
 
 def validate_video_file(value):
     ext = os.path.splitext(value.name)[1].lower()
-    allowed_extensions = (".mp4", ".mov", ".avi", ".mkv", ".webm")
 
-    if ext not in allowed_extensions:
+    if ext not in ALLOWED_VIDEO_EXTENSIONS:
         raise ValidationError("Only video files are allowed (mp4, mov, avi, mkv, webm).")
 
 
@@ -26,13 +30,47 @@ class Video(models.Model):
         null=True,
     )
     
+    poster = models.FileField(
+        upload_to='videos/dash/',
+        blank=True,
+        null=True,
+    )
+    
+    thumbnails = models.FileField(
+        upload_to='videos/dash/',
+        blank=True,
+        null=True,
+    )
+    
     dash_base_path = models.CharField(
         max_length=255,
         blank=True,
     )
     
+    # 'segments': one file per segment; 'on_demand': one file per rendition plus a byte-range index.
+    packaging = models.CharField(
+        max_length=16,
+        default='segments',
+    )
+    
     processing = models.BooleanField(default=False)
     dash_ready = models.BooleanField(default=False)
+    is_live = models.BooleanField(default=False)
+    
+    # Codecs to encode, in order of preference; empty means ENCODE_DEFAULT_CODECS.
+    codecs = models.JSONField(default=list, blank=True)
+    
+    # Bumped by every successful encode, so experiment runs can be compared across ladders.
+    encode_version = models.PositiveIntegerField(default=0)
+    
+    # Video renditions of the current encode and its first and longest segment durations, for the
+    # player's start-up hints (see packaging.manifest_renditions).
+    renditions = models.JSONField(default=dict, blank=True)
+    
+    # Flushed from the Redis popularity counters by a periodic task.
+    view_count = models.PositiveBigIntegerField(default=0)
+    unique_viewers = models.PositiveIntegerField(default=0)
+    last_viewed_at = models.DateTimeField(null=True, blank=True)
     
     created_at = models.DateTimeField(default=timezone.now)
     duration = models.FloatField(
@@ -40,6 +78,21 @@ class Video(models.Model):
         blank=True,
     )
     
+    # uploads.upload_digest of a chunked upload: distinguishes one upload of the source from the
+    # next. Not a hash of the file, it depends on the chunk sizes, so equal files can differ.
+    upload_digest = models.CharField(
+        max_length=64,
+        blank=True,
+    )
+    
+    uploaded_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='videos',
+    )
+    
     def __str__(self):
         return self.title
     
@@ -51,9 +104,324 @@ class Video(models.Model):
         """Check if video is ready for adaptive streaming"""
         return self.dash_ready and bool(self.dash_manifest)
     
+    def dash_version_path(self, version):
+        """Storage directory of one encode; a re-encode writes a new one and leaves the old in place"""
+        return f'dash/{self.pk}/v{version}'
+    
     @property
     def manifest_url(self):
         """Get the URL for the DASH manifest"""
         if self.dash_manifest:
-            return self.dash_manifest.url
-        return None
\ No newline at end of file
+            name = os.path.basename(self.dash_manifest.name)
+            if self.dash_base_path == self.dash_version_path(self.encode_version):
+                return reverse('dash_version_file', args=[self.pk, self.encode_version, name])
+            return reverse('dash_file', args=[self.pk, name])
+        return None
+    
+    @property
+    def poster_url(self):
+        """Get the URL for the poster frame"""
+        if self.poster:
+            return self.poster.url
+        return None
+    
+    @property
+    def thumbnails_url(self):
+        """Get the URL for the WebVTT seek-preview index"""
+        if self.thumbnails:
+            return self.thumbnails.url
+        return None
+    
+    @property
+    def requested_codecs(self):
+        return self.codecs or settings.ENCODE_DEFAULT_CODECS
+    
+    @property
+    def source_key(self):
+        """Identifies the version of the uploaded source that an encode belongs to"""
+        return self.upload_digest or self.video.name
+    
+    ENCODE_INPUTS = ('video', 'upload_digest', 'codecs')
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if all(name in field_names for name in cls.ENCODE_INPUTS):
+            instance.remember_encode_inputs()
+        return instance
+    
+    def _encode_inputs(self):
+        return (self.video.name or '', self.upload_digest, list(self.codecs or []))
+    
+    def remember_encode_inputs(self):
+        self._loaded_encode_inputs = self._encode_inputs()
+    
+    def encode_inputs_changed(self):
+        """Whether the source or the requested codecs differ from when the row was loaded or last
+        saved; always True for new instances and ones loaded without those fields"""
+        loaded = getattr(self, '_loaded_encode_inputs', None)
+        return loaded is None or loaded != self._encode_inputs()
+
+
+class EncodeJob(models.Model):
+    QUEUED = 'queued'
+    DISPATCHED = 'dispatched'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    
+    STATE_CHOICES = [
+        (QUEUED, 'Queued'),
+        (DISPATCHED, 'Dispatched'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+    
+    ACTIVE_STATES = (QUEUED, DISPATCHED, RUNNING)
+    IN_FLIGHT_STATES = (DISPATCHED, RUNNING)
+    
+    video = models.ForeignKey(Video, on_delete=models.CASCADE, related_name='encode_jobs')
+    owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='encode_jobs',
+    )
+    
+    # Makes dispatch idempotent: one job per video per source version.
+    dispatch_key = models.CharField(max_length=255, unique=True)
+    
+    batch = models.ForeignKey(
+        'ReencodeBatch',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='jobs',
+    )
+    
+    priority = models.IntegerField(default=0)
+    estimated_cost = models.FloatField(default=0.0)
+    state = models.CharField(max_length=16, choices=STATE_CHOICES, default=QUEUED, db_index=True)
+    error = models.TextField(blank=True)
+    
+    created_at = models.DateTimeField(default=timezone.now)
+    dispatched_at = models.DateTimeField(null=True, blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"{self.video_id} [{self.state}] {self.dispatch_key}"
+    
+    class Meta:
+        ordering = ['created_at']
+
+
+class ReencodeBatch(models.Model):
+    """Re-encode of selected videos or the whole catalogue, admitted a few at a time in id order"""
+    RUNNING = 'running'
+    PAUSED = 'paused'
+    DONE = 'done'
+    CANCELLED = 'cancelled'
+    
+    STATE_CHOICES = [
+        (RUNNING, 'Running'),
+        (PAUSED, 'Paused'),
+        (DONE, 'Done'),
+        (CANCELLED, 'Cancelled'),
+    ]
+    
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='reencode_batches',
+    )
+    
+    # Empty means every encoded video.
+    video_ids = models.JSONField(default=list, blank=True)
+    
+    # Throttle: jobs of this batch queued or encoding at once, and their summed estimated cost in
+    # rung-seconds (0 for no limit). Re-encodes run below the priority of new uploads.
+    max_in_flight = models.PositiveIntegerField(default=1)
+    cost_budget = models.FloatField(default=0.0)
+    priority = models.IntegerField(default=-1)
+    
+    state = models.CharField(max_length=16, choices=STATE_CHOICES, default=RUNNING, db_index=True)
+    
+    # Highest video id admitted so far; admission resumes after it.
+    cursor = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    
+    created_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"Re-encode {self.pk} [{self.state}]"
+    
+    class Meta:
+        ordering = ['-created_at']
+
+class UploadSession(models.Model):
+    """Resumable chunked upload that is written straight into videos/originals/"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='upload_sessions',
+    )
+    
+    title = models.CharField(max_length=100)
+    description = models.TextField(blank=True)
+    filename = models.CharField(max_length=255)
+    path = models.CharField(max_length=255)
+    length = models.BigIntegerField()
+    
+    codecs = models.JSONField(default=list, blank=True)
+    
+    # [start, end, sha256 hex digest or None while the chunk is still being written]
+    chunks = models.JSONField(default=list)
+    
+    probe_state = models.CharField(max_length=16, blank=True)
+    duration = models.FloatField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    
+    video = models.OneToOneField(
+        Video,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='upload_session',
+    )
+    
+    created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.filename} ({self.offset}/{self.length})"
+    
+    @property
+    def offset(self):
+        """Length of the contiguous prefix that has been fully written"""
+        offset = 0
+        for start, end, digest in sorted(self.chunks):
+            if start > offset or digest is None:
+                break
+            offset = max(offset, end)
+        return offset
+    
+    @property
+    def is_complete(self):
+        return self.offset >= self.length
+    
+    @property
+    def is_failed(self):
+        return bool(self.error)
+
+
+class ExperimentRun(models.Model):
+    """One network-emulation playback, with its QoE metrics computed at ingest"""
+    video = models.ForeignKey(Video, on_delete=models.CASCADE, related_name='experiment_runs')
+    job_id = models.CharField(max_length=64, unique=True)
+    trace = models.CharField(max_length=255)
+    encode_version = models.PositiveIntegerField(default=0)
+    result_path = models.CharField(max_length=255)
+    
+    # Shaka player configuration the run was played with, and its hash for matching equal configs.
+    player_config = models.JSONField(default=dict, blank=True)
+    config_hash = models.CharField(max_length=64, blank=True)
+    
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    duration_requested_ms = models.PositiveIntegerField(null=True, blank=True)
+    
+    play_time_ms = models.FloatField(default=0.0)
+    startup_ms = models.FloatField(null=True, blank=True)
+    stall_count = models.PositiveIntegerField(default=0)
+    stall_time_ms = models.FloatField(default=0.0)
+    total_buffering_ms = models.FloatField(default=0.0)
+    switch_count = models.PositiveIntegerField(default=0)
+    dropped_frames = models.PositiveIntegerField(default=0)
+    avg_bitrate_kbps = models.FloatField(null=True, blank=True)
+    qoe_mos = models.FloatField()
+    
+    ingested_at = models.DateTimeField(default=timezone.now)
+    
+    def __str__(self):
+        return f"{self.video_id} {self.trace} v{self.encode_version}"
+    
+    class Meta:
+        ordering = ['-finished_at']
+        indexes = [
+            models.Index(fields=['video', 'trace', 'encode_version']),
+            models.Index(fields=['trace', 'encode_version']),
+            models.Index(fields=['video', 'trace', 'encode_version', 'config_hash', 'duration_requested_ms']),
+        ]
+
+
+class ExperimentSweep(models.Model):
+    """A videos x traces x player configs x durations matrix of emulation runs"""
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='experiment_sweeps',
+    )
+    spec = models.JSONField()
+    skipped = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    def __str__(self):
+        return f"Sweep {self.pk} ({self.created_at:%Y-%m-%d %H:%M})"
+    
+    class Meta:
+        ordering = ['-created_at']
+
+
+class ExperimentJob(models.Model):
+    """One combination of a sweep, queued for an emulation runner"""
+    QUEUED = 'queued'
+    DONE = 'done'
+    FAILED = 'failed'
+    
+    STATE_CHOICES = [
+        (QUEUED, 'Queued'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+    
+    job_id = models.UUIDField(unique=True, default=uuid.uuid4, editable=False)
+    sweep = models.ForeignKey(ExperimentSweep, on_delete=models.CASCADE, related_name='jobs')
+    video = models.ForeignKey(Video, on_delete=models.CASCADE, related_name='experiment_jobs')
+    trace = models.CharField(max_length=255)
+    encode_version = models.PositiveIntegerField(default=0)
+    player_config = models.JSONField(default=dict, blank=True)
+    config_hash = models.CharField(max_length=64)
+    duration_ms = models.PositiveIntegerField()
+    
+    # Runner whose queue the job was pushed to; empty for the shared queue.
+    shard = models.CharField(max_length=255, blank=True)
+    state = models.CharField(max_length=16, choices=STATE_CHOICES, default=QUEUED, db_index=True)
+    error = models.TextField(blank=True)
+    run = models.OneToOneField(
+        ExperimentRun,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='job',
+    )
+    
+    created_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"{self.video_id} {self.trace} [{self.state}]"
+    
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['video', 'trace', 'encode_version', 'config_hash', 'duration_ms']),
+        ]
@@ -0,0 +1,351 @@
+import json
+import os
+import struct
+import xml.etree.ElementTree as ET
+
+SEGMENTS = 'segments'
+ON_DEMAND = 'on_demand'
+PACKAGING_MODES = (SEGMENTS, ON_DEMAND)
+
+MPD_NS = 'urn:mpeg:dash:schema:mpd:2011'
+NS = {'mpd': MPD_NS}
+
+INDEX_SUFFIX = '.index.json'
+
+# EBML element ids used to walk a WebM file.
+EBML_SEGMENT = 0x18538067
+EBML_INFO = 0x1549A966
+EBML_TIMECODE_SCALE = 0x2AD7B1
+EBML_DURATION = 0x4489
+EBML_CUES = 0x1C53BB6B
+EBML_CUE_POINT = 0xBB
+EBML_CUE_TIME = 0xB3
+EBML_CUE_TRACK_POSITIONS = 0xB7
+EBML_CUE_CLUSTER_POSITION = 0xF1
+
+
+class PackagingError(ValueError):
+    pass
+
+
+def index_path(media_path):
+    return os.path.splitext(media_path)[0] + INDEX_SUFFIX
+
+
+def _read_sidx(f):
+    """Subsegment byte ranges from the top-level sidx box of a single-file MP4"""
+    offset = 0
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+
+    while offset < size:
+        f.seek(offset)
+        header = f.read(8)
+        if len(header) < 8:
+            break
+        box_size, box_type = struct.unpack('>I4s', header)
+        header_size = 8
+        if box_size == 1:
+            box_size = struct.unpack('>Q', f.read(8))[0]
+            header_size = 16
+        elif box_size == 0:
+            box_size = size - offset
+
+        if box_type == b'sidx':
+            body = f.read(box_size - header_size)
+            version = body[0]
+            timescale = struct.unpack_from('>I', body, 8)[0]
+            if version == 0:
+                earliest, first_offset = struct.unpack_from('>II', body, 12)
+                pos = 20
+            else:
+                earliest, first_offset = struct.unpack_from('>QQ', body, 12)
+                pos = 28
+            count = struct.unpack_from('>H', body, pos + 2)[0]
+            pos += 4
+
+            start = offset + box_size + first_offset
+            t = earliest
+            segments = []
+            for _ in range(count):
+                ref, duration, _sap = struct.unpack_from('>III', body, pos)
+                pos += 12
+                ref_size = ref & 0x7FFFFFFF
+                segments.append([t, duration, start, start + ref_size - 1])
+                t += duration
+                start += ref_size
+
+            return {
+                'timescale': timescale,
+                'init': [0, offset - 1],
+                'index': [offset, offset + box_size - 1],
+                'segments': segments,
+            }
+
+        offset += box_size
+
+    raise PackagingError("No sidx box found")
+
+
+def _read_vint(f, strip_marker):
+    first = f.read(1)
+    if not first:
+        raise PackagingError("Unexpected end of file")
+    value = first[0]
+    length = 1
+    mask = 0x80
+    while length <= 8 and not value & mask:
+        mask >>= 1
+        length += 1
+    if length > 8:
+        raise PackagingError("Invalid EBML variable-length integer")
+    if strip_marker:
+        value &= mask - 1
+    for byte in f.read(length - 1):
+        value = (value << 8) | byte
+    return value, length
+
+
+def _read_element(f):
+    element_id, id_length = _read_vint(f, strip_marker=False)
+    size, size_length = _read_vint(f, strip_marker=True)
+    return element_id, size, id_length + size_length
+
+
+def _children(f, start, end):
+    pos = start
+    while pos < end:
+        f.seek(pos)
+        element_id, size, header_size = _read_element(f)
+        yield element_id, pos + header_size, size
+        pos += header_size + size
+
+
+def _read_uint(f, pos, size):
+    f.seek(pos)
+    return int.from_bytes(f.read(size), 'big')
+
+
+def _read_float(f, pos, size):
+    f.seek(pos)
+    return struct.unpack('>f' if size == 4 else '>d', f.read(size))[0]
+
+
+def _read_cues(f):
+    """Cluster byte ranges from the Cues of a single-file WebM"""
+    f.seek(0, os.SEEK_END)
+    file_size = f.tell()
+
+    segment_start = segment_end = None
+    for element_id, data_start, size in _children(f, 0, file_size):
+        if element_id == EBML_SEGMENT:
+            segment_start = data_start
+            segment_end = min(data_start + size, file_size)
+            break
+    if segment_start is None:
+        raise PackagingError("No Segment element found")
+
+    timecode_scale = 1000000
+    duration = None
+    cues = None
+    for element_id, data_start, size in _children(f, segment_start, segment_end):
+        if element_id == EBML_INFO:
+            for child_id, child_start, child_size in _children(f, data_start, data_start + size):
+                if child_id == EBML_TIMECODE_SCALE:
+                    timecode_scale = _read_uint(f, child_start, child_size)
+                elif child_id == EBML_DURATION:
+                    duration = _read_float(f, child_start, child_size)
+        elif element_id == EBML_CUES:
+            cues = (data_start, size)
+    if cues is None:
+        raise PackagingError("No Cues element found")
+
+    points = []
+    cues_start, cues_size = cues
+    for element_id, data_start, size in _children(f, cues_start, cues_start + cues_size):
+        if element_id != EBML_CUE_POINT:
+            continue
+        time = position = None
+        for child_id, child_start, child_size in _children(f, data_start, data_start + size):
+            if child_id == EBML_CUE_TIME:
+                time = _read_uint(f, child_start, child_size)
+            elif child_id == EBML_CUE_TRACK_POSITIONS and position is None:
+                for pos_id, pos_start, pos_size in _children(f, child_start, child_start + child_size):
+                    if pos_id == EBML_CUE_CLUSTER_POSITION:
+                        position = _read_uint(f, pos_start, pos_size)
+        if time is not None and position is not None:
+            points.append((time, segment_start + position))
+    points.sort()
+    if not points:
+        raise PackagingError("Cues element is empty")
+
+    segments = []
+    for i, (time, start) in enumerate(points):
+        f.seek(start)
+        _, size, header_size = _read_element(f)
+        if i + 1 < len(points):
+            end_time = points[i + 1][0]
+        else:
+            end_time = int(duration) if duration else time
+        segments.append([time, end_time - time, start, start + header_size + size - 1])
+
+    # WebM timestamps are in TimecodeScale nanoseconds, so the timescale is ticks per second.
+    return {
+        'timescale': 1000000000 // timecode_scale,
+        'init': [0, points[0][1] - 1],
+        'index': [cues_start, cues_start + cues_size - 1],
+        'segments': segments,
+    }
+
+
+def build_index(media_path):
+    """Read the byte-range index of a single-file rendition"""
+    with open(media_path, 'rb') as f:
+        if media_path.endswith('.webm'):
+            return _read_cues(f)
+        return _read_sidx(f)
+
+
+def write_index(media_path):
+    index = build_index(media_path)
+    path = index_path(media_path)
+    with open(path, 'w') as f:
+        json.dump(index, f)
+    return path
+
+
+def group_segments(segments, timescale, target_duration, startup_duration=0.0):
+    """Merge consecutive subsegments until each group spans at least target_duration seconds
+
+    Subsegments starting within the first startup_duration seconds are kept as they are, in every
+    rendition: the short startup segments the video was encoded with (ENCODE_STARTUP_SEGMENTS), and
+    the audio cut alongside them. Merging them would undo the faster start they were encoded for.
+    """
+    target = target_duration * timescale
+    startup_end = segments[0][0] + startup_duration * timescale if segments else 0
+
+    groups = []
+    head = 0
+    while head < len(segments) and segments[head][0] < startup_end:
+        groups.append(list(segments[head]))
+        head += 1
+
+    current = None
+    for t, duration, start, end in segments[head:]:
+        if current is None or current[1] >= target:
+            current = [t, 0, start, end]
+            groups.append(current)
+        current[1] += duration
+        current[3] = end
+    return groups
+
+
+def _timeline(parent, groups):
+    timeline = ET.SubElement(parent, f'{{{MPD_NS}}}SegmentTimeline')
+    last = None
+    expected_t = None
+    for t, duration, _, _ in groups:
+        if last is not None and last.get('d') == str(duration) and t == expected_t:
+            last.set('r', str(int(last.get('r', 0)) + 1))
+        else:
+            last = ET.SubElement(timeline, f'{{{MPD_NS}}}S', {'t': str(t), 'd': str(duration)})
+        expected_t = t + duration
+
+
+def segment_list_manifest(mpd_text, indices, target_duration, startup_duration=0.0):
+    """Rewrite an on-demand (SegmentBase) MPD into SegmentList form with segments of about
+    target_duration seconds, addressed as byte ranges of each rendition's single file
+
+    indices maps a Representation BaseURL to the index written by write_index. The first
+    startup_duration seconds keep their original segments (see group_segments).
+    """
+    ET.register_namespace('', MPD_NS)
+    root = ET.fromstring(mpd_text)
+
+    for rep in root.iter(f'{{{MPD_NS}}}Representation'):
+        base_url = rep.find('mpd:BaseURL', NS)
+        segment_base = rep.find('mpd:SegmentBase', NS)
+        if base_url is None or segment_base is None:
+            continue
+        index = indices.get(base_url.text.strip())
+        if index is None:
+            continue
+
+        groups = group_segments(index['segments'], index['timescale'], target_duration, startup_duration)
+        position = list(rep).index(segment_base)
+        rep.remove(segment_base)
+
+        segment_list = ET.Element(f'{{{MPD_NS}}}SegmentList', {'timescale': str(index['timescale'])})
+        ET.SubElement(segment_list, f'{{{MPD_NS}}}Initialization', {'range': '{}-{}'.format(*index['init'])})
+        _timeline(segment_list, groups)
+        for _, _, start, end in groups:
+            ET.SubElement(segment_list, f'{{{MPD_NS}}}SegmentURL', {'mediaRange': f'{start}-{end}'})
+        rep.insert(position, segment_list)
+
+    return ET.tostring(root, encoding='unicode', xml_declaration=True)
+
+
+def load_indices(dash_dir):
+    """Indices for every rendition in a packaged video directory, keyed by media file name"""
+    indices = {}
+    for name in os.listdir(dash_dir):
+        if not name.endswith(INDEX_SUFFIX):
+            continue
+        stem = name[:-len(INDEX_SUFFIX)]
+        with open(os.path.join(dash_dir, name)) as f:
+            index = json.load(f)
+        for ext in ('.webm', '.mp4'):
+            if os.path.exists(os.path.join(dash_dir, stem + ext)):
+                indices[stem + ext] = index
+    return indices
+
+
+def _segment_durations(rep, adaptation, indices):
+    """Durations in seconds of a representation's segments, from its SegmentTimeline or its index"""
+    template = rep.find('mpd:SegmentTemplate', NS)
+    if template is None:
+        template = adaptation.find('mpd:SegmentTemplate', NS)
+    if template is not None and template.find('mpd:SegmentTimeline', NS) is not None:
+        timescale = int(template.get('timescale', 1))
+        durations = []
+        for s in template.find('mpd:SegmentTimeline', NS).findall('mpd:S', NS):
+            durations += [int(s.get('d')) / timescale] * (int(s.get('r', 0)) + 1)
+        return durations
+
+    base_url = rep.find('mpd:BaseURL', NS)
+    index = indices.get(base_url.text.strip()) if base_url is not None else None
+    if index is not None:
+        return [duration / index['timescale'] for _, duration, _, _ in index['segments']]
+    return []
+
+
+def manifest_renditions(mpd_text, indices=None):
+    """Video renditions of a packaged MPD, lowest bandwidth first, with the duration of the first
+    and of the longest segment in seconds"""
+    root = ET.fromstring(mpd_text)
+    renditions = []
+    first_segment = None
+    longest_segment = None
+
+    for adaptation in root.iter(f'{{{MPD_NS}}}AdaptationSet'):
+        for rep in adaptation.findall('mpd:Representation', NS):
+            mime_type = rep.get('mimeType') or adaptation.get('mimeType') or ''
+            if (adaptation.get('contentType') or mime_type.split('/')[0]) != 'video':
+                continue
+            renditions.append({
+                'id': rep.get('id'),
+                'bandwidth': int(rep.get('bandwidth', 0)),
+                'width': int(rep.get('width') or adaptation.get('width') or 0),
+                'height': int(rep.get('height') or adaptation.get('height') or 0),
+                'codecs': rep.get('codecs') or adaptation.get('codecs') or '',
+            })
+            durations = _segment_durations(rep, adaptation, indices or {})
+            if durations:
+                first_segment = max(first_segment or 0, durations[0])
+                longest_segment = max(longest_segment or 0, max(durations))
+
+    return {
+        'renditions': sorted(renditions, key=lambda r: r['bandwidth']),
+        'first_segment': first_segment,
+        'longest_segment': longest_segment,
+    }
@@ -0,0 +1,200 @@
+import hashlib
+import logging
+import os
+import re
+import time
+import redis
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db.models import F
+from django.utils import timezone
+from .models import Video
+from .packaging import ON_DEMAND, load_indices
+
+logger = logging.getLogger(__name__)
+
+VIEWS_KEY = 'popularity:views:{}'
+VIEWERS_KEY = 'popularity:viewers:{}'
+HITS_KEY = 'popularity:hits:{}'
+DIRTY_KEY = 'popularity:dirty'
+HOT_KEY = 'popularity:hot'
+TRENDING_KEY = 'popularity:trending'
+
+SEGMENT_RE = re.compile(r'^seg_(.+)_(\d+)\.\w+$')
+
+_client = None
+
+
+def get_redis():
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.REDIS_URL, socket_timeout=1, socket_connect_timeout=1)
+    return _client
+
+
+def client_id(request):
+    """Anonymous identifier of the address and browser of a request; reads neither session nor user"""
+    raw = '{}|{}'.format(request.META.get('REMOTE_ADDR', ''), request.headers.get('User-Agent', ''))
+    return hashlib.sha1(raw.encode()).hexdigest()[:16]
+
+
+def viewer_id(request):
+    """Stable, anonymous identifier for counting unique viewers"""
+    if request.user.is_authenticated:
+        return f'u{request.user.pk}'
+    return client_id(request)
+
+
+def _hour(ts=None):
+    return int((ts or time.time()) // 3600)
+
+
+def record_view(video_id, viewer):
+    """Count a manifest fetch; a handful of pipelined Redis writes, never raises"""
+    hits_key = HITS_KEY.format(_hour())
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.incr(VIEWS_KEY.format(video_id))
+        pipe.pfadd(VIEWERS_KEY.format(video_id), viewer)
+        pipe.zincrby(hits_key, 1, video_id)
+        pipe.expire(hits_key, (settings.POPULARITY_TRENDING_WINDOW + 1) * 3600)
+        pipe.sadd(DIRTY_KEY, video_id)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning("Could not record view of video %s: %s", video_id, e)
+
+
+def flush_counters(batch_size=500):
+    """Move pending view counts from Redis into Video rows; returns the number of videos updated"""
+    r = get_redis()
+    updated = 0
+    while True:
+        video_ids = [int(v) for v in r.spop(DIRTY_KEY, batch_size) or []]
+        if not video_ids:
+            return updated
+
+        pipe = r.pipeline(transaction=False)
+        for video_id in video_ids:
+            pipe.getset(VIEWS_KEY.format(video_id), 0)
+            pipe.pfcount(VIEWERS_KEY.format(video_id))
+        results = pipe.execute()
+
+        now = timezone.now()
+        for i, video_id in enumerate(video_ids):
+            views = int(results[2 * i] or 0)
+            updated += Video.objects.filter(pk=video_id).update(
+                view_count=F('view_count') + views,
+                unique_viewers=results[2 * i + 1],
+                last_viewed_at=now,
+            )
+
+
+def trending(limit):
+    """Video ids ordered by manifest fetches, with hourly buckets decaying by POPULARITY_HALF_LIFE"""
+    r = get_redis()
+    now = _hour()
+    weights = {
+        HITS_KEY.format(now - age): 0.5 ** (age / settings.POPULARITY_HALF_LIFE)
+        for age in range(settings.POPULARITY_TRENDING_WINDOW)
+    }
+    r.zunionstore(TRENDING_KEY, weights)
+    r.expire(TRENDING_KEY, 3600)
+    return [
+        int(video_id)
+        for video_id, score in r.zrevrange(TRENDING_KEY, 0, limit - 1, withscores=True)
+        if score >= settings.POPULARITY_HOT_MIN_SCORE
+    ]
+
+
+def segment_cache_key(video, name, byte_range=None):
+    suffix = '{}-{}'.format(*byte_range) if byte_range else 'all'
+    return f'dash-segment:{video.pk}:{video.source_key}:{video.encode_version}:{name}:{suffix}'
+
+
+def cached_segment(video, name, byte_range=None):
+    """Pre-warmed bytes of a segment, or None when it is not in the hot set"""
+    if not settings.POPULARITY_PREWARM_SEGMENTS:
+        return None
+    try:
+        return cache.get(segment_cache_key(video, name, byte_range))
+    except redis.RedisError as e:
+        logger.warning("Segment cache unavailable: %s", e)
+        return None
+
+
+def _warm_keys_key(video_id):
+    return f'dash-warm:{video_id}'
+
+
+def _first_segments(video, dash_dir):
+    """(name, byte_range) of the init and first POPULARITY_PREWARM_SEGMENTS segments of every rendition"""
+    count = settings.POPULARITY_PREWARM_SEGMENTS
+    if video.packaging == ON_DEMAND:
+        for name, index in load_indices(dash_dir).items():
+            yield name, tuple(index['init'])
+            for _, _, start, end in index['segments'][:count]:
+                yield name, (start, end)
+        return
+
+    for name in os.listdir(dash_dir):
+        match = SEGMENT_RE.match(name)
+        if name.startswith('init_') or (match and int(match.group(2)) <= count):
+            yield name, None
+
+
+def _read(path, byte_range):
+    with open(path, 'rb') as f:
+        if byte_range is None:
+            return f.read(settings.POPULARITY_PREWARM_MAX_BYTES + 1)
+        start, end = byte_range
+        f.seek(start)
+        return f.read(min(end - start + 1, settings.POPULARITY_PREWARM_MAX_BYTES + 1))
+
+
+def warm_video(video):
+    dash_dir = default_storage.path(video.dash_base_path or f'dash/{video.pk}')
+    entries = {}
+    for name, byte_range in _first_segments(video, dash_dir):
+        data = _read(os.path.join(dash_dir, name), byte_range)
+        if len(data) > settings.POPULARITY_PREWARM_MAX_BYTES:
+            continue
+        entries[segment_cache_key(video, name, byte_range)] = data
+
+    timeout = settings.POPULARITY_PREWARM_TIMEOUT
+    cache.set_many(entries, timeout)
+    cache.set(_warm_keys_key(video.pk), list(entries), timeout)
+    return len(entries)
+
+
+def demote_video(video_id):
+    keys = cache.get(_warm_keys_key(video_id)) or []
+    cache.delete_many(keys + [_warm_keys_key(video_id)])
+
+
+def refresh_hot_set():
+    """Warm the first segments of trending videos and evict videos that fell out of the hot set"""
+    r = get_redis()
+    hot_ids = trending(settings.POPULARITY_HOT_SET_SIZE)
+    previous = {int(v) for v in r.smembers(HOT_KEY)}
+
+    warmed = []
+    videos = Video.objects.filter(pk__in=hot_ids, dash_ready=True, is_live=False)
+    for video in videos:
+        try:
+            warm_video(video)
+        except OSError:
+            logger.exception("Could not pre-warm video %s", video.pk)
+            continue
+        warmed.append(video.pk)
+
+    cold = previous - set(warmed)
+    for video_id in cold:
+        demote_video(video_id)
+
+    pipe = r.pipeline()
+    pipe.delete(HOT_KEY)
+    if warmed:
+        pipe.sadd(HOT_KEY, *warmed)
+    pipe.execute()
+    return {'warmed': warmed, 'demoted': sorted(cold)}
@@ -0,0 +1,234 @@
+import cProfile
+import functools
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import time
+import uuid
+from datetime import datetime
+from celery import current_task
+from django.conf import settings
+from django.core import signing
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+SIGNING_SALT = 'streaming.profiling'
+PROFILE_NAME_RE = re.compile(r'^[\w.-]+\.(prof|json)$')
+
+
+def make_profile_token():
+    """Value for the profiling header that forces a profile of the request it is sent with"""
+    return signing.dumps({'nonce': uuid.uuid4().hex}, salt=SIGNING_SALT)
+
+
+def _valid_token(token):
+    try:
+        signing.loads(token, salt=SIGNING_SALT, max_age=settings.PROFILING_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    return True
+
+
+class QueryRecorder:
+    """connection.execute_wrapper hook that records every SQL statement and its duration"""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - start))
+
+    def summary(self, limit=10):
+        slowest = sorted(self.queries, key=lambda q: q[1], reverse=True)[:limit]
+        return {
+            'count': len(self.queries),
+            'total_ms': round(sum(t for _, t in self.queries) * 1000, 3),
+            'slowest': [{'sql': sql[:500], 'ms': round(t * 1000, 3)} for sql, t in slowest],
+        }
+
+
+def _top_functions(profiler, limit=30):
+    stats = pstats.Stats(profiler, stream=io.StringIO())
+    rows = []
+    for (filename, line, func), (_, ncalls, tottime, cumtime, _) in stats.stats.items():
+        rows.append({
+            'function': f'{filename}:{line}({func})',
+            'calls': ncalls,
+            'tottime_ms': round(tottime * 1000, 3),
+            'cumtime_ms': round(cumtime * 1000, 3),
+        })
+    rows.sort(key=lambda r: r['cumtime_ms'], reverse=True)
+    return rows[:limit]
+
+
+def _prune(profile_dir):
+    profiles = [e for e in os.scandir(profile_dir) if e.is_file() and PROFILE_NAME_RE.match(e.name)]
+    total = sum(e.stat().st_size for e in profiles)
+    # Stems start with a timestamp, so sorting them puts the oldest first.
+    stems = sorted({os.path.splitext(e.name)[0] for e in profiles})
+
+    while stems and (len(stems) > settings.PROFILING_MAX_PROFILES or total > settings.PROFILING_MAX_BYTES):
+        stem = stems.pop(0)
+        for ext in ('.prof', '.json'):
+            path = os.path.join(profile_dir, stem + ext)
+            try:
+                total -= os.path.getsize(path)
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def save_profile(kind, name, profiler, queries, wall_time, extra=None):
+    """Write a .prof/.json pair to the profile store and trim it back to its size limits"""
+    profile_dir = settings.PROFILING_DIR
+    os.makedirs(profile_dir, exist_ok=True)
+
+    stem = '{}_{}_{}_{}'.format(
+        datetime.now().strftime('%Y%m%dT%H%M%S%f'),
+        kind,
+        re.sub(r'[^\w.-]', '_', name)[:80],
+        uuid.uuid4().hex[:8],
+    )
+
+    profiler.dump_stats(os.path.join(profile_dir, stem + '.prof'))
+    summary = {
+        'id': stem,
+        'kind': kind,
+        'name': name,
+        'created_at': time.time(),
+        'wall_ms': round(wall_time * 1000, 3),
+        'sql': queries.summary(),
+        'functions': _top_functions(profiler),
+        **(extra or {}),
+    }
+    with open(os.path.join(profile_dir, stem + '.json'), 'w') as f:
+        json.dump(summary, f)
+
+    try:
+        _prune(profile_dir)
+    except OSError:
+        logger.exception("Could not prune profile store")
+    return stem
+
+
+def list_profiles():
+    profile_dir = settings.PROFILING_DIR
+    if not os.path.isdir(profile_dir):
+        return []
+
+    summaries = []
+    for entry in os.scandir(profile_dir):
+        if not entry.name.endswith('.json'):
+            continue
+        try:
+            with open(entry.path) as f:
+                summary = json.load(f)
+        except (OSError, ValueError):
+            continue
+        summary.pop('functions', None)
+        summary['sql'].pop('slowest', None)
+        summaries.append(summary)
+    summaries.sort(key=lambda s: s['created_at'], reverse=True)
+    return summaries
+
+
+def profile_path(name):
+    if not PROFILE_NAME_RE.match(name):
+        return None
+    path = os.path.join(settings.PROFILING_DIR, name)
+    return path if os.path.isfile(path) else None
+
+
+def _run_profiled(func, *args, **kwargs):
+    profiler = cProfile.Profile()
+    queries = QueryRecorder()
+    start = time.perf_counter()
+    with connection.execute_wrapper(queries):
+        profiler.enable()
+        try:
+            return func(*args, **kwargs), profiler, queries, start
+        finally:
+            profiler.disable()
+
+
+class ProfilingMiddleware:
+    """Profiles a sampled fraction of requests, plus any request carrying a signed profiling header"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def _should_profile(self, request):
+        if not settings.PROFILING_ENABLED:
+            return False
+        token = request.headers.get(settings.PROFILING_HEADER)
+        if token:
+            return _valid_token(token)
+        return random.random() < settings.PROFILING_SAMPLE_RATE
+
+    def __call__(self, request):
+        if not self._should_profile(request):
+            return self.get_response(request)
+
+        response, profiler, queries, start = _run_profiled(self.get_response, request)
+        wall_time = time.perf_counter() - start
+
+        match = request.resolver_match
+        name = match.view_name if match else 'unresolved'
+        try:
+            profile_id = save_profile('view', name, profiler, queries, wall_time, {
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+            })
+            response['X-Profile-Id'] = profile_id
+        except OSError:
+            logger.exception("Could not store profile for %s", name)
+        return response
+
+
+def profile_task(func):
+    """Profile a sampled fraction of task runs, or runs sent with the 'profile' header"""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not settings.PROFILING_ENABLED:
+            return func(*args, **kwargs)
+
+        request = current_task.request if current_task else None
+        forced = bool(getattr(request, 'profile', False))
+        if not forced and random.random() >= settings.PROFILING_TASK_SAMPLE_RATE:
+            return func(*args, **kwargs)
+
+        start = time.perf_counter()
+        profiler = cProfile.Profile()
+        queries = QueryRecorder()
+        error = None
+        try:
+            with connection.execute_wrapper(queries):
+                profiler.enable()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    profiler.disable()
+        except Exception as e:
+            error = repr(e)
+            raise
+        finally:
+            try:
+                save_profile('task', func.__name__, profiler, queries, time.perf_counter() - start, {
+                    'task_id': getattr(request, 'id', None),
+                    'error': error,
+                })
+            except OSError:
+                logger.exception("Could not store profile for task %s", func.__name__)
+
+    return wrapper
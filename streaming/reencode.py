@@ -0,0 +1,136 @@
+from django.db import transaction
+from django.db.models import Count, Max, Min, Q, Sum
+from django.utils import timezone
+from .models import EncodeJob, ReencodeBatch, Video
+from .scheduler import admit_encode, probe_for_cost
+
+
+def batch_dispatch_key(batch, video_id):
+    """One job per video per batch, so admitting again after an interruption is a no-op"""
+    return f'reencode:{batch.pk}:{video_id}'
+
+
+def _candidates(batch):
+    videos = Video.objects.filter(is_live=False, created_at__lte=batch.created_at).exclude(video='')
+    if batch.video_ids:
+        videos = videos.filter(pk__in=batch.video_ids)
+    return videos
+
+
+def create_batch(video_ids=None, max_in_flight=1, cost_budget=0.0, priority=-1, user=None):
+    batch = ReencodeBatch.objects.create(
+        created_by=user if user is not None and user.is_authenticated else None,
+        video_ids=sorted(set(video_ids or [])),
+        max_in_flight=max(1, max_in_flight),
+        cost_budget=max(0.0, cost_budget),
+        priority=priority,
+    )
+    batch.total = _candidates(batch).count()
+    batch.save(update_fields=['total'])
+    advance_batch(batch.pk)
+    return batch
+
+
+def advance_batch(batch_id):
+    """Admit the batch's next videos, in id order, while it is within its concurrency and cost budget"""
+    admitted = []
+    batch = ReencodeBatch.objects.get(pk=batch_id)
+    if batch.state != ReencodeBatch.RUNNING:
+        return admitted
+    free = batch.max_in_flight - batch.jobs.filter(state__in=EncodeJob.ACTIVE_STATES).count()
+    if free <= 0:
+        return admitted
+    # Probing a source takes up to UPLOAD_PROBE_TIMEOUT, so the next ones are probed before the batch is locked.
+    upcoming = _candidates(batch).filter(pk__gt=batch.cursor).order_by('pk')[:free]
+    probes = {video.pk: probe_for_cost(video) for video in upcoming}
+
+    with transaction.atomic():
+        batch = ReencodeBatch.objects.select_for_update().get(pk=batch_id)
+        if batch.state != ReencodeBatch.RUNNING:
+            return admitted
+
+        load = batch.jobs.filter(state__in=EncodeJob.ACTIVE_STATES).aggregate(
+            n=Count('id'), cost=Sum('estimated_cost')
+        )
+        in_flight, cost = load['n'], load['cost'] or 0.0
+
+        for video in _candidates(batch).filter(pk__gt=batch.cursor).order_by('pk'):
+            if in_flight >= batch.max_in_flight or (batch.cost_budget and in_flight and cost >= batch.cost_budget):
+                break
+            if video.processing:
+                # Wait for the running encode instead of admitting a job that would fail.
+                break
+            if video.pk not in probes:
+                # Probed on the next round.
+                break
+            job = admit_encode(video.pk, batch.priority, batch_dispatch_key(batch, video.pk), batch, probes[video.pk])
+            batch.cursor = video.pk
+            if job is not None:
+                in_flight += 1
+                cost += job.estimated_cost
+                admitted.append(job)
+        else:
+            if not in_flight:
+                batch.state = ReencodeBatch.DONE
+                batch.finished_at = timezone.now()
+
+        batch.save(update_fields=['cursor', 'state', 'finished_at'])
+    return admitted
+
+
+def advance_batches():
+    admitted = 0
+    for batch_id in ReencodeBatch.objects.filter(state=ReencodeBatch.RUNNING).values_list('pk', flat=True):
+        admitted += len(advance_batch(batch_id))
+    return admitted
+
+
+def set_batch_state(batch, state):
+    """Pause, resume or cancel a batch; cancelling drops its jobs that have not been dispatched"""
+    now = timezone.now()
+    with transaction.atomic():
+        batch = ReencodeBatch.objects.select_for_update().get(pk=batch.pk)
+        if batch.state in (ReencodeBatch.DONE, ReencodeBatch.CANCELLED):
+            return batch
+        batch.state = state
+        if state == ReencodeBatch.CANCELLED:
+            batch.finished_at = now
+            batch.jobs.filter(state=EncodeJob.QUEUED).update(state=EncodeJob.FAILED, error='Cancelled', finished_at=now)
+        batch.save(update_fields=['state', 'finished_at'])
+    if state == ReencodeBatch.RUNNING:
+        advance_batch(batch.pk)
+    return batch
+
+
+def batch_progress(batch):
+    counts = dict(batch.jobs.values_list('state').annotate(n=Count('id')))
+    done = counts.get(EncodeJob.DONE, 0)
+    failed = counts.get(EncodeJob.FAILED, 0)
+    finished = done + failed
+    timing = batch.jobs.aggregate(
+        first_started=Min('started_at'),
+        last_finished=Max('finished_at'),
+        done_cost=Sum('estimated_cost', filter=Q(state=EncodeJob.DONE)),
+    )
+
+    end = timezone.now() if batch.state == ReencodeBatch.RUNNING else timing['last_finished']
+    elapsed = (end - timing['first_started']).total_seconds() if end and timing['first_started'] else 0.0
+    remaining = max(batch.total - finished, 0)
+    per_hour = finished / elapsed * 3600 if elapsed and finished else None
+
+    return {
+        'id': batch.pk,
+        'state': batch.state,
+        'created_at': batch.created_at.isoformat(),
+        'videos': batch.total,
+        'done': done,
+        'failed': failed,
+        'in_flight': sum(counts.get(state, 0) for state in EncodeJob.ACTIVE_STATES),
+        'remaining': remaining,
+        'progress': finished / batch.total if batch.total else 1.0,
+        'elapsed_s': elapsed,
+        'videos_per_hour': per_hour,
+        # Rung-seconds encoded per wall-clock second.
+        'cost_per_second': (timing['done_cost'] or 0.0) / elapsed if elapsed else None,
+        'eta_s': remaining / per_hour * 3600 if per_hour and batch.state == ReencodeBatch.RUNNING else None,
+    }
@@ -0,0 +1,207 @@
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.utils import timezone
+from .media import (
+    ProbeError,
+    codec_cost_factor,
+    probe_media,
+    probed_duration,
+    select_codecs,
+    select_qualities,
+    video_stream,
+)
+from .models import EncodeJob, Video
+
+logger = logging.getLogger(__name__)
+
+# Used when the source cannot be probed at admission time.
+DEFAULT_DURATION = 600.0
+# Key of the advisory lock held by the one dispatcher allowed to run at a time.
+DISPATCH_LOCK_ID = 0x656e636f
+
+
+def estimate_encode_cost(duration, rungs, codecs=('vp9',)):
+    """Encode cost in rung-seconds: seconds of source times the number of ladder rungs,
+    weighted by the relative cost of each codec"""
+    return max(float(duration or DEFAULT_DURATION), 1.0) * max(int(rungs), 1) * codec_cost_factor(codecs)
+
+
+def probe_for_cost(video):
+    """(duration, rungs) of a video's source for its cost estimate, with defaults if it cannot be probed"""
+    duration = video.duration
+    rungs = len(select_qualities(1920, 1080))
+
+    try:
+        probe_data = probe_media(video.video.path, timeout=settings.UPLOAD_PROBE_TIMEOUT)
+    except (ProbeError, OSError) as e:
+        logger.warning("Could not probe video %s for cost estimate: %s", video.pk, e)
+        return duration, rungs
+
+    duration = probed_duration(probe_data) or duration
+    source_video = video_stream(probe_data)
+    if source_video:
+        rungs = len(select_qualities(
+            int(source_video.get('width', 1920)),
+            int(source_video.get('height', 1080)),
+        ))
+    return duration, rungs
+
+
+def encode_backlog_cost():
+    return EncodeJob.objects.filter(
+        state__in=EncodeJob.ACTIVE_STATES
+    ).aggregate(total=Sum('estimated_cost'))['total'] or 0.0
+
+
+def backlog_exceeded():
+    """True when uploads should be turned away until the encoders catch up"""
+    return encode_backlog_cost() > settings.ENCODE_BACKLOG_BUDGET
+
+
+def admit_encode(video_id, priority=0, dispatch_key=None, batch=None, probe=None):
+    """Create the encode job for the video's current source exactly once and dispatch it; a job
+    that failed is queued again. probe is the (duration, rungs) of the source if already known,
+    as probing can take seconds."""
+    video = Video.objects.filter(pk=video_id).first()
+    if video is None or not video.video:
+        return None
+
+    dispatch_key = dispatch_key or f'{video.pk}:{video.source_key}'
+    state = EncodeJob.objects.filter(dispatch_key=dispatch_key).values_list('state', flat=True).first()
+    if state is not None and state != EncodeJob.FAILED:
+        return None
+
+    duration, rungs = probe or probe_for_cost(video)
+    if duration and video.duration is None:
+        Video.objects.filter(pk=video.pk).update(duration=duration)
+    codecs = select_codecs(video.requested_codecs, duration, rungs, settings.ENCODE_CODEC_BUDGET)
+    estimated_cost = estimate_encode_cost(duration, rungs, codecs)
+
+    with transaction.atomic():
+        job, created = EncodeJob.objects.select_for_update().get_or_create(
+            dispatch_key=dispatch_key,
+            defaults={
+                'video': video,
+                'owner': video.uploaded_by,
+                'batch': batch,
+                'priority': priority,
+                'estimated_cost': estimated_cost,
+            },
+        )
+        if not created:
+            if job.state != EncodeJob.FAILED:
+                return job
+            logger.info("Requeueing failed encode job %s (%s)", job.pk, job.error)
+            job.state = EncodeJob.QUEUED
+            job.error = ''
+            job.batch = batch
+            job.priority = priority
+            job.estimated_cost = estimated_cost
+            job.created_at = timezone.now()
+            job.dispatched_at = job.started_at = job.finished_at = None
+            job.save()
+    dispatch_pending()
+    return job
+
+
+def _owner_usage(since):
+    """Rung-seconds each owner has in flight or finished within the fairness window"""
+    usage = {}
+    rows = EncodeJob.objects.filter(
+        state__in=EncodeJob.IN_FLIGHT_STATES
+    ).values('owner_id').annotate(cost=Sum('estimated_cost'))
+    for row in rows:
+        usage[row['owner_id']] = usage.get(row['owner_id'], 0.0) + row['cost']
+
+    rows = EncodeJob.objects.filter(
+        state__in=(EncodeJob.DONE, EncodeJob.FAILED),
+        finished_at__gte=since,
+    ).values('owner_id').annotate(cost=Sum('estimated_cost'))
+    for row in rows:
+        usage[row['owner_id']] = usage.get(row['owner_id'], 0.0) + row['cost']
+
+    return usage
+
+
+def _pick_next(queued, usage):
+    """Highest priority first, then the least served owner, then shortest job first"""
+    top_priority = max(job.priority for job in queued)
+    candidates = [job for job in queued if job.priority == top_priority]
+    return min(
+        candidates,
+        key=lambda job: (usage.get(job.owner_id, 0.0), job.estimated_cost, job.created_at),
+    )
+
+
+def _reclaim_stale_jobs(now):
+    lost = EncodeJob.objects.filter(
+        state=EncodeJob.DISPATCHED,
+        dispatched_at__lt=now - timedelta(seconds=settings.ENCODE_DISPATCH_TIMEOUT),
+    ).update(state=EncodeJob.QUEUED, dispatched_at=None)
+    if lost:
+        logger.warning("Requeued %s encode jobs that were dispatched but never started", lost)
+
+    stuck = EncodeJob.objects.filter(
+        state=EncodeJob.RUNNING,
+        started_at__lt=now - timedelta(seconds=settings.ENCODE_JOB_TIMEOUT),
+    )
+    for job in stuck:
+        job.state = EncodeJob.FAILED
+        job.error = 'Timed out'
+        job.finished_at = now
+        job.save(update_fields=['state', 'error', 'finished_at'])
+        Video.objects.filter(pk=job.video_id).update(processing=False)
+
+
+def _lock_dispatch():
+    """Block until no other transaction is dispatching; released when the current transaction ends.
+    Locking the queued rows alone is not enough, a dispatcher that finds none of them still counts
+    the jobs in flight while another one adds to them."""
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", [DISPATCH_LOCK_ID])
+
+
+def dispatch_pending():
+    """Fill free encoder slots from the queued jobs, in scheduling order"""
+    from .tasks import encode_video
+
+    now = timezone.now()
+    dispatched = []
+
+    with transaction.atomic():
+        _lock_dispatch()
+        queued = list(EncodeJob.objects.select_for_update().filter(state=EncodeJob.QUEUED))
+        _reclaim_stale_jobs(now)
+        queued += list(EncodeJob.objects.select_for_update().filter(
+            state=EncodeJob.QUEUED
+        ).exclude(pk__in=[job.pk for job in queued]))
+
+        in_flight = EncodeJob.objects.filter(state__in=EncodeJob.IN_FLIGHT_STATES).count()
+        usage = _owner_usage(now - timedelta(seconds=settings.ENCODE_FAIRNESS_WINDOW))
+
+        while queued and in_flight < settings.ENCODE_MAX_IN_FLIGHT:
+            job = _pick_next(queued, usage)
+            queued.remove(job)
+
+            job.state = EncodeJob.DISPATCHED
+            job.dispatched_at = now
+            job.save(update_fields=['state', 'dispatched_at'])
+
+            usage[job.owner_id] = usage.get(job.owner_id, 0.0) + job.estimated_cost
+            in_flight += 1
+            dispatched.append(job)
+
+        for job in dispatched:
+            transaction.on_commit(
+                lambda job=job: encode_video.apply_async(
+                    args=[job.video_id],
+                    kwargs={'job_id': job.pk},
+                    queue='video_encoding',
+                )
+            )
+
+    return dispatched
@@ -0,0 +1,131 @@
+import fcntl
+import os
+import re
+import shutil
+from contextlib import contextmanager
+from django.conf import settings
+
+SCRATCH_DIR_RE = re.compile(r'^dash_(\d+)$')
+RESERVATION_SUFFIX = '.reserved'
+LOCK_NAME = '.scratch.lock'
+
+
+class ScratchSpaceError(RuntimeError):
+    pass
+
+
+class ScratchSpaceBusy(ScratchSpaceError):
+    """The root has room for the encode once other encodes free theirs"""
+
+
+def scratch_roots():
+    """Scratch roots of this host, the RAM-backed one (if configured) first"""
+    roots = [settings.ENCODE_SCRATCH_TMPFS_DIR, settings.ENCODE_SCRATCH_DIR]
+    return [root for root in roots if root]
+
+
+def _tree_bytes(path):
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.lstat(os.path.join(root, name)).st_size
+            except FileNotFoundError:
+                continue
+    return size
+
+
+@contextmanager
+def _locked(root):
+    """Serialises reservations on one root between the encodes running on this host"""
+    with open(os.path.join(root, LOCK_NAME), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _outstanding(root, exclude=None):
+    """Bytes other encodes on this root have reserved but not written yet"""
+    outstanding = 0
+    for name in os.listdir(root):
+        if not name.endswith(RESERVATION_SUFFIX) or name == exclude:
+            continue
+        path = os.path.join(root, name)
+        try:
+            with open(path) as f:
+                reserved = int(f.read() or 0)
+        except (OSError, ValueError):
+            continue
+        outstanding += max(0, reserved - _tree_bytes(path[:-len(RESERVATION_SUFFIX)]))
+    return outstanding
+
+
+def available_bytes(root, exclude=None):
+    return shutil.disk_usage(root).free - _outstanding(root, exclude) - settings.ENCODE_SCRATCH_HEADROOM
+
+
+class ScratchSpace:
+    """Scratch directory of one encode, admitted only while its root has room for the estimate.
+
+    Jobs up to ENCODE_SCRATCH_TMPFS_MAX_BYTES go to the tmpfs root when it has room, everything else
+    to ENCODE_SCRATCH_DIR. acquire() never waits: with one encode per worker nothing on the host
+    would free space meanwhile, so the caller retries later on ScratchSpaceBusy. The reservation is
+    kept next to the directory, so concurrent encodes see each other's needs before they have
+    written them. release() must run on every exit path.
+    """
+
+    def __init__(self, video_id, required_bytes):
+        self.video_id = video_id
+        self.required_bytes = int(required_bytes)
+        self.path = None
+
+    def _reserve(self, root):
+        os.makedirs(root, exist_ok=True)
+        path = os.path.join(root, f'dash_{self.video_id}')
+        with _locked(root):
+            # A reservation left by an earlier, killed attempt at this video is replaced.
+            if available_bytes(root, exclude=os.path.basename(path) + RESERVATION_SUFFIX) < self.required_bytes:
+                return False
+            shutil.rmtree(path, ignore_errors=True)
+            os.makedirs(path)
+            with open(path + RESERVATION_SUFFIX, 'w') as f:
+                f.write(str(self.required_bytes))
+            self.path = path
+            return True
+
+    def acquire(self):
+        tmpfs = settings.ENCODE_SCRATCH_TMPFS_DIR
+        if tmpfs and self.required_bytes <= settings.ENCODE_SCRATCH_TMPFS_MAX_BYTES and self._reserve(tmpfs):
+            return self.path
+
+        root = settings.ENCODE_SCRATCH_DIR
+        os.makedirs(root, exist_ok=True)
+        capacity = shutil.disk_usage(root).total - settings.ENCODE_SCRATCH_HEADROOM
+        if self.required_bytes > capacity:
+            raise ScratchSpaceError(
+                f"Encode needs ~{self.required_bytes / 1024 ** 3:.1f} GiB of scratch space, "
+                f"{root} only has {capacity / 1024 ** 3:.1f} GiB"
+            )
+        if not self._reserve(root):
+            raise ScratchSpaceBusy(
+                f"Not enough free scratch space in {root} for ~{self.required_bytes / 1024 ** 3:.1f} GiB"
+            )
+        return self.path
+
+    def release(self):
+        if self.path is None:
+            return
+        shutil.rmtree(self.path, ignore_errors=True)
+        try:
+            os.remove(self.path + RESERVATION_SUFFIX)
+        except FileNotFoundError:
+            pass
+        self.path = None
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc_info):
+        self.release()
@@ -0,0 +1,101 @@
+from celery import states
+from celery.backends.base import KeyValueStoreBackend
+from celery.result import AsyncResult
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, IntegerField, Q, Value, When
+from .models import Video
+
+ROW_KEY = 'search:row:{}'
+
+
+def ranked_ids(query):
+    """(total matches, ids of the best SEARCH_MAX_RESULTS): title matches first, then newest"""
+    matches = Video.objects.filter(Q(title__icontains=query) | Q(description__icontains=query))
+    ranked = matches.annotate(
+        title_match=Case(When(title__icontains=query, then=Value(1)), default=Value(0), output_field=IntegerField())
+    ).order_by('-title_match', '-created_at', '-pk')
+    return matches.count(), list(ranked.values_list('pk', flat=True)[:settings.SEARCH_MAX_RESULTS])
+
+
+def invalidate_row(video_id):
+    cache.delete(ROW_KEY.format(video_id))
+
+
+def hydrate(ids):
+    """Result rows for video ids, in the given order; cached per video, the misses fetched in one query.
+    Videos deleted since the search are left out."""
+    keys = {video_id: ROW_KEY.format(video_id) for video_id in ids}
+    cached = cache.get_many(keys.values())
+    rows = {video_id: cached[key] for video_id, key in keys.items() if key in cached}
+
+    missing = [video_id for video_id in keys if video_id not in rows]
+    if missing:
+        fetched = {
+            video.pk: {
+                "id": video.pk,
+                "title": video.title,
+                "description": video.description,
+                "poster_url": video.poster_url,
+            }
+            for video in Video.objects.filter(pk__in=missing).only("id", "title", "description", "poster")
+        }
+        cache.set_many({keys[video_id]: row for video_id, row in fetched.items()}, settings.SEARCH_ROW_CACHE_TIMEOUT)
+        rows.update(fetched)
+
+    return [rows[video_id] for video_id in ids if video_id in rows]
+
+
+def _task_metas(task_ids):
+    """Result metadata of many tasks; one MGET on key-value result backends"""
+    backend = AsyncResult(task_ids[0]).backend
+    if not isinstance(backend, KeyValueStoreBackend):
+        results = {task_id: AsyncResult(task_id) for task_id in task_ids}
+        return {task_id: {"status": r.state, "result": r.result} for task_id, r in results.items()}
+
+    keys = [backend.get_key_for_task(task_id) for task_id in task_ids]
+    values = backend.mget(keys)
+    if hasattr(values, 'items'):
+        # Memcached-style backends return a mapping of the keys they found.
+        values = [values.get(key) for key in keys]
+    return {
+        task_id: backend.decode_result(value) if value else {"status": states.PENDING, "result": None}
+        for task_id, value in zip(task_ids, values)
+    }
+
+
+def _ids(result):
+    # Searches queued before results were made compact carry whole rows.
+    if "ids" in result:
+        return result["ids"]
+    return [row["id"] for row in result.get("results", [])]
+
+
+def search_statuses(task_ids):
+    """Status of search tasks keyed by task id; the rows of all finished ones are hydrated together"""
+    if not task_ids:
+        return {}
+    metas = _task_metas(task_ids)
+
+    finished = {
+        task_id: meta["result"] for task_id, meta in metas.items()
+        if meta["status"] == states.SUCCESS and isinstance(meta["result"], dict)
+    }
+    rows = {row["id"]: row for row in hydrate(list(dict.fromkeys(
+        video_id for result in finished.values() for video_id in _ids(result)
+    )))}
+
+    statuses = {}
+    for task_id, meta in metas.items():
+        if task_id in finished:
+            result = finished[task_id]
+            statuses[task_id] = {
+                "status": "completed",
+                "count": result["count"],
+                "results": [rows[video_id] for video_id in _ids(result) if video_id in rows],
+            }
+        elif meta["status"] in states.READY_STATES:
+            statuses[task_id] = {"status": "failed"}
+        else:
+            statuses[task_id] = {"status": "pending"}
+    return statuses
@@ -1,32 +1,41 @@
+from django.db import transaction
 from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from .models import Video
-from .tasks import encode_video
-import shutil
-import os
+from .search import invalidate_row
+from .tasks import admit_video_encode, delete_storage_paths
 
 @receiver(post_delete, sender=Video)
 def delete_video_files(sender, instance, **kwargs):
-    if instance.video:
-        instance.video.delete(save=False)
-    
-    if instance.dash_manifest:
-        instance.dash_manifest.delete(save=False)
-    
-    if instance.dash_base_path:
-        storage = instance.dash_manifest.storage
-        try:
-            dash_full_path = os.path.join(storage.location, instance.dash_base_path)
-            if os.path.exists(dash_full_path):
-                shutil.rmtree(dash_full_path)
-        except Exception as e:
-            print(f"Error cleaning up DASH files: {e}")
+    # Removing a DASH tree can take long, so it happens in the background once the delete has
+    # committed; anything this misses is picked up by the storage garbage collector.
+    paths = [f.name for f in (instance.video, instance.dash_manifest, instance.poster, instance.thumbnails) if f]
+    # Every encode of the video, not just the current one.
+    paths.append(f'dash/{instance.pk}')
+    if paths:
+        transaction.on_commit(lambda: delete_storage_paths.delay(paths))
 
 @receiver(post_save, sender=Video)
 def queue_video_encoding(sender, instance, created, **kwargs):
     _ = sender
-    _ = kwargs
     _ = created
     
+    # Saves that cannot have changed the source (status updates from the
+    # encoder itself) never need to go through admission.
+    update_fields = kwargs.get('update_fields')
+    if update_fields is not None and not set(Video.ENCODE_INPUTS) & set(update_fields):
+        return
+    # Neither do edits of other fields, e.g. a new title: they would requeue a failed encode.
+    changed = instance.encode_inputs_changed()
+    instance.remember_encode_inputs()
+    if not changed:
+        return
+    
     if instance.video and not instance.processing:
-        encode_video.apply_async(args=[instance.id], queue="video_encoding")
\ No newline at end of file
+        video_id = instance.id
+        transaction.on_commit(lambda: admit_video_encode.delay(video_id))
+
+@receiver(post_save, sender=Video)
+@receiver(post_delete, sender=Video)
+def invalidate_search_row(sender, instance, **kwargs):
+    invalidate_row(instance.pk)
@@ -11,16 +11,17 @@ document.addEventListener("DOMContentLoaded", () => {
     const durationToRun = Math.min(duration, MAX_DURATION);
 
     try {
-      const response = await fetch("/experiments/start/", {
+      // Sweeps skip trace/duration combinations already measured for this encode.
+      const response = await fetch("/experiments/sweeps/", {
         method: "POST",
         headers: {
           "Content-Type": "application/json",
           "X-CSRFToken": csrfToken,
         },
         body: JSON.stringify({
-          video_id: Number(videoId),
+          videos: [Number(videoId)],
           traces: traceFiles,
-          duration: 30, //change this to durationToRun, for now just 30sec
+          durations: [30], //change this to durationToRun, for now just 30sec
         }),
       });
 
@@ -97,6 +97,9 @@ document.addEventListener('DOMContentLoaded', function() {
             statusData.results.forEach(function(result) {
                 html += '<a href="/detailed_view/' + result.id + '/" class="result-link">';
                 html += '<div class="result-item">';
+                if (result.poster_url) {
+                    html += '<img class="result-poster" loading="lazy" src="' + escapeHtml(result.poster_url) + '" alt="">';
+                }
                 html += '<h3>' + escapeHtml(result.title) + '</h3>';
                 html += '<p>' + escapeHtml(result.description) + '</p>';
                 html += '</div>';
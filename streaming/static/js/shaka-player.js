@@ -11,8 +11,44 @@ async function init() {
     player.addEventListener('error', onPlayerErrorEvent);
     controls.addEventListener('error', onUIErrorEvent);
 
+    if (video.dataset.live) {
+        player.configure({
+            streaming: {
+                lowLatencyMode: true,
+                inaccurateManifestTolerance: 0,
+                rebufferingGoal: 0.01,
+            },
+        });
+    }
+
+    // Start-up hints from this viewer's earlier sessions; emulation runs start cold so that their
+    // results only depend on the configuration and trace under test.
+    const hints = document.getElementById('abr-hints');
+    if (hints && !navigator.webdriver) {
+        applyAbrHints(player, JSON.parse(hints.textContent));
+    }
+
+    // Emulation runs pass the player/ABR configuration under test as JSON.
+    const playerConfig = new URLSearchParams(window.location.search).get("player_config");
+    if (playerConfig) {
+        try {
+            player.configure(JSON.parse(playerConfig));
+        } catch (e) {
+            console.error("Invalid player_config:", e);
+        }
+    }
+
     try {
         await player.load(manifestUri);
+        startQoeBeacons(player, video);
+
+        if (video.dataset.thumbnails) {
+            try {
+                await player.addThumbnailsTrack(video.dataset.thumbnails, 'text/vtt');
+            } catch (e) {
+                console.log("Seek thumbnails unavailable:", e);
+            }
+        }
 
         const params = new URLSearchParams(window.location.search);
         const shouldAutoplay = params.get("autoplay") === "1";
@@ -33,6 +69,102 @@ async function init() {
     }
 }
 
+function applyAbrHints(player, hints) {
+    const config = { abr: {}, streaming: {} };
+    if (hints.bandwidth_estimate) {
+        config.abr.defaultBandwidthEstimate = hints.bandwidth_estimate;
+    }
+    if (hints.rebuffering_goal) {
+        config.streaming.rebufferingGoal = hints.rebuffering_goal;
+    }
+    if (hints.buffering_goal) {
+        config.streaming.bufferingGoal = hints.buffering_goal;
+    }
+    player.configure(config);
+}
+
+// Reports playback QoE of real viewers: every interval the new part of the player's stats is
+// sampled, and samples are sent in batches (and whenever the page is hidden).
+function startQoeBeacons(player, video) {
+    const url = video.dataset.beacon;
+    // Emulated sessions would skew the QoE of real viewers and the bandwidth they are started with.
+    if (!url || !navigator.sendBeacon || navigator.webdriver) {
+        return;
+    }
+
+    const session = window.crypto && crypto.randomUUID ? crypto.randomUUID() : String(Math.random()).slice(2);
+    const intervalMs = Number(video.dataset.beaconInterval || 10) * 1000;
+    const samplesPerBatch = 3;
+
+    let pending = [];
+    let first = true;
+    let sentStates = 0;
+    let sentSwitches = 0;
+    let lastPlayTime = 0;
+    let lastDropped = 0;
+
+    function sample(final) {
+        const stats = player.getStats();
+        const states = stats.stateHistory || [];
+        const switches = stats.switchHistory || [];
+        // The last state entry keeps growing until the player changes state.
+        const stateEnd = final ? states.length : Math.max(sentStates, states.length - 1);
+        const variant = player.getVariantTracks().find((t) => t.active) || {};
+        const playTime = stats.playTime || 0;
+        const dropped = stats.droppedFrames || 0;
+        const stateHistory = states.slice(sentStates, stateEnd);
+
+        pending.push({
+            ts: Date.now(),
+            first: first,
+            variant: { height: variant.height, codecs: variant.videoCodec || variant.codecs },
+            bandwidth: variant.bandwidth,
+            estimatedBandwidth: stats.estimatedBandwidth,
+            stateHistory: stateHistory,
+            switchHistory: switches.slice(sentSwitches),
+            playTime: Math.max(0, playTime - lastPlayTime),
+            droppedFrames: Math.max(0, dropped - lastDropped),
+        });
+
+        // Startup is only complete once the first state entry has been reported.
+        first = first && stateHistory.length === 0;
+        sentStates = stateEnd;
+        sentSwitches = switches.length;
+        lastPlayTime = playTime;
+        lastDropped = dropped;
+    }
+
+    function flush() {
+        if (!pending.length) {
+            return;
+        }
+        const body = JSON.stringify({
+            video: Number(video.dataset.videoId),
+            session: session,
+            samples: pending,
+        });
+        pending = [];
+        navigator.sendBeacon(url, new Blob([body], { type: 'application/json' }));
+    }
+
+    setInterval(() => {
+        if (video.paused && !pending.length) {
+            return;
+        }
+        sample(false);
+        if (pending.length >= samplesPerBatch) {
+            flush();
+        }
+    }, intervalMs);
+
+    document.addEventListener('visibilitychange', () => {
+        if (document.visibilityState === 'hidden') {
+            sample(true);
+            flush();
+        }
+    });
+}
+
 function onPlayerErrorEvent(errorEvent) {
     onPlayerError(errorEvent.detail);
 }
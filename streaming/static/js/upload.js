@@ -0,0 +1,161 @@
+const CHUNK_SIZE = 8 * 1024 * 1024;
+const PARALLEL_CHUNKS = 3;
+const MAX_RETRIES = 5;
+
+document.addEventListener("DOMContentLoaded", () => {
+  const form = document.getElementById("upload-form");
+  const progress = document.getElementById("upload-progress");
+
+  if (!form || !progress || !window.fetch || !window.crypto || !window.crypto.subtle) {
+    return;
+  }
+
+  const endpoint = form.dataset.endpoint;
+  const csrfToken = form.dataset.csrfToken;
+
+  form.addEventListener("submit", async (event) => {
+    const file = form.querySelector("input[type=file]").files[0];
+    if (!file) {
+      return;
+    }
+    event.preventDefault();
+
+    const button = form.querySelector("button[type=submit]");
+    button.disabled = true;
+
+    try {
+      const upload = await resumeOrCreate(file);
+      await uploadChunks(file, upload);
+      localStorage.removeItem(fingerprint(file));
+      window.location.href = form.dataset.redirect;
+    } catch (err) {
+      console.error("Upload failed:", err);
+      progress.textContent = "Upload failed: " + err.message;
+      button.disabled = false;
+    }
+  });
+
+  function fingerprint(file) {
+    return "upload:" + [file.name, file.size, file.lastModified].join(":");
+  }
+
+  function encodeMetadata(fields) {
+    return Object.entries(fields)
+      .map(([key, value]) => key + " " + btoa(unescape(encodeURIComponent(value))))
+      .join(",");
+  }
+
+  async function resumeOrCreate(file) {
+    const location = localStorage.getItem(fingerprint(file));
+    if (location) {
+      const response = await fetch(location, { headers: { "Tus-Resumable": "1.0.0" } });
+      if (response.ok) {
+        const state = await response.json();
+        if (!state.error) {
+          return { location: location, state: state };
+        }
+      }
+      localStorage.removeItem(fingerprint(file));
+    }
+
+    const response = await fetch(endpoint, {
+      method: "POST",
+      headers: {
+        "X-CSRFToken": csrfToken,
+        "Tus-Resumable": "1.0.0",
+        "Upload-Length": String(file.size),
+        "Upload-Metadata": encodeMetadata({
+          filename: file.name,
+          title: form.querySelector("[name=title]").value,
+          description: form.querySelector("[name=description]").value,
+          codecs: Array.from(form.querySelectorAll("[name=codecs]:checked"), (el) => el.value).join(","),
+        }),
+      },
+    });
+    const state = await response.json();
+    if (!response.ok) {
+      throw new Error(state.error || `HTTP ${response.status}`);
+    }
+
+    const created = response.headers.get("Location");
+    localStorage.setItem(fingerprint(file), created);
+    return { location: created, state: state };
+  }
+
+  async function sha256Base64(buffer) {
+    const digest = await crypto.subtle.digest("SHA-256", buffer);
+    return btoa(String.fromCharCode(...new Uint8Array(digest)));
+  }
+
+  async function sendChunk(file, location, start) {
+    const end = Math.min(start + CHUNK_SIZE, file.size);
+    const buffer = await file.slice(start, end).arrayBuffer();
+    const checksum = await sha256Base64(buffer);
+
+    for (let attempt = 0; ; attempt++) {
+      try {
+        const response = await fetch(location, {
+          method: "PATCH",
+          headers: {
+            "X-CSRFToken": csrfToken,
+            "Tus-Resumable": "1.0.0",
+            "Content-Type": "application/offset+octet-stream",
+            "Upload-Offset": String(start),
+            "Upload-Checksum": "sha256 " + checksum,
+          },
+          body: buffer,
+        });
+        const state = await response.json();
+        if (response.ok) {
+          return state;
+        }
+        if (response.status < 500 && response.status !== 460) {
+          throw Object.assign(new Error(state.error || `HTTP ${response.status}`), { fatal: true });
+        }
+      } catch (err) {
+        if (err.fatal || attempt >= MAX_RETRIES) {
+          throw err;
+        }
+      }
+      await new Promise((r) => setTimeout(r, 1000 * 2 ** attempt));
+    }
+  }
+
+  async function uploadChunks(file, upload) {
+    const received = new Set(upload.state.chunks.map(([start]) => start));
+    const pending = [];
+    for (let start = 0; start < file.size; start += CHUNK_SIZE) {
+      if (!received.has(start)) {
+        pending.push(start);
+      }
+    }
+
+    let done = file.size - pending.length * CHUNK_SIZE;
+    const report = () => {
+      progress.textContent = `Uploaded ${Math.min(100, Math.max(0, Math.round((done / file.size) * 100)))}%`;
+    };
+    report();
+
+    const worker = async () => {
+      while (pending.length) {
+        const start = pending.shift();
+        const state = await sendChunk(file, upload.location, start);
+        done += Math.min(CHUNK_SIZE, file.size - start);
+        report();
+        if (state.video_id) {
+          upload.state = state;
+        }
+      }
+    };
+
+    await Promise.all(Array.from({ length: PARALLEL_CHUNKS }, worker));
+
+    if (!upload.state.video_id) {
+      const response = await fetch(upload.location, { headers: { "Tus-Resumable": "1.0.0" } });
+      upload.state = await response.json();
+      if (upload.state.error || !upload.state.video_id) {
+        throw new Error(upload.state.error || "Upload did not complete");
+      }
+    }
+  }
+});
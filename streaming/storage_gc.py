@@ -0,0 +1,176 @@
+import logging
+import os
+import shutil
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from .metrics import STORAGE_RECLAIMED_BYTES
+from .models import UploadSession, Video
+from .scratch import RESERVATION_SUFFIX, SCRATCH_DIR_RE, scratch_roots
+
+logger = logging.getLogger(__name__)
+
+ORIGINALS_DIR = 'videos/originals'
+
+
+def _usage(path):
+    """(bytes, newest mtime) of a file or directory tree"""
+    if not os.path.isdir(path) or os.path.islink(path):
+        st = os.lstat(path)
+        return st.st_size, st.st_mtime
+
+    size = 0
+    newest = os.lstat(path).st_mtime
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files:
+            try:
+                st = os.lstat(os.path.join(root, name))
+            except FileNotFoundError:
+                continue
+            if name in files:
+                size += st.st_size
+            newest = max(newest, st.st_mtime)
+    return size, newest
+
+
+def _remove(path, kind, dry_run=False):
+    """Delete a file or tree and return the bytes reclaimed; never raises"""
+    try:
+        size, _ = _usage(path)
+        if not dry_run:
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+            STORAGE_RECLAIMED_BYTES.labels(kind=kind).inc(size)
+    except FileNotFoundError:
+        return 0
+    except OSError:
+        logger.exception("Could not remove %s", path)
+        return 0
+    logger.info("%s %s (%s bytes)", "Would remove" if dry_run else "Removed", path, size)
+    return size
+
+
+def _is_stale(path, now):
+    try:
+        return now - _usage(path)[1] > settings.STORAGE_GC_GRACE
+    except FileNotFoundError:
+        return False
+
+
+def delete_paths(paths, kind='deleted'):
+    """Remove storage-relative files and directories, e.g. those of a deleted video"""
+    reclaimed = 0
+    for name in paths:
+        path = default_storage.path(name)
+        if os.path.lexists(path):
+            reclaimed += _remove(path, kind)
+    return reclaimed
+
+
+def collect_scratch(dry_run=False):
+    """Remove encoder scratch directories of videos that are not being encoded
+
+    Run on the encoding host: an encode that was killed leaves its directory and reservation behind.
+    """
+    candidates = []
+    for root in scratch_roots():
+        for name in os.listdir(root) if os.path.isdir(root) else []:
+            match = SCRATCH_DIR_RE.match(name)
+            if match and os.path.isdir(os.path.join(root, name)):
+                candidates.append((int(match.group(1)), os.path.join(root, name)))
+
+    video_ids = {video_id for video_id, _ in candidates}
+    encoding = set(Video.objects.filter(pk__in=video_ids, processing=True).values_list('pk', flat=True))
+
+    now = time.time()
+    removed, reclaimed = 0, 0
+    for video_id, path in sorted(candidates):
+        if video_id in encoding or not _is_stale(path, now):
+            continue
+        reclaimed += _remove(path, 'scratch', dry_run)
+        if not dry_run and os.path.exists(path + RESERVATION_SUFFIX):
+            os.remove(path + RESERVATION_SUFFIX)
+        removed += 1
+    return {'removed': removed, 'reclaimed_bytes': reclaimed}
+
+
+def _orphaned_dash_dirs():
+    root = default_storage.path('dash')
+    if not os.path.isdir(root):
+        return []
+    ids = {int(name): os.path.join(root, name) for name in os.listdir(root) if name.isdigit()}
+    existing = set(Video.objects.filter(pk__in=ids).values_list('pk', flat=True))
+    return [path for video_id, path in sorted(ids.items()) if video_id not in existing]
+
+
+def _superseded_dash_entries(now):
+    """Earlier encodes in dash/<id>/ of re-encoded videos, once the current one has been served for
+    STORAGE_GC_GRACE seconds; players that loaded an old manifest before the swap may still need them"""
+    versions = Video.objects.filter(
+        processing=False, dash_base_path__regex=r'^dash/[0-9]+/v[0-9]+$'
+    ).values_list('pk', 'dash_base_path')
+
+    paths = []
+    for video_id, base_path in versions.iterator():
+        current = default_storage.path(base_path)
+        try:
+            swapped_at = os.lstat(current).st_mtime
+        except FileNotFoundError:
+            continue
+        if now - swapped_at <= settings.STORAGE_GC_GRACE:
+            continue
+        video_dir = os.path.dirname(current)
+        paths += [os.path.join(video_dir, name) for name in sorted(os.listdir(video_dir)) if name != os.path.basename(current)]
+    return paths
+
+
+def _abandon_stale_uploads():
+    """Fail upload sessions that stopped receiving chunks, so their partial files become orphans"""
+    return UploadSession.objects.filter(
+        video__isnull=True,
+        error='',
+        updated_at__lt=timezone.now() - timedelta(seconds=settings.STORAGE_GC_UPLOAD_TTL),
+    ).update(error='Upload abandoned', updated_at=timezone.now())
+
+
+def _orphaned_originals():
+    root = default_storage.path(ORIGINALS_DIR)
+    if not os.path.isdir(root):
+        return []
+
+    referenced = set(Video.objects.exclude(video='').values_list('video', flat=True).iterator())
+    referenced.update(UploadSession.objects.filter(error='').values_list('path', flat=True).iterator())
+    return [
+        os.path.join(root, name)
+        for name in sorted(os.listdir(root))
+        if f'{ORIGINALS_DIR}/{name}' not in referenced
+    ]
+
+
+def collect_media(dry_run=False):
+    """Remove DASH trees and uploaded originals that no Video or live upload refers to, and encodes
+    that a re-encode has replaced"""
+    if not dry_run:
+        _abandon_stale_uploads()
+
+    now = time.time()
+    report = {}
+    candidates = (
+        ('dash', _orphaned_dash_dirs()),
+        ('superseded', _superseded_dash_entries(now)),
+        ('originals', _orphaned_originals()),
+    )
+    for kind, paths in candidates:
+        removed, reclaimed = 0, 0
+        for path in paths:
+            if not _is_stale(path, now):
+                continue
+            reclaimed += _remove(path, kind, dry_run)
+            removed += 1
+        report[kind] = {'removed': removed, 'reclaimed_bytes': reclaimed}
+    report['reclaimed_bytes'] = sum(r['reclaimed_bytes'] for r in report.values())
+    return report
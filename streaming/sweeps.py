@@ -0,0 +1,226 @@
+import hashlib
+import itertools
+import json
+import logging
+import os
+import time
+from datetime import timedelta
+import redis
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+from .models import ExperimentJob, ExperimentRun, ExperimentSweep, Video
+
+logger = logging.getLogger(__name__)
+
+SHARED_QUEUE = 'emulation_jobs'
+SHARD_QUEUE = 'emulation_jobs:{}'
+RUNNERS_KEY = 'emulation_runners'
+
+
+class SweepError(ValueError):
+    pass
+
+
+def config_hash(config):
+    return hashlib.sha256(json.dumps(config or {}, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+
+
+def _trace_files(traces):
+    traces_dir = os.path.join(settings.EXPERIMENTS_DIR, 'traces')
+    available = sorted(name for name in os.listdir(traces_dir) if name.endswith('.csv'))
+    if traces in (None, '*', 'all'):
+        return available
+    if isinstance(traces, str):
+        traces = [traces]
+
+    names = []
+    for trace in traces:
+        name = os.path.basename(str(trace))
+        name = name if name.endswith('.csv') else f'{name}.csv'
+        if name not in available:
+            raise SweepError(f"Unknown trace: {trace}")
+        names.append(name)
+    return names
+
+
+def _int_list(values, field):
+    if not isinstance(values, list) or not values:
+        raise SweepError(f"{field} must be a non-empty list")
+    try:
+        return [int(v) for v in values]
+    except (TypeError, ValueError):
+        raise SweepError(f"{field} must contain integers")
+
+
+def expand_sweep(spec):
+    """Validate a sweep spec and expand it into (video, trace, config, duration_s) combinations"""
+    video_ids = _int_list(spec.get('videos'), 'videos')
+    durations = _int_list(spec.get('durations', [30]), 'durations')
+    if any(d <= 0 or d > settings.EXPERIMENT_MAX_DURATION for d in durations):
+        raise SweepError(f"durations must be between 1 and {settings.EXPERIMENT_MAX_DURATION} seconds")
+
+    configs = spec.get('configs', [{}])
+    if not isinstance(configs, list) or not configs or not all(isinstance(c, dict) for c in configs):
+        raise SweepError("configs must be a non-empty list of player configuration objects")
+
+    traces = _trace_files(spec.get('traces'))
+    if not traces:
+        raise SweepError("No traces selected")
+
+    videos = {v.pk: v for v in Video.objects.filter(pk__in=video_ids, dash_ready=True)}
+    missing = sorted(set(video_ids) - set(videos))
+    if missing:
+        raise SweepError(f"Videos not found or not streamable: {missing}")
+
+    combos = list(itertools.product(dict.fromkeys(video_ids), traces, configs, dict.fromkeys(durations)))
+    if len(combos) > settings.EXPERIMENT_MAX_SWEEP_JOBS:
+        raise SweepError(f"Sweep expands to {len(combos)} jobs, the limit is {settings.EXPERIMENT_MAX_SWEEP_JOBS}")
+    return videos, combos
+
+
+def _measured_keys(videos):
+    """(video, trace, encode version, config hash, duration ms) of runs that exist or are queued"""
+    keys = set()
+    runs = ExperimentRun.objects.filter(video__in=videos).values_list(
+        'video_id', 'trace', 'encode_version', 'config_hash', 'duration_requested_ms'
+    )
+    for video_id, trace, version, digest, duration_ms in runs:
+        keys.add((video_id, trace, version, digest, duration_ms))
+    queued = ExperimentJob.objects.filter(video__in=videos, state=ExperimentJob.QUEUED).values_list(
+        'video_id', 'trace', 'encode_version', 'config_hash', 'duration_ms'
+    )
+    for video_id, trace, version, digest, duration_ms in queued:
+        keys.add((video_id, os.path.splitext(trace)[0], version, digest, duration_ms))
+    return keys
+
+
+def live_runners(r):
+    cutoff = time.time() - settings.EXPERIMENT_RUNNER_TTL
+    return [runner.decode() for runner in r.zrangebyscore(RUNNERS_KEY, cutoff, '+inf')]
+
+
+def _shard_loads(runners):
+    """Seconds of queued playback per runner queue"""
+    loads = {runner: 0 for runner in runners}
+    rows = ExperimentJob.objects.filter(
+        state=ExperimentJob.QUEUED, shard__in=runners
+    ).values('shard').annotate(ms=Sum('duration_ms'))
+    for row in rows:
+        loads[row['shard']] = row['ms'] / 1000.0
+    return loads
+
+
+def assign_shards(jobs, runners, loads=None):
+    """Longest job first onto the least loaded runner, so every runner finishes at about the same time"""
+    if not runners:
+        return
+    loads = dict(loads or {runner: 0 for runner in runners})
+    for job in sorted(jobs, key=lambda j: j.duration_ms, reverse=True):
+        runner = min(runners, key=lambda name: (loads[name], name))
+        job.shard = runner
+        loads[runner] += job.duration_ms / 1000.0
+
+
+def job_payload(job):
+    return json.dumps({
+        'job_id': str(job.job_id),
+        'video_id': job.video_id,
+        'trace': job.trace,
+        'duration': job.duration_ms // 1000,
+        'encode_version': job.encode_version,
+        'config': job.player_config,
+    })
+
+
+def start_sweep(spec, user=None):
+    """Create the sweep's jobs, skipping measured combinations, and push them to the runner queues"""
+    videos, combos = expand_sweep(spec)
+    r = redis.Redis.from_url(settings.REDIS_URL)
+    runners = live_runners(r)
+
+    with transaction.atomic():
+        sweep = ExperimentSweep.objects.create(
+            created_by=user if user is not None and user.is_authenticated else None,
+            spec=spec,
+        )
+
+        measured = _measured_keys(list(videos.values()))
+        jobs = []
+        for video_id, trace, config, duration in combos:
+            video = videos[video_id]
+            digest = config_hash(config)
+            key = (video_id, os.path.splitext(trace)[0], video.encode_version, digest, duration * 1000)
+            if key in measured:
+                sweep.skipped += 1
+                continue
+            measured.add(key)
+            jobs.append(ExperimentJob(
+                sweep=sweep,
+                video=video,
+                trace=trace,
+                encode_version=video.encode_version,
+                player_config=config,
+                config_hash=digest,
+                duration_ms=duration * 1000,
+            ))
+
+        assign_shards(jobs, runners, _shard_loads(runners))
+        ExperimentJob.objects.bulk_create(jobs)
+        sweep.save(update_fields=['skipped'])
+
+        def push():
+            pipe = r.pipeline()
+            for job in jobs:
+                pipe.lpush(SHARD_QUEUE.format(job.shard) if job.shard else SHARED_QUEUE, job_payload(job))
+            pipe.execute()
+
+        transaction.on_commit(push)
+
+    return sweep, jobs
+
+
+def reclaim_orphaned_shards():
+    """Move jobs queued for runners that stopped heartbeating onto the shared queue, and fail jobs
+    that were taken by a runner but never reported back"""
+    ExperimentJob.objects.filter(
+        state=ExperimentJob.QUEUED,
+        created_at__lt=timezone.now() - timedelta(seconds=settings.EXPERIMENT_JOB_TIMEOUT),
+    ).update(state=ExperimentJob.FAILED, error='Timed out', finished_at=timezone.now())
+
+    r = redis.Redis.from_url(settings.REDIS_URL)
+    cutoff = time.time() - settings.EXPERIMENT_RUNNER_TTL
+    moved = 0
+    for runner in r.zrangebyscore(RUNNERS_KEY, '-inf', f'({cutoff}'):
+        runner = runner.decode()
+        queue = SHARD_QUEUE.format(runner)
+        # Oldest first, so reclaimed jobs keep their order.
+        while r.lmove(queue, SHARED_QUEUE, 'RIGHT', 'LEFT') is not None:
+            moved += 1
+        ExperimentJob.objects.filter(state=ExperimentJob.QUEUED, shard=runner).update(shard='')
+        r.zrem(RUNNERS_KEY, runner)
+    if moved:
+        logger.warning("Moved %s emulation jobs from stale runners to the shared queue", moved)
+    return moved
+
+
+def sweep_progress(sweep):
+    counts = dict(sweep.jobs.values_list('state').annotate(n=Count('id')))
+    total = sum(counts.values())
+    finished = counts.get(ExperimentJob.DONE, 0) + counts.get(ExperimentJob.FAILED, 0)
+    shards = {
+        row['shard'] or 'shared': row['n']
+        for row in sweep.jobs.filter(state=ExperimentJob.QUEUED).values('shard').annotate(n=Count('id'))
+    }
+    return {
+        'id': sweep.pk,
+        'created_at': sweep.created_at.isoformat(),
+        'jobs': total,
+        'skipped': sweep.skipped,
+        'queued': counts.get(ExperimentJob.QUEUED, 0),
+        'done': counts.get(ExperimentJob.DONE, 0),
+        'failed': counts.get(ExperimentJob.FAILED, 0),
+        'progress': finished / total if total else 1.0,
+        'queued_by_shard': shards,
+    }
@@ -1,33 +1,61 @@
 from celery import shared_task
-from .models import Video
+from .models import EncodeJob, Video
+from .metrics import encode_stage
+from .experiment_results import drain_results
+from .packaging import ON_DEMAND, load_indices, manifest_renditions, write_index
+from .sweeps import reclaim_orphaned_shards
+from . import popularity, storage_gc
+from .scheduler import DEFAULT_DURATION, admit_encode
+from .scratch import ScratchSpace, ScratchSpaceBusy
+from .reencode import advance_batches
+from .search import ranked_ids
+from .profiling import profile_task
+from .cpu import PREVIEW_THREADS, available_cpus, input_thread_args, rung_threads, run_packed, tile_columns
+from .media import (
+    AUDIO_CODECS,
+    CODECS,
+    POSTER_NAME,
+    THUMBNAILS_VTT_NAME,
+    audio_stream,
+    estimate_scratch_bytes,
+    frame_rate,
+    keyframe_args,
+    packager_segment_duration,
+    preview_outputs,
+    probe_media,
+    probed_duration,
+    select_codecs,
+    select_qualities,
+    video_codec_args,
+    video_stream,
+    write_thumbnails_vtt,
+)
 import os
 import shutil
 import subprocess
 import json
+import logging
 import uuid
 import redis
 from django.core.files.base import ContentFile
 from django.db import transaction
 from django.conf import settings
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
 
 @shared_task
+@profile_task
 def search_videos(query):
-    from django.db.models import Q
-    results = Video.objects.filter(
-        Q(title__icontains=query) | Q(description__icontains=query)
-    )
-
-    count = results.count()
-
-    return {
-        "query": query,
-        "count": count,
-        "results": list(results.values("id", "title", "description"))
-    }
+    # Only ids travel through the result backend; the status views hydrate the rows.
+    count, ids = ranked_ids(query)
+    return {"query": query, "count": count, "ids": ids}
 
 @shared_task
+@profile_task
 def run_network_emulation(video_id, traces, duration):
     r = redis.Redis.from_url(settings.REDIS_URL)
+    encode_version = Video.objects.filter(pk=video_id).values_list('encode_version', flat=True).first()
 
     job_ids = []
     for trace in traces:
@@ -39,6 +67,7 @@ def run_network_emulation(video_id, traces, duration):
             "video_id": video_id,
             "trace": trace,
             "duration": duration,
+            "encode_version": encode_version,
         }
 
         r.lpush("emulation_jobs", json.dumps(job))
@@ -46,178 +75,285 @@ def run_network_emulation(video_id, traces, duration):
     return {"job_ids": job_ids, "count": len(job_ids)}
 
 @shared_task
-def encode_video(video_id):
+@profile_task
+def flush_popularity_counters():
+    return {"updated": popularity.flush_counters()}
+
+@shared_task
+@profile_task
+def refresh_hot_set():
+    return popularity.refresh_hot_set()
+
+@shared_task
+@profile_task
+def ingest_experiment_results():
+    return {"ingested": drain_results(), "reclaimed": reclaim_orphaned_shards()}
+
+@shared_task
+@profile_task
+def collect_storage_garbage():
+    return storage_gc.collect_media()
+
+@shared_task
+@profile_task
+def collect_scratch_garbage():
+    return storage_gc.collect_scratch()
+
+@shared_task
+@profile_task
+def delete_storage_paths(paths):
+    return {"reclaimed_bytes": storage_gc.delete_paths(paths)}
+
+@shared_task
+@profile_task
+def advance_reencode_batches():
+    return {"admitted": advance_batches()}
+
+@shared_task
+@profile_task
+def admit_video_encode(video_id):
+    # Admission probes the source, which is too slow for the upload request.
+    job = admit_encode(video_id)
+    return {"job_id": job.pk if job else None}
+
+def _finish_encode_job(job_id, state, error=''):
+    if job_id is None:
+        return
+    EncodeJob.objects.filter(pk=job_id).update(state=state, error=error, finished_at=timezone.now())
+
+@shared_task
+@profile_task
+def encode_video(video_id, job_id=None, scratch_attempt=0):
+    from .scheduler import dispatch_pending
+
     with transaction.atomic():
         video = Video.objects.select_for_update().get(pk=video_id)
         if video.processing:
+            _finish_encode_job(job_id, EncodeJob.FAILED, 'Video is already being encoded')
+            transaction.on_commit(dispatch_pending)
             return
         video.processing = True
         video.save(update_fields=['processing'])
+        if job_id is not None:
+            EncodeJob.objects.filter(pk=job_id).update(state=EncodeJob.RUNNING, started_at=timezone.now())
     
+    scratch = None
     try:
         input_path = video.video.path
-        output_dir = f'/tmp/dash_{video_id}'
-        os.makedirs(output_dir, exist_ok=True)
         
-        probe_cmd = [
-            'ffprobe',
-            '-v', 'error',
-            '-show_entries', 'format=duration:stream=codec_type,width,height,codec_name',
-            '-of', 'json',
-            input_path
-        ]
-        probe_result = subprocess.run(probe_cmd, capture_output=True, text=True, check=True)
-        probe_data = json.loads(probe_result.stdout)
+        with encode_stage('probe'):
+            probe_data = probe_media(input_path)
 
-        duration = float(probe_data['format']['duration'])
+        duration = probed_duration(probe_data)
 
-        video_stream = next((s for s in probe_data['streams'] if s['codec_type'] == 'video'), None)
-        if not video_stream:
+        source_video = video_stream(probe_data)
+        if not source_video:
             raise RuntimeError("No video stream found in input file")
 
-        audio_stream = next((s for s in probe_data['streams'] if s.get('codec_type') == 'audio'), None)
-        has_audio = audio_stream is not None
+        has_audio = audio_stream(probe_data) is not None
         
-        source_width = int(video_stream.get('width', 1920))
-        source_height = int(video_stream.get('height', 1080))
+        source_width = int(source_video.get('width', 1920))
+        source_height = int(source_video.get('height', 1080))
                 
-        all_qualities = [
-            {'name': '360p', 'width': 640, 'height': 360, 'bitrate': '400k', 'maxrate': '500k'},
-            {'name': '480p', 'width': 854, 'height': 480, 'bitrate': '800k', 'maxrate': '1200k'},
-            {'name': '720p', 'width': 1280, 'height': 720, 'bitrate': '2000k', 'maxrate': '3000k'},
-            {'name': '1080p', 'width': 1920, 'height': 1080, 'bitrate': '4000k', 'maxrate': '6000k'},
-        ]
-
-        qualities = [q for q in all_qualities if q['height'] <= source_height]
+        qualities = select_qualities(source_width, source_height)
+        
+        segment_plan = (
+            settings.ENCODE_SEGMENT_DURATION,
+            settings.ENCODE_STARTUP_SEGMENT_DURATION,
+            settings.ENCODE_STARTUP_SEGMENTS,
+        )
+        gop_args = keyframe_args(frame_rate(source_video), *segment_plan)
         
-        if not qualities:
-            qualities = [{
-                'name': 'source',
-                'width': source_width,
-                'height': source_height,
-                'bitrate': '400k',
-                'maxrate': '500k'
-            }]
+        codecs = select_codecs(video.requested_codecs, duration, len(qualities), settings.ENCODE_CODEC_BUDGET)
+        
+        # Only starts with room for all of its outputs; see the ScratchSpaceBusy handler below.
+        scratch = ScratchSpace(
+            video_id,
+            estimate_scratch_bytes(duration or DEFAULT_DURATION, qualities, codecs, has_audio),
+        )
+        with encode_stage('scratch'):
+            output_dir = scratch.acquire()
         
         video_files = []
+        video_jobs = []
+        cpus = available_cpus()
         
-        for _, quality in enumerate(qualities):
-            video_output = os.path.join(output_dir, f'video_{quality["name"]}.webm')
-            
-            video_cmd = [
-                'ffmpeg',
-                '-i', input_path,
-                '-c:v', 'libvpx-vp9',
-                '-b:v', quality['bitrate'],
-                '-minrate', quality['bitrate'],
-                '-maxrate', quality['maxrate'],
-                '-crf', '31',
-                '-vf', f"scale={quality['width']}:{quality['height']}",
-                '-cpu-used', '2',
-                '-row-mt', '1',
-                '-tile-columns', '2',
-                '-g', '120',
-                '-keyint_min', '120',
-                '-sc_threshold', '0',
-                '-an',
-                '-f', 'webm',
-                '-y',
-                video_output
-            ]
-            
-            result = subprocess.run(video_cmd, capture_output=True, text=True)
+        for codec in codecs:
+            container = CODECS[codec]['container']
             
-            if result.returncode != 0:
-                raise subprocess.CalledProcessError(result.returncode, video_cmd, result.stdout, result.stderr)
-            
-            video_files.append(video_output)
-
-        audio_output = os.path.join(output_dir, 'audio.webm')
-        
-        if has_audio:
-            try:
-                audio_cmd = [
+            for idx, quality in enumerate(qualities):
+                rendition = f'{codec}_{quality["name"]}'
+                video_output = os.path.join(output_dir, f'video_{rendition}.{container}')
+                threads = rung_threads(quality['width'], quality['height'], cpus)
+                previews = codec == codecs[0] and idx == 0
+                budget = threads + PREVIEW_THREADS if previews else threads
+                
+                video_cmd = [
                     'ffmpeg',
+                    *input_thread_args(budget),
                     '-i', input_path,
-                    '-vn',
-                    '-c:a', 'libopus',
-                    '-b:a', '128k',
-                    '-ar', '48000',
-                    '-ac', '2',
-                    '-f', 'webm',
+                    *video_codec_args(codec, quality, threads, tile_columns(quality['width'], threads)),
+                    '-vf', f"scale={quality['width']}:{quality['height']}",
+                    *gop_args,
+                    '-an',
+                    '-f', container,
                     '-y',
-                    audio_output
+                    video_output
                 ]
                 
-                result = subprocess.run(audio_cmd, capture_output=True, text=True)
+                if previews:
+                    # Poster and seek-preview sprites reuse the decode of the first rung.
+                    video_cmd += preview_outputs(output_dir, duration, source_width, source_height)
                 
-                if result.returncode != 0:
-                    raise subprocess.CalledProcessError(result.returncode, audio_cmd, result.stdout, result.stderr)
-            except:
-                has_audio = False
+                video_jobs.append((f'video_{rendition}', video_cmd, budget))
+                video_files.append((rendition, container, video_output))
+        
+        # Rungs are encoded side by side, packed so their threads fill but do not exceed the cores.
+        run_packed(video_jobs, cpus)
+
+        write_thumbnails_vtt(output_dir, duration, source_width, source_height)
+
+        audio_files = []
+        
+        if has_audio:
+            for audio_codec in dict.fromkeys(CODECS[codec]['audio'] for codec in codecs):
+                container = AUDIO_CODECS[audio_codec]['container']
+                audio_output = os.path.join(output_dir, f'audio_{audio_codec}.{container}')
+                try:
+                    audio_cmd = [
+                        'ffmpeg',
+                        '-i', input_path,
+                        '-vn',
+                        *AUDIO_CODECS[audio_codec]['args'],
+                        '-ar', '48000',
+                        '-ac', '2',
+                        '-f', container,
+                        '-y',
+                        audio_output
+                    ]
+                    
+                    with encode_stage(f'audio_{audio_codec}'):
+                        result = subprocess.run(audio_cmd, capture_output=True, text=True)
+                    
+                    if result.returncode != 0:
+                        raise subprocess.CalledProcessError(result.returncode, audio_cmd, result.stdout, result.stderr)
+                    
+                    audio_files.append((audio_codec, container, audio_output))
+                except subprocess.CalledProcessError:
+                    continue
         
         manifest = 'manifest.mpd'
         
+        packaging = settings.ENCODE_PACKAGING
         packager_inputs = []
+        packaged_files = []
 
-        for idx, video_file in enumerate(video_files):
-            quality_name = qualities[idx]['name']
-            packager_inputs.append(
-                f'in={video_file},stream=video,init_segment={output_dir}/init_{quality_name}.webm,segment_template={output_dir}/seg_{quality_name}_$Number$.webm'
-            )
+        streams = [('video', rendition, container, path) for rendition, container, path in video_files]
+        streams += [('audio', f'audio_{codec}', container, path) for codec, container, path in audio_files]
 
-        if has_audio:
-            packager_inputs.append(
-                f'in={audio_output},stream=audio,init_segment={output_dir}/init_audio.webm,segment_template={output_dir}/seg_audio_$Number$.webm'
-            )
+        for stream, rendition, container, source_file in streams:
+            if packaging == ON_DEMAND:
+                # One mezzanine file per rendition; segments are byte ranges of it.
+                packaged = f'{output_dir}/{rendition}.{container}'
+                packaged_files.append(packaged)
+                packager_inputs.append(f'in={source_file},stream={stream},output={packaged}')
+            else:
+                packager_inputs.append(
+                    f'in={source_file},stream={stream},init_segment={output_dir}/init_{rendition}.{container},segment_template={output_dir}/seg_{rendition}_$Number$.{container}'
+                )
 
         packager_cmd = [
             'packager',
             *packager_inputs,
             '--mpd_output', os.path.join(output_dir, manifest),
-            '--segment_duration', '4',
-            '--generate_static_live_mpd'
+            '--segment_duration', str(packager_segment_duration(*segment_plan)),
         ]
+        if packaging != ON_DEMAND:
+            packager_cmd.append('--generate_static_live_mpd')
 
-        result = subprocess.run(packager_cmd, capture_output=True, text=True)
+        with encode_stage('packager'):
+            result = subprocess.run(packager_cmd, capture_output=True, text=True)
 
         if result.returncode != 0:
             raise subprocess.CalledProcessError(result.returncode, packager_cmd, result.stdout, result.stderr)
 
-        dash_dir_name = f'dash/{video_id}'
-
-        manifest_path = os.path.join(output_dir, manifest)
-        with open(manifest_path, 'rb') as f:
-            video.dash_manifest.storage.save(
-                f'{dash_dir_name}/{manifest}',
-                ContentFile(f.read())
-            )
-
-        for file_name in os.listdir(output_dir):
-            if file_name == manifest:
-                continue
-            file_path = os.path.join(output_dir, file_name)
-            if os.path.isfile(file_path):
-                with open(file_path, 'rb') as f:
-                    video.dash_manifest.storage.save(
-                        f'{dash_dir_name}/{file_name}',
-                        ContentFile(f.read())
-                    )
+        for packaged in packaged_files:
+            write_index(packaged)
+
+        with open(os.path.join(output_dir, manifest)) as f:
+            renditions = manifest_renditions(f.read(), load_indices(output_dir) if packaging == ON_DEMAND else None)
+
+        # The encoder outputs are packager inputs only; the manifest never references them.
+        encoder_outputs = {path for _, _, _, path in streams}
+
+        # Each encode gets its own directory, so the previous one keeps being served until the
+        # save below swaps the video over to it.
+        dash_dir_name = video.dash_version_path(video.encode_version + 1)
+        shutil.rmtree(video.dash_manifest.storage.path(dash_dir_name), ignore_errors=True)
+
+        with encode_stage('upload'):
+            manifest_path = os.path.join(output_dir, manifest)
+            with open(manifest_path, 'rb') as f:
+                video.dash_manifest.storage.save(
+                    f'{dash_dir_name}/{manifest}',
+                    ContentFile(f.read())
+                )
+
+            for file_name in os.listdir(output_dir):
+                if file_name == manifest:
+                    continue
+                file_path = os.path.join(output_dir, file_name)
+                if os.path.isfile(file_path) and file_path not in encoder_outputs:
+                    with open(file_path, 'rb') as f:
+                        video.dash_manifest.storage.save(
+                            f'{dash_dir_name}/{file_name}',
+                            ContentFile(f.read())
+                        )
 
         video.dash_manifest.name = f'{dash_dir_name}/{manifest}'
+        video.poster.name = f'{dash_dir_name}/{POSTER_NAME}' if os.path.exists(os.path.join(output_dir, POSTER_NAME)) else None
+        video.thumbnails.name = f'{dash_dir_name}/{THUMBNAILS_VTT_NAME}'
         video.dash_base_path = dash_dir_name
+        video.packaging = packaging
+        video.renditions = renditions
+        video.encode_version += 1
         video.duration = duration
         video.dash_ready = True
-        video.processing = True
-        video.save(update_fields=['dash_manifest', 'dash_base_path', 'duration', 'dash_ready', 'processing'])
+        video.processing = False
+        video.save(update_fields=[
+            'dash_manifest', 'poster', 'thumbnails', 'dash_base_path', 'packaging', 'renditions', 'encode_version',
+            'duration', 'dash_ready', 'processing',
+        ])
 
-        shutil.rmtree(output_dir)
+        _finish_encode_job(job_id, EncodeJob.DONE)
                 
-    except subprocess.CalledProcessError as _:
+    except ScratchSpaceBusy as e:
         video.processing = False
         video.save(update_fields=['processing'])
+        # Holding the worker would not free any space, so the job keeps its slot and tries again later.
+        attempts = settings.ENCODE_SCRATCH_WAIT // settings.ENCODE_SCRATCH_RETRY_DELAY
+        if job_id is None or scratch_attempt >= attempts:
+            _finish_encode_job(job_id, EncodeJob.FAILED, str(e))
+            raise
+        logger.info("Video %s waits for scratch space (attempt %s of %s): %s", video_id, scratch_attempt + 1, attempts, e)
+        EncodeJob.objects.filter(pk=job_id).update(state=EncodeJob.DISPATCHED, dispatched_at=timezone.now())
+        encode_video.apply_async(
+            args=[video_id],
+            kwargs={'job_id': job_id, 'scratch_attempt': scratch_attempt + 1},
+            queue='video_encoding',
+            countdown=settings.ENCODE_SCRATCH_RETRY_DELAY,
+        )
+    except subprocess.CalledProcessError as e:
+        video.processing = False
+        video.save(update_fields=['processing'])
+        _finish_encode_job(job_id, EncodeJob.FAILED, e.stderr or str(e))
         raise
-    except Exception as _:
+    except Exception as e:
         video.processing = False
         video.save(update_fields=['processing'])
-        raise
\ No newline at end of file
+        _finish_encode_job(job_id, EncodeJob.FAILED, str(e))
+        raise
+    finally:
+        if scratch is not None:
+            scratch.release()
+        dispatch_pending()
\ No newline at end of file
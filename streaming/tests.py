@@ -1,3 +1,363 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+from unittest import mock
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from .beacons import BeaconError, STREAM_KEY, consume, entry_commands, parse_beacon
+from .experiment_results import FAILED_RESULTS_KEY, PROCESSING_RESULTS_KEY, RESULTS_KEY, drain_results
+from .forms import VideoForm
+from .live import read_growing_segment
+from .models import EncodeJob, UploadSession, Video
+from .packaging import group_segments
+from .scheduler import admit_encode
+from .scratch import ScratchSpaceBusy
+from .sweeps import _trace_files
+from .tasks import encode_video
+from .uploads import create_upload_session
 
-# Create your tests here.
+
+def _beacon(*samples):
+    return json.dumps({"video": 1, "session": "s", "samples": list(samples)})
+
+
+def _entry(samples):
+    return {b'v': b'1', b's': b's', b'd': json.dumps(samples).encode()}
+
+
+class ParseBeaconTests(SimpleTestCase):
+    def test_accepts_player_sample(self):
+        sample = {
+            "ts": 1700000000000, "first": True, "variant": {"height": 720, "codecs": "vp09.00.40.08"},
+            "bandwidth": 2500000, "stateHistory": [{"state": "playing", "duration": 8.0}],
+            "switchHistory": [{"timestamp": 1, "bandwidth": 2500000}], "playTime": 8, "droppedFrames": 0,
+        }
+        self.assertEqual(parse_beacon(_beacon(sample)), (1, "s", [sample]))
+
+    def test_rejects_malformed_samples(self):
+        for sample in (
+            {"variant": "abc"},
+            {"variant": {"height": "720"}},
+            {"stateHistory": [1]},
+            {"switchHistory": {"bandwidth": 1}},
+            {"switchHistory": [{"bandwidth": "fast"}]},
+            {"playTime": "8"},
+            {"droppedFrames": True},
+        ):
+            with self.subTest(sample=sample), self.assertRaises(BeaconError):
+                parse_beacon(_beacon(sample))
+
+    def test_rejects_non_finite_numbers(self):
+        with self.assertRaises(BeaconError):
+            parse_beacon('{"video": 1, "session": "s", "samples": [{"playTime": 1e400}]}')
+
+
+class ConsumeTests(SimpleTestCase):
+    def test_bad_entry_is_dropped_and_acknowledged(self):
+        good = {"ts": 1700000000000, "variant": {"height": 360}, "playTime": 9}
+        entries = [
+            (b'1-0', _entry([good, {"variant": "abc"}])),
+            (b'2-0', _entry([{"stateHistory": [1]}])),
+            (b'3-0', _entry([good])),
+        ]
+        r = mock.MagicMock()
+        r.xautoclaim.return_value = (b'0-0', entries, [])
+        pipe = r.pipeline.return_value
+
+        self.assertEqual(consume(r, 'c1'), 3)
+
+        pipe.xack.assert_called_once_with(STREAM_KEY, mock.ANY, b'1-0', b'2-0', b'3-0')
+        pipe.execute.assert_called_once()
+        # Only the good entry is aggregated; nothing of the half-valid first entry is queued.
+        self.assertEqual([c.args[1:] for c in pipe.hincrby.call_args_list if c.args[1] == 'samples'], [('samples', 1)])
+
+
+class BandwidthSampleTests(SimpleTestCase):
+    def _bandwidth_commands(self, estimate):
+        entry = _entry([{"playTime": 1, "estimatedBandwidth": estimate}])
+        entry.update({b'c': b'v1', b'n': b'n1'})
+        return [c for c in entry_commands(entry, 60) if c[1].startswith('qoe:bw:')]
+
+    def test_out_of_range_estimates_are_ignored(self):
+        for estimate in (float('inf'), 1e15, 0, True):
+            with self.subTest(estimate=estimate):
+                self.assertEqual(self._bandwidth_commands(estimate), [])
+
+    def test_shared_scopes_keep_one_sample_per_client(self):
+        commands = self._bandwidth_commands(3e6)
+        self.assertIn(('lpush', 'qoe:bw:client:v1', 3000000), commands)
+        self.assertEqual(
+            [c[:3] for c in commands if c[0] == 'zadd'],
+            [('zadd', 'qoe:bw:network:n1', {'v1': mock.ANY}), ('zadd', 'qoe:bw:video:1', {'v1': mock.ANY})],
+        )
+
+
+class QoeBeaconViewTests(TestCase):
+    def test_logged_in_beacon_does_not_query_the_database(self):
+        self.client.force_login(User.objects.create_user('viewer'))
+        with mock.patch('streaming.views.append_beacon') as append, self.assertNumQueries(0):
+            response = self.client.post(reverse('qoe_beacon'), _beacon({"playTime": 1}), content_type='text/plain')
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(append.call_args.kwargs['client'].startswith('u'))
+
+
+class DetailedViewTests(TestCase):
+    def test_live_video_before_its_manifest_is_published(self):
+        video = Video.objects.create(title='Live', is_live=True)
+        response = self.client.get(reverse('detailed_view', args=[video.pk]))
+        self.assertContains(response, 'The stream is starting')
+
+
+@mock.patch('streaming.scheduler.dispatch_pending')
+class AdmitEncodeTests(TestCase):
+    def setUp(self):
+        self.video = Video.objects.create(title='Upload', video='videos/originals/upload.mp4')
+
+    def test_failed_job_is_admitted_again(self, _dispatch):
+        job = admit_encode(self.video.pk, probe=(60.0, 3))
+        self.assertIsNone(admit_encode(self.video.pk, probe=(60.0, 3)))
+
+        EncodeJob.objects.filter(pk=job.pk).update(state=EncodeJob.FAILED, error='Out of scratch space')
+        again = admit_encode(self.video.pk, probe=(60.0, 3))
+
+        self.assertEqual(again.pk, job.pk)
+        again.refresh_from_db()
+        self.assertEqual((again.state, again.error, again.finished_at), (EncodeJob.QUEUED, '', None))
+
+    def test_known_probe_skips_ffprobe(self, _dispatch):
+        with mock.patch('streaming.scheduler.probe_for_cost') as probe:
+            admit_encode(self.video.pk, probe=(60.0, 3))
+        probe.assert_not_called()
+
+
+@mock.patch('streaming.signals.admit_video_encode')
+class QueueVideoEncodingTests(TestCase):
+    def setUp(self):
+        with mock.patch('streaming.signals.admit_video_encode'):
+            self.video = Video.objects.create(title='Upload', video='videos/originals/upload.mp4')
+
+    def _save(self, video):
+        with self.captureOnCommitCallbacks(execute=True):
+            video.save()
+
+    def test_edit_of_other_fields_does_not_readmit(self, admit):
+        video = Video.objects.get(pk=self.video.pk)
+        video.title = 'Renamed'
+        self._save(video)
+        self._save(video)
+        admit.delay.assert_not_called()
+
+    def test_new_source_or_codecs_are_admitted(self, admit):
+        video = Video.objects.get(pk=self.video.pk)
+        video.codecs = ['av1']
+        self._save(video)
+        video.video = 'videos/originals/replaced.mp4'
+        self._save(video)
+        self.assertEqual(admit.delay.call_count, 2)
+
+
+@mock.patch('streaming.scheduler.dispatch_pending')
+@mock.patch('streaming.tasks.probe_media', return_value={
+    'format': {'duration': '60'},
+    'streams': [{'codec_type': 'video', 'width': 1280, 'height': 720, 'avg_frame_rate': '30/1'}],
+})
+@mock.patch('streaming.tasks.ScratchSpace.acquire', side_effect=ScratchSpaceBusy('full'))
+class EncodeScratchTests(TestCase):
+    def setUp(self):
+        self.video = Video.objects.create(title='Upload', video='videos/originals/upload.mp4')
+        self.job = EncodeJob.objects.create(video=self.video, dispatch_key='k', state=EncodeJob.DISPATCHED)
+
+    def test_busy_scratch_space_retries_later_without_failing(self, *_mocks):
+        with mock.patch.object(encode_video, 'apply_async') as apply_async:
+            encode_video(self.video.pk, job_id=self.job.pk)
+
+        self.job.refresh_from_db()
+        self.video.refresh_from_db()
+        self.assertEqual(self.job.state, EncodeJob.DISPATCHED)
+        self.assertFalse(self.video.processing)
+        self.assertEqual(apply_async.call_args.kwargs['kwargs'], {'job_id': self.job.pk, 'scratch_attempt': 1})
+        self.assertGreater(apply_async.call_args.kwargs['countdown'], 0)
+
+    def test_fails_once_out_of_attempts(self, *_mocks):
+        with mock.patch.object(encode_video, 'apply_async') as apply_async, self.assertRaises(ScratchSpaceBusy):
+            encode_video(self.video.pk, job_id=self.job.pk, scratch_attempt=100)
+
+        apply_async.assert_not_called()
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.state, EncodeJob.FAILED)
+
+
+class GroupSegmentsTests(SimpleTestCase):
+    def _segments(self, durations, timescale=1000):
+        segments, t, offset = [], 0, 0
+        for d in durations:
+            segments.append((t * timescale, d * timescale, offset, offset + 99))
+            t += d
+            offset += 100
+        return segments
+
+    def test_startup_head_is_kept_in_every_rendition(self):
+        video = self._segments([1, 1, 1] + [4] * 5)
+        audio = self._segments([1] * 23)
+        for segments in (video, audio):
+            with self.subTest(segments=len(segments)):
+                groups = group_segments(segments, 1000, 8, startup_duration=3)
+                self.assertEqual([d for _, d, _, _ in groups], [1000, 1000, 1000, 8000, 8000, 4000])
+
+
+class UploadChunkTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.user = User.objects.create_user('uploader')
+        self.client.force_login(self.user)
+
+    def test_negative_offset_is_rejected(self):
+        session = create_upload_session(self.user, 'clip.mp4', 100, 'Clip')
+        response = self.client.generic(
+            'PATCH', reverse('upload_detail', args=[session.id]), b'x' * 10,
+            content_type='application/offset+octet-stream', headers={'Upload-Offset': '-5'},
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_retry_takes_over_the_reservation_of_a_dead_worker(self):
+        session = create_upload_session(self.user, 'clip.mp4', 100, 'Clip')
+        UploadSession.objects.filter(pk=session.pk).update(chunks=[[0, 10, None]])
+        url = reverse('upload_detail', args=[session.id])
+        patch = dict(content_type='application/offset+octet-stream', headers={'Upload-Offset': '0'})
+
+        self.assertEqual(self.client.generic('PATCH', url, b'x' * 10, **patch).status_code, 200)
+        self.assertEqual(self.client.generic('PATCH', url, b'x' * 5, **patch).status_code, 409)
+        session.refresh_from_db()
+        self.assertEqual(session.offset, 10)
+        self.assertEqual(len(session.chunks), 1)
+
+    @override_settings(ENCODE_DEFAULT_CODECS=['vp9', 'h264', 'av1'])
+    def test_metadata_codecs_keep_configured_preference_order(self):
+        session = create_upload_session(self.user, 'clip.mp4', 100, 'Clip', codecs=['av1', 'h264', 'bogus', 'av1'])
+        self.assertEqual(session.codecs, ['h264', 'av1'])
+
+
+class GrowingSegmentTests(SimpleTestCase):
+    def test_bytes_follow_the_writer_until_the_segment_is_renamed(self):
+        with tempfile.TemporaryDirectory() as dash_dir:
+            final_path = os.path.join(dash_dir, 'chunk_0_00001.m4s')
+            with open(final_path + '.tmp', 'wb') as f:
+                f.write(b'moof')
+            chunks = read_growing_segment(final_path + '.tmp', stall_timeout=5, poll_interval=0)
+
+            self.assertEqual(next(chunks), b'moof')
+            with open(final_path + '.tmp', 'ab') as f:
+                f.write(b'mdat')
+            os.rename(final_path + '.tmp', final_path)
+            self.assertEqual(list(chunks), [b'mdat'])
+
+    def test_stalled_writer_ends_the_response(self):
+        with tempfile.NamedTemporaryFile(suffix='.m4s.tmp') as f:
+            f.write(b'moof')
+            f.flush()
+            self.assertEqual(list(read_growing_segment(f.name, stall_timeout=0, poll_interval=0)), [b'moof'])
+
+
+class TraceFilesTests(SimpleTestCase):
+    def test_single_trace_name(self):
+        with tempfile.TemporaryDirectory() as experiments:
+            os.makedirs(os.path.join(experiments, 'traces'))
+            for name in ('trace1.csv', 'trace2.csv'):
+                open(os.path.join(experiments, 'traces', name), 'w').close()
+            with override_settings(EXPERIMENTS_DIR=experiments):
+                self.assertEqual(_trace_files('trace1.csv'), ['trace1.csv'])
+                self.assertEqual(_trace_files('trace2'), ['trace2.csv'])
+                self.assertEqual(_trace_files('all'), ['trace1.csv', 'trace2.csv'])
+
+
+@override_settings(ENCODE_DEFAULT_CODECS=['vp9', 'h264', 'av1'])
+class CodecOrderTests(SimpleTestCase):
+    def test_form_keeps_configured_preference_order(self):
+        form = VideoForm()
+        form.cleaned_data = {"codecs": ['av1', 'h264', 'vp9']}
+        self.assertEqual(form.clean_codecs(), ['vp9', 'h264', 'av1'])
+
+
+class ManifestViewCountTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.video = Video.objects.create(title='Clip', dash_base_path='dash/1')
+        os.makedirs(os.path.join(media.name, 'dash', '1'))
+        with open(os.path.join(media.name, 'dash', '1', 'manifest.mpd'), 'w') as f:
+            f.write('<MPD/>')
+
+    def test_only_full_manifest_gets_are_views(self):
+        url = reverse('dash_file', args=[self.video.pk, 'manifest.mpd'])
+        with mock.patch('streaming.views.record_view') as record_view:
+            self.client.head(url)
+            self.client.get(url, headers={'Range': 'bytes=0-1'})
+            record_view.assert_not_called()
+            self.client.get(url)
+            record_view.assert_called_once()
+
+
+class _ListRedis:
+    """The few list commands drain_results uses"""
+
+    def __init__(self, **lists):
+        self.lists = {key: list(values) for key, values in lists.items()}
+
+    def _list(self, key):
+        return self.lists.setdefault(key, [])
+
+    def lpush(self, key, value):
+        self._list(key).insert(0, value)
+        return self
+
+    def rpush(self, key, value):
+        self._list(key).append(value)
+        return self
+
+    def lrem(self, key, count, value):
+        self._list(key).remove(value)
+        return self
+
+    def rpoplpush(self, source, destination):
+        if not self._list(source):
+            return None
+        value = self._list(source).pop()
+        self.lpush(destination, value)
+        return value
+
+    def pipeline(self):
+        return self
+
+    def execute(self):
+        pass
+
+
+class DrainResultsTests(TestCase):
+    def _drain(self, r):
+        with mock.patch('streaming.experiment_results.redis.Redis.from_url', return_value=r):
+            return drain_results()
+
+    def test_database_error_puts_the_result_back(self):
+        raw = json.dumps({"job_id": "j1", "out": "r.json", "video_id": 1, "trace": "t"})
+        r = _ListRedis(**{RESULTS_KEY: [raw]})
+        with mock.patch('streaming.experiment_results.ingest_result', side_effect=RuntimeError('db down')):
+            with self.assertRaises(RuntimeError):
+                self._drain(r)
+        self.assertEqual((r.lists[RESULTS_KEY], r.lists[PROCESSING_RESULTS_KEY]), ([raw], []))
+
+        with mock.patch('streaming.experiment_results.ingest_result') as ingest:
+            self.assertEqual(self._drain(r), 1)
+        ingest.assert_called_once()
+        self.assertEqual((r.lists[RESULTS_KEY], r.lists[PROCESSING_RESULTS_KEY]), ([], []))
+
+    def test_result_of_a_dead_drain_is_ingested(self):
+        raw = json.dumps({"job_id": "j1", "out": "r.json", "video_id": 1, "trace": "t"})
+        r = _ListRedis(**{PROCESSING_RESULTS_KEY: [raw], RESULTS_KEY: ['not json']})
+        with mock.patch('streaming.experiment_results.ingest_result') as ingest:
+            self.assertEqual(self._drain(r), 1)
+        ingest.assert_called_once()
+        self.assertEqual(r.lists[FAILED_RESULTS_KEY], ['not json'])
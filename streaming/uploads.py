@@ -0,0 +1,251 @@
+import base64
+import hashlib
+import os
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from .media import CODECS, ProbeError, in_preference_order, probe_media, probed_duration, video_stream
+from .models import ALLOWED_VIDEO_EXTENSIONS, UploadSession, Video
+
+READ_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def parse_upload_metadata(header):
+    """Decode a tus Upload-Metadata header ("key base64value,key base64value")"""
+    metadata = {}
+    for pair in filter(None, (p.strip() for p in header.split(","))):
+        key, _, value = pair.partition(" ")
+        try:
+            metadata[key] = base64.b64decode(value).decode("utf-8") if value else ""
+        except (ValueError, UnicodeDecodeError):
+            raise UploadError(f"Invalid Upload-Metadata value for '{key}'")
+    return metadata
+
+
+def parse_upload_checksum(header):
+    """Return the expected sha256 hex digest from a tus Upload-Checksum header, if any"""
+    if not header:
+        return None
+    algorithm, _, value = header.partition(" ")
+    if algorithm.lower() != "sha256":
+        raise UploadError(f"Unsupported checksum algorithm '{algorithm}'", status=400)
+    try:
+        return base64.b64decode(value).hex()
+    except ValueError:
+        raise UploadError("Invalid Upload-Checksum value")
+
+
+def create_upload_session(user, filename, length, title, description="", codecs=None):
+    filename = os.path.basename(filename or "")
+    ext = os.path.splitext(filename)[1].lower()
+    if ext not in ALLOWED_VIDEO_EXTENSIONS:
+        raise UploadError("Only video files are allowed (mp4, mov, avi, mkv, webm).")
+    if length <= 0:
+        raise UploadError("Upload-Length must be positive")
+    if length > settings.UPLOAD_MAX_SIZE:
+        raise UploadError("Upload exceeds the maximum allowed size", status=413)
+    if not title:
+        raise UploadError("A title is required")
+
+    codecs = in_preference_order([c for c in dict.fromkeys(codecs or []) if c in CODECS], settings.ENCODE_DEFAULT_CODECS)
+
+    session = UploadSession(
+        user=user,
+        title=title[:100],
+        description=description,
+        filename=filename,
+        length=length,
+        codecs=codecs,
+    )
+    session.path = f"videos/originals/{session.id.hex}_{default_storage.get_valid_name(filename)}"
+
+    full_path = default_storage.path(session.path)
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+
+    # Chunks are written in place at their offset, so the final file is
+    # allocated (sparsely) up front and never copied afterwards.
+    with open(full_path, "wb") as f:
+        f.truncate(length)
+
+    session.save()
+    return session
+
+
+def _overlaps(chunks, start, end):
+    return any(start < c_end and c_start < end for c_start, c_end, _ in chunks)
+
+
+def _reserve_chunk(session_id, start, end):
+    with transaction.atomic():
+        session = UploadSession.objects.select_for_update().get(pk=session_id)
+        if session.is_failed:
+            raise UploadError(session.error, status=410)
+        if session.video_id:
+            raise UploadError("Upload already completed", status=409)
+        if end > session.length:
+            raise UploadError("Chunk extends past Upload-Length", status=409)
+
+        for c_start, c_end, c_digest in session.chunks:
+            if (c_start, c_end) == (start, end) and c_digest is not None:
+                # Retry of a chunk that already landed.
+                return session, False
+        # A retry of the same range takes over its reservation: the worker that made it may
+        # have died mid-chunk, which would otherwise leave the range reserved for good.
+        others = [c for c in session.chunks if (c[0], c[1]) != (start, end)]
+        if _overlaps(others, start, end):
+            raise UploadError("Chunk overlaps a range that was already received", status=409)
+
+        session.chunks = others + [[start, end, None]]
+        session.save(update_fields=["chunks", "updated_at"])
+        return session, True
+
+
+def _release_chunk(session_id, start, end, digest=None):
+    with transaction.atomic():
+        session = UploadSession.objects.select_for_update().get(pk=session_id)
+        if digest is not None:
+            session.chunks = [c for c in session.chunks if (c[0], c[1]) != (start, end)]
+            session.chunks.append([start, end, digest])
+        else:
+            # A failed attempt leaves a chunk that a retry has meanwhile written in place.
+            session.chunks = [c for c in session.chunks if (c[0], c[1], c[2]) != (start, end, None)]
+        session.save(update_fields=["chunks", "updated_at"])
+        return session
+
+
+def write_chunk(session, start, length, stream, expected_digest=None):
+    """Stream one chunk from the request body into its final position on disk"""
+    if length <= 0:
+        raise UploadError("Chunk is empty")
+    if length > settings.UPLOAD_CHUNK_MAX_SIZE:
+        raise UploadError("Chunk exceeds the maximum chunk size", status=413)
+
+    if start < 0:
+        raise UploadError("Upload-Offset must not be negative")
+
+    end = start + length
+    session, reserved = _reserve_chunk(session.pk, start, end)
+    if not reserved:
+        return session
+
+    hasher = hashlib.sha256()
+    written = 0
+    try:
+        with open(default_storage.path(session.path), "r+b") as f:
+            f.seek(start)
+            while written < length:
+                data = stream.read(min(READ_SIZE, length - written))
+                if not data:
+                    break
+                f.write(data)
+                hasher.update(data)
+                written += len(data)
+    except Exception:
+        _release_chunk(session.pk, start, end)
+        raise
+
+    if written != length:
+        _release_chunk(session.pk, start, end)
+        raise UploadError(f"Expected {length} bytes but received {written}")
+
+    digest = hasher.hexdigest()
+    if expected_digest is not None and digest != expected_digest:
+        _release_chunk(session.pk, start, end)
+        raise UploadError("Checksum mismatch", status=460)
+
+    return _release_chunk(session.pk, start, end, digest)
+
+
+def upload_digest(session):
+    """sha256 over the ordered chunk digests, computed without re-reading the file
+
+    This identifies one upload, not the file's content: the same file sent in different chunk
+    sizes gets a different digest, so it must not be used to find duplicate uploads.
+    """
+    hasher = hashlib.sha256()
+    for _, _, digest in sorted(session.chunks):
+        hasher.update(bytes.fromhex(digest))
+    return hasher.hexdigest()
+
+
+def _fail(session, message):
+    with transaction.atomic():
+        session = UploadSession.objects.select_for_update().get(pk=session.pk)
+        session.error = message
+        session.save(update_fields=["error", "updated_at"])
+    default_storage.delete(session.path)
+    return session
+
+
+def _probe(session):
+    try:
+        probe_data = probe_media(default_storage.path(session.path), timeout=settings.UPLOAD_PROBE_TIMEOUT)
+    except ProbeError as e:
+        return None, str(e)
+    if not video_stream(probe_data):
+        return None, "No video stream found in input file"
+    return probe_data, None
+
+
+def probe_upload_header(session):
+    """Validate the upload with ffprobe as soon as the header bytes are in.
+
+    Containers that keep their index at the end of the file (mp4 without
+    faststart) cannot be probed from a prefix; those are deferred until the
+    upload completes instead of being rejected.
+    """
+    if session.probe_state or session.is_failed:
+        return session
+    if session.offset < min(session.length, settings.UPLOAD_PROBE_BYTES):
+        return session
+
+    probe_data, error = _probe(session)
+    if probe_data is not None:
+        session.probe_state = "ok"
+        session.duration = probed_duration(probe_data)
+    elif "moov atom not found" in error and not session.is_complete:
+        session.probe_state = "deferred"
+    else:
+        return _fail(session, f"Not a valid video file: {error}")
+
+    UploadSession.objects.filter(pk=session.pk).update(
+        probe_state=session.probe_state,
+        duration=session.duration,
+    )
+    return session
+
+
+def finalize_upload(session):
+    """Turn a fully received upload into a Video row (which queues encoding)"""
+    if session.probe_state != "ok":
+        probe_data, error = _probe(session)
+        if probe_data is None:
+            return _fail(session, f"Not a valid video file: {error}")
+        session.probe_state = "ok"
+        session.duration = probed_duration(probe_data)
+
+    with transaction.atomic():
+        locked = UploadSession.objects.select_for_update().get(pk=session.pk)
+        if locked.video_id or locked.is_failed or not locked.is_complete:
+            return locked
+
+        video = Video.objects.create(
+            title=locked.title,
+            description=locked.description,
+            video=locked.path,
+            duration=session.duration,
+            upload_digest=upload_digest(locked),
+            uploaded_by=locked.user,
+            codecs=locked.codecs,
+        )
+        locked.video = video
+        locked.probe_state = session.probe_state
+        locked.duration = session.duration
+        locked.save(update_fields=["video", "probe_state", "duration", "updated_at"])
+        return locked
@@ -10,10 +10,24 @@ urlpatterns = [
     path("login/", views.login_view, name="login"),
     path("logout/", LogoutView.as_view(next_page="home"), name="logout"),
     path("upload/", views.upload_view, name="upload"),
+    path("uploads/", views.upload_create, name="upload_create"),
+    path("uploads/<uuid:upload_id>/", views.upload_detail, name="upload_detail"),
     path("search/", views.search, name="search"),
     path("detailed_view/<int:id>/", views.detailed_view, name="detailed_view"),
+    path("dash/<int:id>/<str:name>", views.dash_file, name="dash_file"),
+    path("dash/<int:id>/v<int:version>/<str:name>", views.dash_file, name="dash_version_file"),
+    path("status/", views.task_statuses, name="task_statuses"),
     path("status/<str:task_id>/", views.task_status, name="task_status"),
     path("experiments/start/", views.start_emulation, name="start_emulation"),
+    path("experiments/qoe/", views.experiment_qoe, name="experiment_qoe"),
+    path("experiments/sweeps/", views.sweep_create, name="sweep_create"),
+    path("experiments/sweeps/<int:sweep_id>/", views.sweep_detail, name="sweep_detail"),
+    path("live/time/", views.live_time, name="live_time"),
+    path("qoe/beacons/", views.qoe_beacon, name="qoe_beacon"),
+    path("qoe/<int:video_id>/", views.qoe_realtime, name="qoe_realtime"),
+    path("metrics", views.metrics, name="metrics"),
+    path("profiles/", views.profiles, name="profiles"),
+    path("profiles/<str:name>", views.profile_download, name="profile_download"),
 ]
 
 if settings.DEBUG:
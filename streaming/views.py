@@ -3,13 +3,56 @@ from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
 from django.contrib.auth import login
 from .forms import VideoForm
 from .tasks import search_videos, run_network_emulation
-from .models import Video
-from django.http import JsonResponse
-from celery.result import AsyncResult
+from .metrics import render_metrics
+from .packaging import ON_DEMAND, load_indices, segment_list_manifest
+from .popularity import cached_segment, client_id, record_view, viewer_id
+from .profiling import list_profiles, make_profile_token, profile_path
+from .abr_hints import abr_hints
+from .beacons import BeaconError, append_beacon, network_key, parse_beacon, rolling_qoe
+from .experiment_results import GROUPINGS, aggregate_qoe
+from .live import read_growing_segment, wait_for_segment
+from .models import ExperimentRun, ExperimentSweep, Video, UploadSession
+from .scheduler import backlog_exceeded
+from .search import search_statuses
+from .sweeps import SweepError, start_sweep, sweep_progress
+from .uploads import (
+    UploadError,
+    create_upload_session,
+    finalize_upload,
+    parse_upload_checksum,
+    parse_upload_metadata,
+    probe_upload_header,
+    write_chunk,
+)
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
 from django.conf import settings
 import json
+import logging
+import mimetypes
+import os
+import re
+import redis
 from pathlib import Path
 
+logger = logging.getLogger(__name__)
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+RANGE_READ_SIZE = 64 * 1024
+DASH_CONTENT_TYPES = {
+    ".mpd": "application/dash+xml",
+    ".webm": "video/webm",
+    ".mp4": "video/mp4",
+    ".m4s": "video/iso.segment",
+    ".vtt": "text/vtt",
+}
+
 def home_view(request):
     return render (request, "home.html")
 
@@ -28,24 +71,17 @@ def search(request):
     })
 
 def task_status(_request, task_id):
-    task = AsyncResult(task_id)
+    return JsonResponse(search_statuses([task_id])[task_id])
 
-    if task.ready():
-        result = task.result
-
-        results = Video.objects.filter(
-            id__in=[r["id"] for r in result["results"]]
-        )
-
-        return JsonResponse({
-            "status": "completed",
-            "count": result["count"],
-            "results": list(results.values("id", "title", "description")),
-        })
-    else:
-        return JsonResponse({
-            "status": "pending",
-        })
+@require_http_methods(["GET"])
+def task_statuses(request):
+    """Status of many searches in one request: ?ids=<task id>,<task id>,..."""
+    task_ids = list(dict.fromkeys(i for i in request.GET.get("ids", "").split(",") if i))
+    if not task_ids:
+        return JsonResponse({"error": "No task ids provided"}, status=400)
+    if len(task_ids) > settings.SEARCH_STATUS_MAX_TASKS:
+        return JsonResponse({"error": f"At most {settings.SEARCH_STATUS_MAX_TASKS} task ids"}, status=400)
+    return JsonResponse({"tasks": search_statuses(task_ids)})
 
 def signup_view(request):
     if request.user.is_authenticated:
@@ -88,8 +124,17 @@ def upload_view(request):
         return redirect("home")
     
     if request.method == "POST":
+        if backlog_exceeded():
+            response = render(request, "upload.html", {
+                "form": VideoForm(request.POST),
+                "error": "The encoding queue is full, please try again later.",
+            }, status=503)
+            response["Retry-After"] = str(settings.ENCODE_BACKPRESSURE_RETRY_AFTER)
+            return response
+
         form = VideoForm(request.POST, request.FILES)
         if form.is_valid():
+            form.instance.uploaded_by = request.user
             form.save()
             return redirect("home")
     else:
@@ -100,6 +145,100 @@ def upload_view(request):
     }
     return render(request, "upload.html", context)
 
+TUS_VERSION = "1.0.0"
+
+def _upload_state(session, status=200):
+    if session.video_id:
+        location = reverse("detailed_view", args=[session.video_id])
+    else:
+        location = reverse("upload_detail", args=[session.id])
+
+    response = JsonResponse({
+        "id": str(session.id),
+        "offset": session.offset,
+        "length": session.length,
+        "chunks": [[start, end] for start, end, digest in sorted(session.chunks) if digest],
+        "probe_state": session.probe_state,
+        "error": session.error,
+        "video_id": session.video_id,
+        "location": location,
+    }, status=status)
+    response["Tus-Resumable"] = TUS_VERSION
+    response["Upload-Offset"] = str(session.offset)
+    response["Upload-Length"] = str(session.length)
+    response["Cache-Control"] = "no-store"
+    return response
+
+@require_http_methods(["POST"])
+def upload_create(request):
+    if not request.user.is_authenticated:
+        return JsonResponse({"error": "Authentication required"}, status=403)
+
+    if backlog_exceeded():
+        response = JsonResponse({"error": "The encoding queue is full, please try again later."}, status=503)
+        response["Retry-After"] = str(settings.ENCODE_BACKPRESSURE_RETRY_AFTER)
+        return response
+
+    try:
+        metadata = parse_upload_metadata(request.headers.get("Upload-Metadata", ""))
+        length = int(request.headers.get("Upload-Length", ""))
+    except ValueError:
+        return JsonResponse({"error": "Upload-Length header is required"}, status=400)
+    except UploadError as e:
+        return JsonResponse({"error": str(e)}, status=e.status)
+
+    try:
+        session = create_upload_session(
+            user=request.user,
+            filename=metadata.get("filename"),
+            length=length,
+            title=metadata.get("title", ""),
+            description=metadata.get("description", ""),
+            codecs=[c for c in metadata.get("codecs", "").split(",") if c],
+        )
+    except UploadError as e:
+        return JsonResponse({"error": str(e)}, status=e.status)
+
+    response = _upload_state(session, status=201)
+    response["Location"] = reverse("upload_detail", args=[session.id])
+    return response
+
+@require_http_methods(["HEAD", "GET", "PATCH"])
+def upload_detail(request, upload_id):
+    if not request.user.is_authenticated:
+        return JsonResponse({"error": "Authentication required"}, status=403)
+
+    session = get_object_or_404(UploadSession, id=upload_id, user=request.user)
+
+    if request.method != "PATCH":
+        return _upload_state(session)
+
+    if request.content_type != "application/offset+octet-stream":
+        return JsonResponse({"error": "Content-Type must be application/offset+octet-stream"}, status=415)
+
+    try:
+        start = int(request.headers.get("Upload-Offset", ""))
+        length = int(request.headers.get("Content-Length", ""))
+    except ValueError:
+        return JsonResponse({"error": "Upload-Offset and Content-Length headers are required"}, status=400)
+
+    try:
+        expected_digest = parse_upload_checksum(request.headers.get("Upload-Checksum"))
+        session = write_chunk(session, start, length, request, expected_digest)
+    except UploadError as e:
+        return JsonResponse({"error": str(e)}, status=e.status)
+
+    session = probe_upload_header(session)
+    if session.is_failed:
+        return JsonResponse({"error": session.error}, status=422)
+
+    if session.is_complete and not session.video_id:
+        session = finalize_upload(session)
+        if session.is_failed:
+            return JsonResponse({"error": session.error}, status=422)
+
+    return _upload_state(session)
+
 def detailed_view(request, id):
     video = get_object_or_404(Video, id=id)
     traces_dir = Path(settings.BASE_DIR) / "experiments" / "traces"
@@ -107,7 +246,9 @@ def detailed_view(request, id):
 
     context = {
         "video": video,
-        "trace_files": trace_files
+        "trace_files": trace_files,
+        "beacon_interval": settings.QOE_BEACON_INTERVAL,
+        "abr_hints": abr_hints(video, request),
     }
     return render(request, "detailed_view.html", context)
 
@@ -119,5 +260,248 @@ def start_emulation(request):
         traces=data.get("traces"),
         duration=data.get("duration", 60),
     )
-    print(data.get("traces"))
-    return JsonResponse({"task_id": task.id})
\ No newline at end of file
+    logger.debug("Queued network emulation for traces %s", data.get("traces"))
+    return JsonResponse({"task_id": task.id})
+
+@require_http_methods(["POST"])
+def sweep_create(request):
+    """Expand a videos x traces x configs x durations matrix into emulation jobs
+
+    Body: {"videos": [1, 2], "traces": ["oboe_trace_0"] or "all",
+           "configs": [{shaka player config}, ...], "durations": [30, 60]}
+    """
+    try:
+        spec = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({"error": "Invalid JSON"}, status=400)
+    if not isinstance(spec, dict):
+        return JsonResponse({"error": "Expected a JSON object"}, status=400)
+
+    try:
+        sweep, jobs = start_sweep(spec, request.user)
+    except SweepError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    response = sweep_progress(sweep)
+    response["status_url"] = reverse("sweep_detail", args=[sweep.pk])
+    return JsonResponse(response, status=201)
+
+@require_http_methods(["GET"])
+def sweep_detail(_request, sweep_id):
+    sweep = get_object_or_404(ExperimentSweep, pk=sweep_id)
+    return JsonResponse(sweep_progress(sweep))
+
+@require_http_methods(["GET"])
+def experiment_qoe(request):
+    """Aggregate QoE of ingested emulation runs; times are in milliseconds"""
+    group_by = request.GET.get("group_by", "video")
+    if group_by not in GROUPINGS:
+        return JsonResponse({"error": f"group_by must be one of {', '.join(GROUPINGS)}"}, status=400)
+
+    runs = ExperimentRun.objects.all()
+    try:
+        if request.GET.get("video"):
+            runs = runs.filter(video_id=int(request.GET["video"]))
+        if request.GET.get("encode_version"):
+            runs = runs.filter(encode_version=int(request.GET["encode_version"]))
+    except ValueError:
+        return JsonResponse({"error": "video and encode_version must be integers"}, status=400)
+    if request.GET.get("trace"):
+        runs = runs.filter(trace=request.GET["trace"])
+
+    return JsonResponse({
+        "group_by": group_by,
+        "groups": aggregate_qoe(runs, group_by),
+    })
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def qoe_beacon(request):
+    """Batched player stats from navigator.sendBeacon; appended to a Redis stream, never the database"""
+    try:
+        video_id, session, samples = parse_beacon(request.body)
+    except BeaconError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    try:
+        append_beacon(
+            video_id, session, samples,
+            client=client_id(request), network=network_key(request.META.get("REMOTE_ADDR", "")),
+        )
+    except redis.RedisError as e:
+        logger.warning("Could not queue QoE beacon: %s", e)
+        return HttpResponse(status=503)
+    return HttpResponse(status=204)
+
+@require_http_methods(["GET"])
+def qoe_realtime(request, video_id):
+    try:
+        minutes = int(request.GET.get("minutes", 15))
+    except ValueError:
+        return JsonResponse({"error": "minutes must be an integer"}, status=400)
+    minutes = max(1, min(minutes, settings.QOE_ROLLING_WINDOW))
+    return JsonResponse(rolling_qoe(video_id, minutes))
+
+def live_time(_request):
+    """xs:dateTime clock that live manifests reference for UTCTiming"""
+    now = timezone.now().isoformat(timespec="milliseconds").replace("+00:00", "Z")
+    response = HttpResponse(now, content_type="text/plain")
+    response["Cache-Control"] = "no-store"
+    response["Access-Control-Allow-Origin"] = "*"
+    return response
+
+def metrics(_request):
+    body, content_type = render_metrics()
+    return HttpResponse(body, content_type=content_type)
+
+@staff_member_required
+def profiles(_request):
+    return JsonResponse({
+        "header": settings.PROFILING_HEADER,
+        "token": make_profile_token(),
+        "profiles": list_profiles(),
+    })
+
+@staff_member_required
+def profile_download(_request, name):
+    path = profile_path(name)
+    if path is None:
+        raise Http404("Profile not found")
+    return FileResponse(open(path, "rb"), as_attachment=name.endswith(".prof"), filename=name)
+
+def _read_range(path, start, length):
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            data = f.read(min(RANGE_READ_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+def _parse_range(header, size):
+    """(start, end) of a single-range Range header, None without one, or False if unsatisfiable"""
+    match = RANGE_RE.match(header or "")
+    if not match or not any(match.groups()):
+        return None
+
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        start = max(size - int(last), 0)
+        end = size - 1
+
+    if start >= size or start > end:
+        return False
+    return start, end
+
+def _file_response(request, path, content_type, byte_range, cached=None):
+    """Serve a file or a byte range of it, from the pre-warmed copy when there is one"""
+    size = os.path.getsize(path)
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{size}"
+        return response
+
+    if byte_range is None:
+        if cached is not None:
+            response = HttpResponse(cached, content_type=content_type)
+        else:
+            response = FileResponse(open(path, "rb"), content_type=content_type)
+        response["Accept-Ranges"] = "bytes"
+        return response
+
+    start, end = byte_range
+    if cached is not None:
+        response = HttpResponse(cached, status=206, content_type=content_type)
+    else:
+        response = StreamingHttpResponse(
+            _read_range(path, start, end - start + 1), status=206, content_type=content_type
+        )
+    response["Content-Length"] = str(end - start + 1)
+    response["Content-Range"] = f"bytes {start}-{end}/{size}"
+    response["Accept-Ranges"] = "bytes"
+    return response
+
+def _live_segment_response(request, path, content_type):
+    """A live segment that ffmpeg has not finished yet. Low-latency players request it as soon as
+    its first chunk may exist (availabilityTimeOffset), so its bytes are streamed as they are
+    written rather than after the whole segment is on disk."""
+    found = wait_for_segment(path, settings.LIVE_SEGMENT_DURATION)
+    if found is None:
+        raise Http404("File not found")
+    if found == path:
+        return _file_response(request, path, content_type, None)
+    return StreamingHttpResponse(
+        read_growing_segment(found, stall_timeout=settings.LIVE_SEGMENT_DURATION), content_type=content_type
+    )
+
+def _segment_list_manifest(video, manifest_path, target_duration):
+    key = f"dash-manifest:{video.pk}:{os.path.dirname(manifest_path)}:{video.source_key}:{target_duration}"
+    body = cache.get(key)
+    if body is None:
+        startup_duration = settings.ENCODE_STARTUP_SEGMENTS * settings.ENCODE_STARTUP_SEGMENT_DURATION
+        with open(manifest_path) as f:
+            body = segment_list_manifest(
+                f.read(), load_indices(os.path.dirname(manifest_path)), target_duration, startup_duration
+            )
+        cache.set(key, body, settings.DASH_MANIFEST_CACHE_TIMEOUT)
+    return body
+
+def _record_manifest_view(request, video):
+    # A player loading the manifest is one view; HEAD requests and partial fetches are not.
+    if request.method == "GET" and "Range" not in request.headers:
+        record_view(video.pk, viewer_id(request))
+
+@require_http_methods(["GET", "HEAD"])
+def dash_file(request, id, name, version=None):
+    """Manifests, segments and single-file renditions of a packaged video, with byte-range support.
+
+    Versioned URLs serve one particular encode, so players keep getting the segments of the
+    manifest they loaded while a re-encode is swapped in; unversioned URLs serve the current one.
+    On-demand packaged videos take ?segment_duration=N on the manifest to get a SegmentList
+    manifest whose segments are ~N second byte ranges of each rendition.
+    """
+    video = get_object_or_404(Video, id=id)
+    current_path = video.dash_base_path or f"dash/{video.pk}"
+    base_path = video.dash_version_path(version) if version is not None else current_path
+    is_current = base_path == current_path
+    dash_dir = default_storage.path(base_path)
+    path = os.path.join(dash_dir, name)
+    ext = os.path.splitext(name)[1]
+    content_type = DASH_CONTENT_TYPES.get(ext) or mimetypes.guess_type(name)[0] or "application/octet-stream"
+    if name.startswith("."):
+        raise Http404("File not found")
+    if not os.path.isfile(path):
+        if video.is_live and ext == ".m4s" and os.path.isdir(dash_dir):
+            return _live_segment_response(request, path, content_type)
+        raise Http404("File not found")
+    segment_duration = request.GET.get("segment_duration")
+
+    if ext == ".mpd" and segment_duration and video.packaging == ON_DEMAND:
+        try:
+            target_duration = float(segment_duration)
+        except ValueError:
+            target_duration = None
+        if target_duration not in settings.DASH_SEGMENT_DURATIONS:
+            return JsonResponse({
+                "error": "Unsupported segment_duration",
+                "supported": settings.DASH_SEGMENT_DURATIONS,
+            }, status=400)
+        _record_manifest_view(request, video)
+        return HttpResponse(_segment_list_manifest(video, path, target_duration), content_type=content_type)
+
+    if ext == ".mpd":
+        if video.is_live:
+            response = _file_response(request, path, content_type, None)
+            response["Cache-Control"] = "no-cache"
+            return response
+        _record_manifest_view(request, video)
+
+    byte_range = _parse_range(request.headers.get("Range"), os.path.getsize(path))
+    cached = None
+    if ext != ".mpd" and byte_range is not False and not video.is_live and is_current:
+        cached = cached_segment(video, name, byte_range)
+    return _file_response(request, path, content_type, byte_range, cached)